@@ -58,11 +58,86 @@ class BaseConfig(object):
     CHUNK_SIZE=1000 # taille des chunks de doc pour FAISS 
     RAG_MIN_SCORE=0.75 #seuil min de pertinence pour repondre en RAG 0.7 
     RAG_MIN_SCORE_WORKFLOW=0.6
-    nb_chunks_to_use=1000
+    nb_chunks_to_use=100
     #on prend en compte les X meilleurs chunks  
     #et on check si > RAG_MIN_SCORE pour la reponse RAG avant prompt a mon model LLM, 5 à 10 pour gros LLM 7B
+    # (= k de la recherche FAISS : 50-100 suffit, le rerank ne travaille que sur ces candidats)
+    RAG_LOG_SAMPLE_RATE=0.0 # part des requetes dont les chunks retenus sont loggés (0 = aucun log par chunk)
+    RAG_LOG_TOP=5 # nb de chunks loggés par requete échantillonnée
+    # rerank cross-encoder optionnel des meilleurs candidats hybrides (None = désactivé)
+    RAG_CROSS_ENCODER = None # ex : op.join(RESSOURCES_DIR, "models/bge-reranker-base")
+    RAG_RERANK_TOP_N = 20 # candidats rerankés
+    RAG_RERANK_BATCH = 8 # paires par lot
+    RAG_RERANK_THREADS = 4 # lots en parallèle (CPU)
+    RAG_RERANK_BUDGET_MS = 400 # rerank sauté si le coût estimé dépasse ce budget (0 = pas de limite)
+    RAG_RERANK_CACHE_SIZE = 20000 # cache (requete, chunk) → score
+    # cache sémantique des réponses LLM (question proche + mêmes chunks => réponse immédiate)
+    RESPONSE_CACHE_SIZE = 512 # nb max de réponses (LRU, 0 = désactivé)
+    RESPONSE_CACHE_TTL = 3600 # secondes (0 = pas d'expiration)
+    RESPONSE_CACHE_MIN_SIM = 0.95 # similarité cosinus min entre questions
     
+    # type d'index FAISS par index : flat | ivf_flat | ivf_pq | hnsw (changement => rebuild)
+    # choisir via le rapport recall/latence : python -m ia.faiss.index_factory
+    FAISS_INDEX_MODE = {"general": "flat", "workflow": "flat"}
+    FAISS_NLIST=1024 # nb de listes IVF max (réduit automatiquement sur petit corpus)
+    FAISS_PQ_M=64 # sous-quantizers PQ (doit diviser 1024)
+    FAISS_HNSW_M=32
+    FAISS_HNSW_EF_CONSTRUCTION=200
+    FAISS_NPROBE=16 # persisté avec l'index
+    FAISS_EF_SEARCH=128 # persisté avec l'index
+    FAISS_TRAIN_SAMPLE=100000 # nb max de vecteurs pour l'entrainement IVF/PQ
+    # stockage des vecteurs dans l'index : float32 | float16 (RAM / 2) | int8 (RAM / 4) (changement => rebuild)
+    # float16 / int8 : vecteurs float32 gardés sur disque (mmap) pour le rescoring exact
+    FAISS_STORAGE = {"general": "float32", "workflow": "float32"}
+    FAISS_RESCORE_FACTOR=2 # candidats recherchés dans l'index compressé = top_k x facteur
+    # shards par famille de documents (dossier de l'archive / web) : general__factures, workflow__documentation_machines...
+    FAISS_SHARDING = True
+    FAISS_SHARD_WORKERS = 4 # recherche en parallèle sur les shards
+    ANOMALY_RAG_FAMILIES = ["documentation_machines"] # shards interrogés par l'analyse d'anomalies
+
+    QUERY_EMBED_CACHE_SIZE=4096 # cache LRU des embeddings de tokens / requetes (persistant entre requetes)
+    EMBED_CACHE_DIR = op.join(INDEX_FAISS, "embed_cache") # cache disque des embeddings de chunks (mmap)
+    EMBED_CACHE_MAX_MB = 4096 # au-delà : éviction des vecteurs les moins récemment utilisés
+
+    # pipeline d'indexation : extraction/chunking (process) -> embedding -> ajout index
+    INDEX_WORKERS = max(1, (os.cpu_count() or 2) - 1) # process d'extraction / chunking
+    INDEX_QUEUE_SIZE = 4 # nb de lots en attente entre deux étapes (mémoire bornée)
+    INDEX_BATCH_CHUNKS = 512 # chunks par lot d'embedding
+    INDEX_CHECKPOINT_CHUNKS = 20000 # chunks par écriture index + manifest (reprise après arrêt)
+
+    # crawler web (ressources RAG/web_ressources)
+    WEB_CRAWL_MODE = "auto" # auto (HTTP simple, Chromium si page vide) | http | browser
+    WEB_CRAWL_CONCURRENCY = 8 # requetes simultanées au total
+    WEB_CRAWL_PER_DOMAIN = 2 # requetes simultanées par domaine
+    WEB_BROWSER_PAGES = 4 # pages Chromium réutilisées (un seul navigateur partagé)
+    WEB_CRAWL_TIMEOUT = 60 # sec
+    
+    LLM_STREAM_ANOMALY = True # tokens des analyses d'anomalie émis en direct (Socket.IO "anomalie_stream")
     SERVER_TIMEOUT=200 # 200 sec par default
+    # ordonnanceur LLM (un seul modèle => un appel à la fois) : anomalie live > chat > rapport TRS
+    LLM_QUEUE_MAX = 32 # requetes en attente max (au-delà : HTTP 503)
+    LLM_TIMEOUTS = {"anomaly": 600, "chat": SERVER_TIMEOUT, "trs": 1800} # sec, attente + génération
+    # état KV llama.cpp des prompts système fixes (RAG, anomalie, TRS, schéma SQL) : seul le suffixe est évalué
+    LLM_PREFIX_CACHE = True
+    LLM_PREFIX_CACHE_SIZE = 8 # nb d'états gardés en RAM (taille ~ KV des tokens du préfixe)
+    # pool de process llama.cpp (GGUF en mmap, coeurs répartis entre workers) : 1 = modèle unique dans le process API
+    # choisir via le benchmark de charge : python -m ia.llm_pool
+    LLM_POOL_WORKERS = 1
+    LLM_POOL_HEALTH_S = 5 # intervalle des health checks (worker mort => redémarré)
+    # décodage spéculatif : petit GGUF de la même famille (même vocabulaire) qui propose les tokens, vérifiés par MODEL_NAME
+    # mesurer le gain via : python -m ia.speculative
+    LLM_DRAFT_MODEL = None # (désactive LLM_PREFIX_CACHE : logits_all) ex : op.join(RESSOURCES_DIR, "models/qwen2-0.5b/qwen2-0_5b-instruct-q8_0.gguf")
+    LLM_DRAFT_TOKENS = 8 # tokens proposés par passe
+    LLM_RECORD_PROMPTS = False # True : prompts d'anomalie enregistrés (rapport_llm_export/<jour>/anomaly/) pour le benchmark python -m ia.speculative
+    LLM_SEPARATE_PROCESS = False # True : inférence hors du process API REST / WebSocket (pool, même à 1 worker)
+    LLM_WARMUP = True # modèle chargé en tâche de fond au démarrage (sinon : à la première inférence)
+    # démon d'inférence partagé (GGUF + embedder chargés une fois) : python -m ia.inference_service
+    INFERENCE_REMOTE = False # True : app Flask / scheduler / scripts passent par le démon
+    INFERENCE_ADDRESS = "/tmp/ia_llm_inference.sock" if os.name != "nt" else "127.0.0.1:5055" # socket Unix ou host:port
+    # micro-batching des générations HF (transformers) : requêtes concurrentes décodées ensemble
+    # choisir via le benchmark : python -m ia.hf_batcher
+    HF_BATCH_MAX = 8 # séquences max par batch
+    HF_BATCH_WAIT_MS = 10 # fenêtre de collecte avant de lancer un batch
     
     #### WORKFLOW ####
     folder_workflow = op.join(RESSOURCES_DIR,"workflow") 
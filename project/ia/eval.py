@@ -1,9 +1,9 @@
-import torch
 import io
 from config import Config
 from PIL import Image
 from transformers import Blip2Processor, Blip2ForConditionalGeneration
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from concurrent.futures import TimeoutError
+from ia import hf_batcher, llm_scheduler
 import base64
 import ia.history_handler
 import ia.web_search_handler
@@ -97,30 +97,21 @@ def faiss_search(user_ip, query, model, tokenizer):
     """
 
    
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device) # important 
-   
-    def run_generation():
-        with torch.no_grad():
-            return model.generate(
-                **inputs,
-                max_new_tokens=Config.MAX_OUTPUT_TOKEN,
-                do_sample=False,
-                top_p=Config.TOP_P,   
-                top_k=Config.TOP_K, 
-                temperature=Config.TEMPERATURE,
-                repetition_penalty=1.08,
-                no_repeat_ngram_size=3
-            )
-
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(run_generation)
-        try:
-            output = future.result(timeout=Config.SERVER_TIMEOUT)  # timeout
-            decoded = tokenizer.decode(output[0], skip_special_tokens=True)
-            print("### result : " +decoded[len(prompt):].strip())
-            return decoded[len(prompt):].strip()
-        except TimeoutError:
-            return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"
+    try:
+        # décodé en batch avec les requêtes concurrentes (greedy)
+        result = hf_batcher.generate(
+            model, tokenizer, prompt,
+            max_new_tokens=Config.MAX_OUTPUT_TOKEN,
+            repetition_penalty=1.08,
+            no_repeat_ngram_size=3,
+            timeout=Config.SERVER_TIMEOUT
+        )
+        print("### result : " + result)
+        return result
+    except TimeoutError:
+        return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"
+    except llm_scheduler.QueueFull as e:
+        return str(e)
         
 
 def prompt_query(user_ip, query, model, tokenizer):
@@ -169,54 +160,36 @@ def prompt_query(user_ip, query, model, tokenizer):
     """
 
     
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device) # important 
-   
-    def run_generation():
-        with torch.no_grad():
-            return model.generate(
-                **inputs,
-                max_new_tokens=Config.MAX_OUTPUT_TOKEN,
-                do_sample=False,
-                repetition_penalty=1.08,
-                no_repeat_ngram_size=3,
-                top_p=Config.TOP_P,   
-                top_k=Config.TOP_K, 
-                temperature=Config.TEMPERATURE
-            )
-
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(run_generation)
-        try:
-            output = future.result(timeout=Config.SERVER_TIMEOUT)  # timeout
-            decoded = tokenizer.decode(output[0], skip_special_tokens=True)
-            print("### result : " +decoded[len(prompt):].strip())
-            return decoded[len(prompt):].strip()
-        except TimeoutError:
-            return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"
+    try:
+        # décodé en batch avec les requêtes concurrentes (greedy)
+        result = hf_batcher.generate(
+            model, tokenizer, prompt,
+            max_new_tokens=Config.MAX_OUTPUT_TOKEN,
+            repetition_penalty=1.08,
+            no_repeat_ngram_size=3,
+            timeout=Config.SERVER_TIMEOUT
+        )
+        print("### result : " + result)
+        return result
+    except TimeoutError:
+        return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"
+    except llm_scheduler.QueueFull as e:
+        return str(e)
         
         
 def eval_prompt(prompt, model, tokenizer, user_ip="sytem_workflow"):
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device) # important 
-   
-    def run_generation():
-        with torch.no_grad():
-            return model.generate(
-                **inputs,
-                max_new_tokens=Config.MAX_OUTPUT_TOKEN,
-                do_sample=False,
-                top_p=Config.TOP_P,   
-                top_k=Config.TOP_K, 
-                temperature=Config.TEMPERATURE,
-                repetition_penalty=1.08,
-                no_repeat_ngram_size=3
-            )
-
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(run_generation)
-        try:
-            output = future.result(timeout=2000)  # timeout
-            decoded = tokenizer.decode(output[0], skip_special_tokens=True)
-            print("### result : " +decoded[len(prompt):].strip())
-            return decoded[len(prompt):].strip()
-        except TimeoutError:
-            return f"⏱️ La génération a dépassé le délai imparti ({2000} sec)"
+    try:
+        # décodé en batch avec les requêtes concurrentes (greedy)
+        result = hf_batcher.generate(
+            model, tokenizer, prompt,
+            max_new_tokens=Config.MAX_OUTPUT_TOKEN,
+            repetition_penalty=1.08,
+            no_repeat_ngram_size=3,
+            timeout=2000
+        )
+        print("### result : " + result)
+        return result
+    except TimeoutError:
+        return f"⏱️ La génération a dépassé le délai imparti ({2000} sec)"
+    except llm_scheduler.QueueFull as e:
+        return str(e)
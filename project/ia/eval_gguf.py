@@ -1,14 +1,15 @@
 import io
 import base64
 from PIL import Image
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from concurrent.futures import TimeoutError
 
 from config import Config
 from ia.faiss.faiss_handler import retrieve
 from ia.history_handler import filter_relevant_history, add_user_query
+from ia import response_cache, llm_stream, llm_scheduler, prefix_cache, inference_service
 from ia.web_search_handler import searchWeb
 
-from ia.generate_repport import repportLLM
+from ia.generate_repport import repportLLM, save_prompt
 from ia.generate_repport_trs import  repportLLM_TRS
 from config import Config
 from ia.faiss.faiss_handler import retrieve
@@ -29,12 +30,68 @@ def build_chat_prompt(system, user):
 """
 
 
+def chat_prompt_prefix(system):
+    # partie statique de build_chat_prompt() : tout ce qui précède le message utilisateur
+    return build_chat_prompt(system, prefix_cache.SENTINEL).split(prefix_cache.SENTINEL)[0]
+
+
+# =========================================================
+# PROMPTS SYSTÈME FIXES (état KV mis en cache, voir prefix_cache)
+# =========================================================
+RAG_SYSTEM_PROMPT = """Tu es un assistant français RAG.
+        Tu dois répondre UNIQUEMENT à partir du contexte fourni.
+        Aucune information extérieure ne doit être ajoutée.
+        Réponse factuelle, concise, directe.
+        """
+
+DIRECT_SYSTEM_PROMPT = """Tu es un assistant français.
+Tu dois répondre UNIQUEMENT à partir des éléments fournis.
+Réponse courte, précise, directe.
+"""
+
+ANOMALY_SYSTEM_PROMPT = """
+                    LANGUE DE SORTIE OBLIGATOIRE : FRANÇAIS UNIQUEMENT.
+
+                    INTERDICTION ABSOLUE :
+                    - Toute utilisation de mots, phrases ou expressions en anglais.
+                    - Toute sortie partiellement ou totalement en anglais est STRICTEMENT INTERDITE
+                    et sera considérée comme INVALIDE.
+
+                    RÈGLE DE CONFORMITÉ :
+                    - La réponse doit être intégralement rédigée en français.
+                    - Les termes techniques doivent être traduits ou explicités en français.
+                    - Aucun anglicisme, acronyme ou terme non traduit n’est autorisé.
+
+                    UTILISATION DE DOCUMENTATION TECHNIQUE :
+                    - Si la réponse s’appuie sur une documentation technique disponible,
+                    tu DOIS obligatoirement le préciser explicitement sous la forme suivante :
+
+                    « Selon la documentation technique de référence : [nom du document] »
+
+                    Toute réponse ne respectant pas strictement ces règles est considérée comme NON CONFORME.
+
+                """
+
+TRS_SYSTEM_PROMPT = """
+                    LANGUE DE SORTIE OBLIGATOIRE : FRANÇAIS UNIQUEMENT.
+                    INTERDICTION ABSOLUE :
+                    - anglais
+                    TOUTE SORTIE CONTENANT DE L’ANGLAIS EST CONSIDÉRÉE COMME INVALIDE.
+                """
+
+
 # =========================================================
 # GGUF GENERATION
 # =========================================================
-def run_gguf_generation(model, prompt):
-    result = model(
+def run_gguf_generation(model, prompt, job=None, prefix=None):
+    # génération token par token : un job annulé (timeout) s'arrête au token suivant
+    if inference_service.remote_enabled():
+        model = inference_service.client()  # modèle chaud du démon d'inférence
+    tokens = llm_stream.stream_completion(
+        model,
         prompt,
+        job=job,
+        prefix=prefix,
         max_tokens=Config.MAX_OUTPUT_TOKEN,
         temperature=Config.TEMPERATURE,
         top_p=Config.TOP_P,
@@ -42,35 +99,36 @@ def run_gguf_generation(model, prompt):
         repeat_penalty=1.08,
         stop=["<|end|>"]
     )
-    return result["choices"][0]["text"].strip()
+    return llm_stream.collect(tokens).strip()
 
 
 # =========================================================
 # FAISS + RAG
 # =========================================================
-def faiss_search(user_ip, query, model, workeflow):
-    retrieved = retrieve(user_ip="none",query = query, workeflow = workeflow)
+def faiss_search(user_ip, query, model, workeflow, stream=False, stats=None):
+    """
+    Réponse RAG. stream=True : générateur de morceaux de texte (SSE), TTFT / total dans `stats`.
+    """
+    retrieved = retrieve(user_ip="none", query=query, workflow=bool(workeflow))
 
     if not retrieved:
         print("⚠️ Aucun chunk pertinent (score < threshold). Fallback vers LLM brut.")
-        return prompt_query(user_ip, query, model)
-
-    context = "\n\n".join([
-        f"Texte: {r['text']}...\n"
-        f"Chemin: {r['metadata'].get('path','inconnu')}\n"
-        f"Source: {r['metadata'].get('source','inconnu')}\n"
-        f"Page: {r['metadata'].get('page','?')}\n"
-        f"Score: {round(r.get('score', 0), 3)}"
-        for r in retrieved
-    ])
-
-    system_prompt = """Tu es un assistant français RAG.
-        Tu dois répondre UNIQUEMENT à partir du contexte fourni.
-        Aucune information extérieure ne doit être ajoutée.
-        Réponse factuelle, concise, directe.
-        """
+        return prompt_query(user_ip, query, model, stream=stream, stats=stats)
+
+    # même contexte (chunks récupérés) + question proche => réponse déjà générée
+    signature = ("faiss", model_signature(model), tuple(retrieved.chunk_ids()))
+
+    def build_prompt():
+        context = "\n\n".join([
+            f"Texte: {r['text']}...\n"
+            f"Chemin: {r['metadata'].get('path','inconnu')}\n"
+            f"Source: {r['metadata'].get('source','inconnu')}\n"
+            f"Page: {r['metadata'].get('page','?')}\n"
+            f"Score: {round(r.get('score', 0), 3)}"
+            for r in retrieved
+        ])
 
-    user_prompt = f"""=== Contexte ===
+        user_prompt = f"""=== Contexte ===
 {context}
 
 === Question ===
@@ -83,41 +141,34 @@ Règles :
 - Pas d’explication
 """
 
-    prompt = build_chat_prompt(system_prompt, user_prompt)
+        return build_chat_prompt(RAG_SYSTEM_PROMPT, user_prompt)
 
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(run_gguf_generation, model, prompt)
-        try:
-            return future.result(timeout=Config.SERVER_TIMEOUT)
-        except TimeoutError:
-            return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"
+    return answer(query, model, signature, build_prompt, stream, stats, prefix=chat_prompt_prefix(RAG_SYSTEM_PROMPT))
 
 
 # =========================================================
 # PROMPT DIRECT (HISTORIQUE + WEB)
 # =========================================================
-def prompt_query(user_ip, query, model):
+def prompt_query(user_ip, query, model, stream=False, stats=None):
     history = filter_relevant_history(user_ip, query)
     add_user_query(user_ip, query)
 
-    history_text = ""
-    if history:
-        history_text = "\n".join([f"- {h}" for h in history])
+    signature = ("prompt", model_signature(model), tuple(history or ()))
 
-    web_results = searchWeb(query)
-    web_text = ""
-    if web_results:
-        web_text = "\n".join([
-            f"{r['title']} | {r['url']}\n{r.get('snippet','')}"
-            for r in web_results
-        ])
+    def build_prompt():
+        history_text = ""
+        if history:
+            history_text = "\n".join([f"- {h}" for h in history])
 
-    system_prompt = """Tu es un assistant français.
-Tu dois répondre UNIQUEMENT à partir des éléments fournis.
-Réponse courte, précise, directe.
-"""
+        web_results = searchWeb(query)
+        web_text = ""
+        if web_results:
+            web_text = "\n".join([
+                f"{r['title']} | {r['url']}\n{r.get('snippet','')}"
+                for r in web_results
+            ])
 
-    user_prompt = f"""
+        user_prompt = f"""
 Historique pertinent :
 {history_text if history_text else "Aucun"}
 
@@ -135,14 +186,76 @@ Règles strictes :
 - Pas de Markdown
 """
 
-    prompt = build_chat_prompt(system_prompt, user_prompt)
+        return build_chat_prompt(DIRECT_SYSTEM_PROMPT, user_prompt)
 
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(run_gguf_generation, model, prompt)
-        try:
-            return future.result(timeout=Config.SERVER_TIMEOUT)
-        except TimeoutError:
-            return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"
+    return answer(query, model, signature, build_prompt, stream, stats, prefix=chat_prompt_prefix(DIRECT_SYSTEM_PROMPT))
+
+
+# =========================================================
+# GÉNÉRATION (CACHE SÉMANTIQUE + STREAMING)
+# =========================================================
+def answer(query, model, signature, build_prompt, stream=False, stats=None, prefix=None):
+    """
+    build_prompt() n'est appelé qu'en cas de miss du cache (recherche web, contexte...).
+    prefix : début statique du prompt (état KV réutilisé, voir prefix_cache).
+    """
+    if stream:
+        return _answer_stream(query, model, signature, build_prompt, stats, prefix)
+
+    cached, query_vec = response_cache.lookup(query, signature)
+    if cached is not None:
+        print("⚡ Réponse servie depuis le cache sémantique")
+        return cached
+
+    result = generate_with_timeout(model, build_prompt(), prefix=prefix)
+    response_cache.store(query, signature, result, query_vec)
+    return result
+
+
+def _answer_stream(query, model, signature, build_prompt, stats=None, prefix=None):
+    stats = stats if stats is not None else llm_stream.new_stats()
+
+    cached, query_vec = response_cache.lookup(query, signature)
+    if cached is not None:
+        print("⚡ Réponse servie depuis le cache sémantique")
+        stats.update(ttft_ms=0.0, total_ms=0.0, tokens=1, cached=True)
+        yield cached
+        return
+
+    prompt = build_prompt()
+    parts = []
+    try:
+        for text in llm_scheduler.stream(
+            lambda job: llm_stream.stream_completion(model, prompt, stats, job=job, prefix=prefix),
+            priority="chat", name="chat_stream"
+        ):
+            parts.append(text)
+            yield text
+    except TimeoutError:
+        stats["timeout"] = True
+        yield "\n" + llm_stream.TIMEOUT_MESSAGE.format(Config.LLM_TIMEOUTS["chat"])
+    except llm_scheduler.QueueFull as e:
+        yield str(e)
+        return
+
+    # client déconnecté : on ne passe pas ici (GeneratorExit), rien n'est caché
+    if not stats["timeout"]:
+        response_cache.store(query, signature, "".join(parts).strip(), query_vec)
+
+
+def generate_with_timeout(model, prompt, priority="chat", timeout=None, prefix=None):
+    timeout = timeout or Config.LLM_TIMEOUTS[priority]
+    try:
+        return llm_scheduler.run(lambda job: run_gguf_generation(model, prompt, job, prefix), priority, timeout)
+    except TimeoutError:
+        return llm_stream.TIMEOUT_MESSAGE.format(timeout)
+    except llm_scheduler.QueueFull as e:
+        return str(e)
+
+
+def model_signature(model):
+    # réponses d'un autre modèle GGUF jamais resservies
+    return getattr(model, "model_path", None) or id(model)
 
 
 # =========================================================
@@ -152,20 +265,21 @@ def eval_prompt(prompt, model):
     system_prompt = "Tu es un assistant français."
     final_prompt = build_chat_prompt(system_prompt, prompt)
 
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(run_gguf_generation, model, final_prompt)
-        try:
-            return future.result(timeout=2000)
-        except TimeoutError:
-            return f"⏱️ La génération a dépassé le délai imparti (2000 sec)"
+    return generate_with_timeout(model, final_prompt, timeout=2000, prefix=chat_prompt_prefix(system_prompt))
 
 
 def eval_prompt_anomaly_gguf(
     system_prompt: str,
     user_prompt: str,
     model,
-    anomalie: dict
+    anomalie: dict,
+    on_token=None,
+    stats=None
 ):
+    """
+    on_token(texte) : callback de streaming (ex : émission Socket.IO), None = réponse en un bloc.
+    stats : TTFT / temps total du streaming (llm_stream.new_stats()).
+    """
     # ============================================================
     # RAG
     # ============================================================
@@ -180,7 +294,8 @@ def eval_prompt_anomaly_gguf(
     retrieved = retrieve(
         user_ip="none",
         query=query,
-        workflow=True
+        workflow=True,
+        families=Config.ANOMALY_RAG_FAMILIES
     )
 
     if retrieved:
@@ -239,35 +354,11 @@ FORMAT DE SORTIE STRICT
     # ============================================================
     print ("[RUN LLM] Wait Anomaly Result ")
     print(final_prompt)
-    output = model.create_chat_completion(
+    params = dict(
         messages=[
             {
                 "role": "system",
-                "content": (
-                    """
-                    LANGUE DE SORTIE OBLIGATOIRE : FRANÇAIS UNIQUEMENT.
-
-                    INTERDICTION ABSOLUE :
-                    - Toute utilisation de mots, phrases ou expressions en anglais.
-                    - Toute sortie partiellement ou totalement en anglais est STRICTEMENT INTERDITE
-                    et sera considérée comme INVALIDE.
-
-                    RÈGLE DE CONFORMITÉ :
-                    - La réponse doit être intégralement rédigée en français.
-                    - Les termes techniques doivent être traduits ou explicités en français.
-                    - Aucun anglicisme, acronyme ou terme non traduit n’est autorisé.
-
-                    UTILISATION DE DOCUMENTATION TECHNIQUE :
-                    - Si la réponse s’appuie sur une documentation technique disponible,
-                    tu DOIS obligatoirement le préciser explicitement sous la forme suivante :
-
-                    « Selon la documentation technique de référence : [nom du document] »
-
-                    Toute réponse ne respectant pas strictement ces règles est considérée comme NON CONFORME.
-
-                """
-                 
-                )
+                "content": ANOMALY_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -280,8 +371,13 @@ FORMAT DE SORTIE STRICT
         repeat_penalty=1.1,
         max_tokens=2500
     )
+    save_prompt(params["messages"], anomalie)
 
-    result = output["choices"][0]["message"]["content"].strip()
+    # on_token : chaque morceau est poussé au client (Socket.IO) dès sa génération
+    result = llm_scheduler.run(
+        lambda job: llm_stream.collect(llm_stream.stream_chat(model, stats=stats, job=job, cache_prefix=True, **params), on_token),
+        priority="anomaly", name="anomaly"
+    ).strip()
 
     if not result or len(result) < 50:
         raise RuntimeError("LLM output invalide ou vide (Anomaly)")
@@ -388,18 +484,11 @@ CONCLUSION FACTUELLE :
     # ============================================================
     print ("[RUN LLM] Wait TRS Result ")
 
-    output = model.create_chat_completion(
+    params = dict(
         messages=[
             {
                 "role": "system",
-                "content": (
-                    """
-                    LANGUE DE SORTIE OBLIGATOIRE : FRANÇAIS UNIQUEMENT.
-                    INTERDICTION ABSOLUE :
-                    - anglais
-                    TOUTE SORTIE CONTENANT DE L’ANGLAIS EST CONSIDÉRÉE COMME INVALIDE.
-                """
-                )
+                "content": TRS_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -413,7 +502,11 @@ CONCLUSION FACTUELLE :
         max_tokens=2500
     )
 
-    result = output["choices"][0]["message"]["content"].strip()
+    # rapport TRS : priorité la plus basse, passe après les anomalies live et le chat
+    result = llm_scheduler.run(
+        lambda job: llm_stream.collect(llm_stream.stream_chat(model, job=job, cache_prefix=True, **params)),
+        priority="trs", name="trs"
+    ).strip()
 
     if not result or len(result) < 50:
         raise RuntimeError("LLM output invalide ou vide (TRS)")
@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+
+# ============================================================
+# MANIFEST D'ARCHIVE : RÉINDEXATION INCRÉMENTALE
+# ============================================================
+# Un manifest par index FAISS :
+#   {path: {"size", "mtime_ns", "hash", "start", "end"}}
+# - (size, mtime) inchangés           → fichier non relu
+# - (size, mtime) changés, même hash  → seule la signature est mise à jour
+# - hash différent                    → chunks supprimés puis fichier réindexé
+# - absent du disque                  → chunks supprimés
+# start / end = plage d'ids du chunk store du document.
+
+VERSION = 1
+HASH_BLOCK = 1 << 20
+
+
+def file_signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def content_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {"version": VERSION, "files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != VERSION:
+        return {"version": VERSION, "files": {}}
+    return manifest
+
+
+def save_manifest(manifest, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def plan_reindex(manifest, root, paths):
+    """
+    Compare les fichiers présents sous `root` au manifest.
+    Retourne {"new", "changed", "deleted", "unchanged"} (listes de chemins)
+    et met à jour la signature des fichiers seulement "touchés".
+    """
+    files = manifest["files"]
+    root = os.path.normpath(root)
+    plan = {"new": [], "changed": [], "deleted": [], "unchanged": []}
+    hashes = {}
+
+    for path in paths:
+        size, mtime_ns = file_signature(path)
+        entry = files.get(path)
+
+        if entry is None:
+            plan["new"].append(path)
+            hashes[path] = content_hash(path)
+            continue
+
+        if entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            plan["unchanged"].append(path)
+            continue
+
+        digest = content_hash(path)
+        if digest == entry.get("hash"):
+            entry["size"], entry["mtime_ns"] = size, mtime_ns
+            plan["unchanged"].append(path)
+        else:
+            plan["changed"].append(path)
+            hashes[path] = digest
+
+    current = set(paths)
+    for path in list(files):
+        if path not in current and os.path.normpath(path).startswith(root + os.sep):
+            plan["deleted"].append(path)
+
+    plan["hashes"] = hashes
+    return plan
+
+
+def record_files(manifest, paths, hashes, ranges, errors=()):
+    """
+    Enregistre les fichiers (ré)indexés. Un fichier sans chunk est enregistré
+    quand même (start = end = None) pour ne pas être relu au prochain passage.
+    """
+    files = manifest["files"]
+    for path in paths:
+        size, mtime_ns = file_signature(path)
+        start, end = ranges.get(path, (None, None))
+        files[path] = {
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "hash": hashes.get(path) or content_hash(path),
+            "start": start,
+            "end": end,
+        }
+        if path in errors:
+            files[path]["error"] = True
+
+
+def forget_files(manifest, paths):
+    for path in paths:
+        manifest["files"].pop(path, None)
+
+
+def refresh_ranges(manifest, ranges):
+    """
+    Plages d'ids à jour (après une compaction les ids sont renumérotés).
+    """
+    for path, entry in manifest["files"].items():
+        entry["start"], entry["end"] = ranges.get(path, (None, None))
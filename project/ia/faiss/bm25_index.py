@@ -0,0 +1,148 @@
+import os
+import re
+import pickle
+from collections import Counter, defaultdict
+import numpy as np
+
+# ============================================================
+# INDEX BM25 PERSISTANT (CORPUS COMPLET)
+# ============================================================
+# - dictionnaire de termes → postings (doc ids int32, tf float32)
+# - longueurs de documents (doc id = position du chunk = id FAISS)
+# - IDF calculée sur tout le corpus (et non plus sur les 1000 candidats)
+# Mise à jour incrémentale : seuls les nouveaux chunks sont tokenisés.
+
+VERSION = 1
+K1 = 1.5
+B = 0.75
+
+TOKEN_RE = re.compile(r"\b[a-zA-Z0-9éèêàùôîç]+\b")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def new_bm25_index():
+    return {
+        "version": VERSION,
+        "postings": {},  # {term: (np.int32 doc_ids, np.float32 tfs)}
+        "doc_len": np.zeros(0, dtype=np.float32),
+    }
+
+
+def add_documents(bm25, chunks):
+    """
+    Ajoute `chunks` à la suite des documents existants (ids = ordre d'ajout).
+    """
+    start = len(bm25["doc_len"])
+    new_postings = defaultdict(lambda: ([], []))
+    lengths = np.zeros(len(chunks), dtype=np.float32)
+
+    for offset, text in enumerate(chunks):
+        tokens = tokenize(text)
+        lengths[offset] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            ids, tfs = new_postings[term]
+            ids.append(start + offset)
+            tfs.append(tf)
+
+    postings = bm25["postings"]
+    for term, (ids, tfs) in new_postings.items():
+        ids = np.asarray(ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        if term in postings:
+            old_ids, old_tfs = postings[term]
+            ids = np.concatenate([old_ids, ids])
+            tfs = np.concatenate([old_tfs, tfs])
+        postings[term] = (ids, tfs)
+
+    bm25["doc_len"] = np.concatenate([bm25["doc_len"], lengths])
+    return bm25
+
+
+def build_bm25_index(chunks):
+    return add_documents(new_bm25_index(), chunks)
+
+
+def _term_weights(bm25, term):
+    """
+    (doc_ids, score BM25 du terme) pour tous les documents qui le contiennent.
+    """
+    p = bm25["postings"].get(term)
+    if p is None:
+        return None, None
+
+    ids, tfs = p
+    doc_len = bm25["doc_len"]
+    n_docs = len(doc_len)
+    avgdl = float(doc_len.mean()) if n_docs else 1.0
+
+    # IDF non négative façon Lucene (log(1 + ...)), même pour un terme présent partout (pas BM25+ : pas de δ sur le TF)
+    df = len(ids)
+    idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+    denom = tfs + K1 * (1 - B + B * doc_len[ids] / (avgdl + 1e-10))
+    return ids, idf * tfs * (K1 + 1) / denom
+
+
+def get_scores(bm25, query_tokens, doc_ids):
+    """
+    Scores BM25 de `query_tokens` pour les documents `doc_ids` (ordre conservé).
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int32)
+    scores = np.zeros(len(doc_ids), dtype=np.float32)
+    if not len(doc_ids):
+        return scores
+
+    order = np.argsort(doc_ids)
+    sorted_ids = doc_ids[order]
+
+    for term in query_tokens:
+        ids, w = _term_weights(bm25, term)
+        if ids is None:
+            continue
+
+        pos = np.searchsorted(sorted_ids, ids)
+        pos = np.clip(pos, 0, len(sorted_ids) - 1)
+        hit = sorted_ids[pos] == ids
+        if hit.any():
+            np.add.at(scores, order[pos[hit]], w[hit])
+
+    return scores
+
+
+def search(bm25, query_tokens, k):
+    """
+    Top-k lexical sur tout le corpus : (doc_ids, scores) triés par score décroissant.
+    """
+    n_docs = len(bm25["doc_len"])
+    scores = np.zeros(n_docs, dtype=np.float32)
+
+    for term in query_tokens:
+        ids, w = _term_weights(bm25, term)
+        if ids is not None:
+            np.add.at(scores, ids, w)
+
+    k = min(k, n_docs)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), scores[:0]
+
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    top = top[scores[top] > 0]
+    return top, scores[top]
+
+
+def save_bm25_index(bm25, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(bm25, f)
+
+
+def load_bm25_index(path):
+    with open(path, "rb") as f:
+        bm25 = pickle.load(f)
+    if bm25.get("version") != VERSION:
+        return None
+    return bm25
@@ -0,0 +1,404 @@
+import os
+import json
+import shutil
+import time
+from collections.abc import Sequence
+import numpy as np
+
+# ============================================================
+# CHUNK STORE : TEXTES MMAP + METADATA COLONNAIRES
+# ============================================================
+# Remplace le pickle {"chunks": [...], "metadata": [...]} :
+# - texts.bin   : blob UTF-8 de tous les chunks (mmap)
+# - texts.idx   : table d'offsets int64 (start, length) par chunk
+# - type / source / path : colonnes int32 encodées par dictionnaire (*.codes + *.values)
+# - chunk.i32   : numéro du chunk dans son document
+# - extra.*     : autres clés metadata éventuelles (JSON, vide en général)
+# - deleted.i64 : ids supprimés (tombstones, compactés au prochain rebuild)
+# - vectors.f32 : (optionnel) vecteurs pleine précision (count, vector_dim) quand
+#                 l'index FAISS est compressé (float16 / int8) → rescoring exact
+# Le chargement ne désérialise rien : seuls les chunks demandés sont décodés.
+# Un ajout n'écrit que les nouvelles données (fichiers en append).
+#
+# Arborescence : <dir>/store.json → génération courante <dir>/gen_<ts>/
+# Une reconstruction complète écrit une nouvelle génération (compatible Windows :
+# aucun fichier encore mappé par un lecteur n'est réécrit).
+
+VERSION = 1
+DICT_COLUMNS = ("type", "source", "path")
+INT_COLUMNS = ("chunk",)
+OFFSET_DTYPE = np.int64
+CODE_DTYPE = np.int32
+
+
+def manifest_path(store_dir):
+    return os.path.join(store_dir, "store.json")
+
+
+def _read_manifest(store_dir):
+    path = manifest_path(store_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(store_dir, manifest):
+    path = manifest_path(store_dir)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def _memmap(path, dtype, count, shape_tail=()):
+    if count == 0 or not os.path.exists(path):
+        return np.zeros((0,) + shape_tail, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,) + shape_tail)
+
+
+def _read_values(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ----------------- Lecture -----------------
+class ChunkStore:
+
+    def __init__(self, store_dir):
+        manifest = _read_manifest(store_dir)
+        if manifest is None or manifest.get("version") != VERSION:
+            raise FileNotFoundError(f"Chunk store absent ou incompatible : {store_dir}")
+
+        self.store_dir = store_dir
+        self.count = manifest["count"]
+        self.gen_dir = os.path.join(store_dir, manifest["generation"])
+        g = self.gen_dir
+
+        self._texts_idx = _memmap(os.path.join(g, "texts.idx"), OFFSET_DTYPE, self.count, (2,))
+        self._texts = self._open_blob(os.path.join(g, "texts.bin"))
+        self._extra_idx = _memmap(os.path.join(g, "extra.idx"), OFFSET_DTYPE, self.count, (2,))
+        self._extra = self._open_blob(os.path.join(g, "extra.bin"))
+
+        self._codes = {
+            c: _memmap(os.path.join(g, f"{c}.codes"), CODE_DTYPE, self.count)
+            for c in DICT_COLUMNS
+        }
+        self._values = {c: _read_values(os.path.join(g, f"{c}.values")) for c in DICT_COLUMNS}
+        self._ints = {
+            c: _memmap(os.path.join(g, f"{c}.i32"), CODE_DTYPE, self.count)
+            for c in INT_COLUMNS
+        }
+
+        self.vector_dim = manifest.get("vector_dim")
+        self._vectors = None
+
+        self.deleted = np.zeros(self.count, dtype=bool)
+        n_deleted = manifest.get("deleted", 0)
+        if n_deleted:
+            ids = np.fromfile(os.path.join(g, "deleted.i64"), dtype=np.int64, count=n_deleted)
+            self.deleted[ids[ids < self.count]] = True
+
+        self.texts = ChunkTexts(self)
+        self.metadata = ChunkMetadata(self)
+
+    @staticmethod
+    def _open_blob(path):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return self.count
+
+    def vectors(self):
+        """
+        Vecteurs pleine précision (mmap, ligne = id), None si le store n'en a pas.
+        """
+        if not self.vector_dim:
+            return None
+        if self._vectors is None:
+            self._vectors = _memmap(
+                os.path.join(self.gen_dir, "vectors.f32"), np.float32, self.count, (self.vector_dim,)
+            )
+        return self._vectors
+
+    def text(self, i):
+        start, length = self._texts_idx[i]
+        return bytes(self._texts[start:start + length]).decode("utf-8")
+
+    def meta(self, i):
+        meta = {}
+        for c in DICT_COLUMNS:
+            code = int(self._codes[c][i])
+            if code >= 0:
+                meta[c] = self._values[c][code]
+        for c in INT_COLUMNS:
+            meta[c] = int(self._ints[c][i])
+
+        start, length = self._extra_idx[i]
+        if length:
+            meta.update(json.loads(bytes(self._extra[start:start + length]).decode("utf-8")))
+        return meta
+
+    def column(self, name):
+        """
+        Colonne complète (liste Python) sans reconstruire les dicts.
+        """
+        if name in INT_COLUMNS:
+            return self._ints[name].tolist()
+        values = self._values[name]
+        return [values[c] if c >= 0 else None for c in self._codes[name]]
+
+    def live_ids(self):
+        return np.flatnonzero(~self.deleted)
+
+    def distinct(self, name):
+        """
+        Valeurs distinctes d'une colonne dictionnaire parmi les chunks vivants
+        (ex : chemins déjà indexés).
+        """
+        used = np.unique(np.asarray(self._codes[name])[~self.deleted])
+        values = self._values[name]
+        return [values[c] for c in used if c >= 0]
+
+    def ids_for(self, name, wanted):
+        """
+        Ids des chunks vivants dont la colonne `name` vaut une des valeurs `wanted`.
+        """
+        wanted = set(wanted)
+        codes = [c for c, v in enumerate(self._values[name]) if v in wanted]
+        if not codes:
+            return np.zeros(0, dtype=np.int64)
+        mask = np.isin(np.asarray(self._codes[name]), codes) & ~self.deleted
+        return np.flatnonzero(mask)
+
+    def id_ranges(self, name):
+        """
+        {valeur: [premier id, dernier id + 1]} pour les chunks vivants.
+        """
+        codes = np.asarray(self._codes[name])
+        live = self.live_ids()
+        if not len(live):
+            return {}
+        live_codes = codes[live]
+        order = np.argsort(live_codes, kind="stable")
+        sorted_codes = live_codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        ends = np.r_[starts[1:], len(sorted_codes)]
+        values = self._values[name]
+        return {
+            values[sorted_codes[s]]: [int(live[order[s]]), int(live[order[e - 1]]) + 1]
+            for s, e in zip(starts, ends)
+            if sorted_codes[s] >= 0
+        }
+
+
+class ChunkTexts(Sequence):
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store.text(j) for j in range(*i.indices(len(self)))]
+        return self.store.text(int(i))
+
+
+class ChunkMetadata(Sequence):
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store.meta(j) for j in range(*i.indices(len(self)))]
+        return self.store.meta(int(i))
+
+    def distinct(self, name):
+        return self.store.distinct(name)
+
+
+def open_store(store_dir):
+    if _read_manifest(store_dir) is None:
+        return None
+    return ChunkStore(store_dir)
+
+
+# ----------------- Écriture -----------------
+def _truncate(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+
+def _blob_end(idx_path, count):
+    if count == 0:
+        return 0
+    with open(idx_path, "rb") as f:
+        f.seek((count - 1) * 2 * np.dtype(OFFSET_DTYPE).itemsize)
+        start, length = np.frombuffer(f.read(2 * np.dtype(OFFSET_DTYPE).itemsize), dtype=OFFSET_DTYPE)
+    return int(start + length)
+
+
+def _append_blob(gen_dir, name, count, payloads):
+    idx_path = os.path.join(gen_dir, f"{name}.idx")
+    bin_path = os.path.join(gen_dir, f"{name}.bin")
+
+    # un ajout interrompu laisse des octets au-delà de `count` : on les écarte
+    offset = _blob_end(idx_path, count)
+    _truncate(idx_path, count * 2 * np.dtype(OFFSET_DTYPE).itemsize)
+    _truncate(bin_path, offset)
+
+    table = np.zeros((len(payloads), 2), dtype=OFFSET_DTYPE)
+    with open(bin_path, "ab") as f:
+        for k, data in enumerate(payloads):
+            f.write(data)
+            table[k] = (offset, len(data))
+            offset += len(data)
+
+    with open(idx_path, "ab") as f:
+        f.write(table.tobytes())
+
+
+def _append_dict_column(gen_dir, name, count, values):
+    codes_path = os.path.join(gen_dir, f"{name}.codes")
+    values_path = os.path.join(gen_dir, f"{name}.values")
+
+    existing = _read_values(values_path)
+    known = {}
+    for code, v in enumerate(existing):
+        known.setdefault(json.dumps(v, ensure_ascii=False), code)
+    next_code = len(existing)
+
+    codes = np.empty(len(values), dtype=CODE_DTYPE)
+    new_lines = []
+    for k, v in enumerate(values):
+        if v is None:
+            codes[k] = -1
+            continue
+        key = json.dumps(v, ensure_ascii=False)
+        code = known.get(key)
+        if code is None:
+            code = next_code
+            next_code += 1
+            known[key] = code
+            new_lines.append(key)
+        codes[k] = code
+
+    if new_lines:
+        with open(values_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(new_lines) + "\n")
+
+    _truncate(codes_path, count * np.dtype(CODE_DTYPE).itemsize)
+    with open(codes_path, "ab") as f:
+        f.write(codes.tobytes())
+
+
+def _append_int_column(gen_dir, name, count, values):
+    path = os.path.join(gen_dir, f"{name}.i32")
+    _truncate(path, count * np.dtype(CODE_DTYPE).itemsize)
+    with open(path, "ab") as f:
+        f.write(np.asarray(values, dtype=CODE_DTYPE).tobytes())
+
+
+def _append_vectors(gen_dir, count, vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    path = os.path.join(gen_dir, "vectors.f32")
+    _truncate(path, count * vectors.shape[1] * 4)
+    with open(path, "ab") as f:
+        f.write(vectors.tobytes())
+
+
+def _append(gen_dir, count, chunks, metadata):
+    known_keys = set(DICT_COLUMNS) | set(INT_COLUMNS)
+
+    _append_blob(gen_dir, "texts", count, [c.encode("utf-8") for c in chunks])
+    _append_blob(gen_dir, "extra", count, [
+        json.dumps(extra, ensure_ascii=False).encode("utf-8") if extra else b""
+        for extra in ({k: v for k, v in m.items() if k not in known_keys} for m in metadata)
+    ])
+    for c in DICT_COLUMNS:
+        _append_dict_column(gen_dir, c, count, [m.get(c) for m in metadata])
+    for c in INT_COLUMNS:
+        _append_int_column(gen_dir, c, count, [int(m.get(c, 0)) for m in metadata])
+
+
+def append_to_store(store_dir, chunks, metadata, vectors=None):
+    """
+    Ajoute des chunks à la génération courante (création si absente).
+    Le manifest (count) est écrit en dernier : c'est lui qui valide l'ajout.
+    vectors : obligatoire si le store conserve les vecteurs pleine précision.
+    """
+    chunks, metadata = list(chunks), list(metadata)
+    manifest = _read_manifest(store_dir)
+    if manifest is None:
+        return create_store(store_dir, chunks, metadata, vectors)
+
+    gen_dir = os.path.join(store_dir, manifest["generation"])
+    if manifest.get("vector_dim"):
+        if vectors is None:
+            raise ValueError(f"Chunk store {store_dir} : vecteurs pleine précision requis pour l'ajout")
+        _append_vectors(gen_dir, manifest["count"], vectors)
+    _append(gen_dir, manifest["count"], chunks, metadata)
+
+    manifest["count"] += len(chunks)
+    _write_manifest(store_dir, manifest)
+    return manifest["count"]
+
+
+def delete_from_store(store_dir, ids):
+    """
+    Marque des chunks comme supprimés (tombstones) sans réécrire les données.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    manifest = _read_manifest(store_dir)
+    if manifest is None or not len(ids):
+        return 0
+
+    gen_dir = os.path.join(store_dir, manifest["generation"])
+    path = os.path.join(gen_dir, "deleted.i64")
+    n_deleted = manifest.get("deleted", 0)
+
+    _truncate(path, n_deleted * np.dtype(np.int64).itemsize)
+    with open(path, "ab") as f:
+        f.write(ids.tobytes())
+
+    manifest["deleted"] = n_deleted + len(ids)
+    _write_manifest(store_dir, manifest)
+    return len(ids)
+
+
+def create_store(store_dir, chunks, metadata, vectors=None):
+    """
+    Réécriture complète dans une nouvelle génération, puis bascule du manifest.
+    vectors : vecteurs pleine précision à conserver (index compressé), sinon None.
+    """
+    chunks, metadata = list(chunks), list(metadata)
+    os.makedirs(store_dir, exist_ok=True)
+
+    generation = f"gen_{time.time_ns()}"
+    gen_dir = os.path.join(store_dir, generation)
+    os.makedirs(gen_dir)
+
+    _append(gen_dir, 0, chunks, metadata)
+    manifest = {"version": VERSION, "generation": generation, "count": len(chunks)}
+    if vectors is not None:
+        _append_vectors(gen_dir, 0, vectors)
+        manifest["vector_dim"] = int(np.asarray(vectors).shape[1])
+    _write_manifest(store_dir, manifest)
+
+    # nettoyage best-effort des générations précédentes (peuvent être encore mappées)
+    for entry in os.listdir(store_dir):
+        if entry.startswith("gen_") and entry != generation:
+            shutil.rmtree(os.path.join(store_dir, entry), ignore_errors=True)
+
+    return len(chunks)
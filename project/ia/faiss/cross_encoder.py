@@ -0,0 +1,161 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sentence_transformers import CrossEncoder
+from config import Config
+
+# ============================================================
+# RERANK CROSS-ENCODER (OPTIONNEL)
+# ============================================================
+# Appliqué aux RAG_RERANK_TOP_N meilleurs candidats hybrides (FAISS + BM25) :
+# - modèle local (Config.RAG_CROSS_ENCODER, None = désactivé), CPU
+# - lots de RAG_RERANK_BATCH paires répartis sur RAG_RERANK_THREADS threads
+# - cache LRU (hash requête, hash chunk) → score : rien n'est recalculé
+#   pour une question déjà posée, même après un rebuild (clé = contenu du chunk)
+# - budget de latence : si le coût estimé des paires non cachées dépasse
+#   RAG_RERANK_BUDGET_MS, seuls les meilleurs candidats hybrides tenant dans le
+#   budget sont rerankés (le reste garde l'ordre hybride). Le coût par paire
+#   est une moyenne glissante hors premier appel (à froid) ; si même une paire
+#   dépasse le budget, une paire est rerankée tous les _PROBE_EVERY sauts pour
+#   remesurer (sinon l'estimation ne redescendrait jamais)
+
+_PROBE_EVERY = 20
+
+_lock = threading.Lock()
+_model = None
+_executor = None
+_cache = OrderedDict()
+_warm = False  # premier predict (à froid) exclu de la moyenne
+_skips = 0     # sauts consécutifs (budget < 1 paire)
+
+_metrics = {
+    "runs": 0,
+    "partial_budget": 0,
+    "skipped_budget": 0,
+    "pairs_scored": 0,
+    "cache_hits": 0,
+    "ms_per_pair": None,  # moyenne glissante, sert à l'estimation du budget
+    "last_ms": 0.0,
+}
+
+
+def enabled():
+    return bool(Config.RAG_CROSS_ENCODER)
+
+
+def _hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=12).digest()
+
+
+def query_hash(query):
+    return _hash(" ".join(query.lower().split()))
+
+
+def get_model():
+    global _model, _executor
+    if _model is None:
+        with _lock:
+            if _model is None:
+                t0 = time.perf_counter()
+                _executor = ThreadPoolExecutor(max_workers=Config.RAG_RERANK_THREADS)
+                _model = CrossEncoder(Config.RAG_CROSS_ENCODER, device="cpu")
+                print(f"✅ Cross-encoder chargé ({Config.RAG_CROSS_ENCODER}) en {time.perf_counter() - t0:.2f}s")
+    return _model
+
+
+def _predict(pairs):
+    model = get_model()
+    batch = Config.RAG_RERANK_BATCH
+    batches = [pairs[i:i + batch] for i in range(0, len(pairs), batch)]
+    if len(batches) == 1:
+        return np.asarray(model.predict(batches[0], batch_size=batch), dtype=np.float32)
+    parts = _executor.map(lambda b: model.predict(b, batch_size=batch), batches)
+    return np.concatenate([np.asarray(p, dtype=np.float32) for p in parts])
+
+
+def _budget_pairs(n_missing):
+    # nb de paires non cachées à scorer dans le budget, 0 = rerank sauté
+    global _skips
+    per_pair = _metrics["ms_per_pair"]
+    budget = Config.RAG_RERANK_BUDGET_MS
+    if not budget or per_pair is None:
+        return n_missing
+    allowed = min(n_missing, int(budget // per_pair))
+    if allowed:
+        _skips = 0
+        return allowed
+    _skips += 1
+    if _skips >= _PROBE_EVERY:
+        _skips = 0
+        return 1
+    return 0
+
+
+def rerank_scores(query, texts):
+    """
+    Scores cross-encoder des premiers textes de `texts` (ordre hybride) :
+    tous, ou le préfixe dont les paires non cachées tiennent dans le budget de latence.
+    None si aucune paire ne tient dans le budget.
+    """
+    global _warm
+    qh = query_hash(query)
+    keys = [(qh, _hash(t)) for t in texts]
+    scores = np.empty(len(texts), dtype=np.float32)
+
+    with _lock:
+        missing = []
+        for i, k in enumerate(keys):
+            s = _cache.get(k)
+            if s is None:
+                missing.append(i)
+            else:
+                _cache.move_to_end(k)
+                scores[i] = s
+        _metrics["cache_hits"] += len(texts) - len(missing)
+
+    if missing:
+        with _lock:
+            allowed = _budget_pairs(len(missing))
+        if not allowed:
+            _metrics["skipped_budget"] += 1
+            return None
+        if allowed < len(missing):
+            # préfixe : les candidats avant la première paire non cachée hors budget
+            _metrics["partial_budget"] += 1
+            scores = scores[:missing[allowed]]
+            missing = missing[:allowed]
+
+        get_model()  # chargement hors mesure (estimation du budget)
+        t0 = time.perf_counter()
+        new = _predict([(query, texts[i]) for i in missing])
+        dt = (time.perf_counter() - t0) * 1000
+
+        with _lock:
+            ms = dt / len(missing)
+            per_pair = _metrics["ms_per_pair"]
+            if _warm:
+                _metrics["ms_per_pair"] = ms if per_pair is None else 0.8 * per_pair + 0.2 * ms
+            _warm = True
+            _metrics["pairs_scored"] += len(missing)
+            _metrics["last_ms"] = round(dt, 2)
+            for i, s in zip(missing, new):
+                scores[i] = s
+                _cache[keys[i]] = float(s)
+            while len(_cache) > Config.RAG_RERANK_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    _metrics["runs"] += 1
+    return scores
+
+
+def get_metrics():
+    with _lock:
+        return {
+            "enabled": enabled(),
+            "model": Config.RAG_CROSS_ENCODER,
+            "cache_size": len(_cache),
+            **_metrics,
+        }
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import threading
+import numpy as np
+from config import Config
+
+# ============================================================
+# CACHE DISQUE DES EMBEDDINGS DE CHUNKS
+# ============================================================
+# Clé = (modèle, hash du texte du chunk) → vecteur brut du modèle (avant projection).
+# Un rebuild, un changement de type d'index ou un chunk présent dans les deux
+# index (general / workflow) ne repasse plus par l'encodeur.
+#
+# Un dossier par modèle : <EMBED_CACHE_DIR>/<hash modèle>/
+# - cache.json        : {version, model, dim, count, generation}  (écrit en dernier = commit)
+# - gen_<ts>/keys.bin : blake2b 16 octets par ligne
+# - gen_<ts>/vectors.f32 : float32 (count, dim), lu en mmap
+# - gen_<ts>/used.i64 : dernier accès par ligne (éviction LRU), écrit par points de
+#   contrôle (USED_FLUSH_S), à l'éviction et à l'arrêt du process, pas à chaque encode :
+#   un arrêt brutal ne perd que la fraîcheur LRU récente (lignes absentes = jamais utilisées)
+# Taille bornée (EMBED_CACHE_MAX_MB) : au-delà, seules les lignes les plus
+# récemment utilisées sont recopiées dans une nouvelle génération.
+# Un seul process écrivain (l'indexation), lecture mmap partout ailleurs.
+
+VERSION = 1
+KEY_BYTES = 16
+EVICT_TO = 0.8  # après éviction on garde 80% de la taille max
+USED_FLUSH_S = 60  # intervalle min entre deux écritures de used.i64
+
+_lock = threading.Lock()
+_caches = {}
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+
+def _model_dir(model_id):
+    key = hashlib.sha1(str(model_id).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(Config.EMBED_CACHE_DIR, key)
+
+
+class EmbeddingCache:
+
+    def __init__(self, model_id, cache_dir=None, max_mb=None):
+        self.model_id = str(model_id)
+        self.cache_dir = cache_dir or _model_dir(model_id)
+        self.max_mb = max_mb or Config.EMBED_CACHE_MAX_MB
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._used_dirty = False
+        self._used_saved_at = time.monotonic()
+        self._load()
+
+    # ----------------- Lecture -----------------
+    def _manifest_path(self):
+        return os.path.join(self.cache_dir, "cache.json")
+
+    def _load(self):
+        self.dim = None
+        self.count = 0
+        self.generation = None
+        self.rows = {}
+        self.used = np.zeros(0, dtype=np.int64)
+        self._vectors = None
+
+        path = self._manifest_path()
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != VERSION or manifest.get("model") != self.model_id:
+            return
+
+        self.dim = manifest["dim"]
+        self.count = manifest["count"]
+        self.generation = manifest["generation"]
+        g = self._gen_dir()
+
+        keys = np.fromfile(os.path.join(g, "keys.bin"), dtype=np.uint8, count=self.count * KEY_BYTES)
+        keys = keys.reshape(self.count, KEY_BYTES)
+        self.rows = {keys[i].tobytes(): i for i in range(self.count)}
+
+        used_path = os.path.join(g, "used.i64")
+        used = np.fromfile(used_path, dtype=np.int64) if os.path.exists(used_path) else np.zeros(0, np.int64)
+        self.used = np.zeros(self.count, dtype=np.int64)
+        self.used[:min(len(used), self.count)] = used[:self.count]
+
+    def _gen_dir(self):
+        return os.path.join(self.cache_dir, self.generation)
+
+    def vectors(self):
+        if self._vectors is None:
+            if self.count == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._vectors = np.memmap(
+                os.path.join(self._gen_dir(), "vectors.f32"),
+                dtype=np.float32, mode="r", shape=(self.count, self.dim)
+            )
+        return self._vectors
+
+    def max_rows(self):
+        return max(1, int(self.max_mb * 1e6 // (4 * self.dim)))
+
+    # ----------------- Écriture -----------------
+    def _write_manifest(self):
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": VERSION,
+                "model": self.model_id,
+                "dim": self.dim,
+                "count": self.count,
+                "generation": self.generation,
+            }, f)
+        os.replace(tmp, self._manifest_path())
+
+    def _append(self, keys, vectors):
+        if self.generation is None:
+            self.generation = f"gen_{time.time_ns()}"
+            os.makedirs(self._gen_dir(), exist_ok=True)
+        g = self._gen_dir()
+
+        # un ajout interrompu a pu laisser des octets au-delà de `count`
+        for name, row_bytes in (("keys.bin", KEY_BYTES), ("vectors.f32", 4 * self.dim)):
+            path = os.path.join(g, name)
+            if os.path.exists(path) and os.path.getsize(path) > self.count * row_bytes:
+                with open(path, "r+b") as f:
+                    f.truncate(self.count * row_bytes)
+
+        with open(os.path.join(g, "keys.bin"), "ab") as f:
+            f.write(b"".join(keys))
+        with open(os.path.join(g, "vectors.f32"), "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+        for i, k in enumerate(keys):
+            self.rows[k] = self.count + i
+        self.used = np.concatenate([self.used, np.full(len(keys), time.time_ns(), dtype=np.int64)])
+        self.count += len(keys)
+        self._vectors = None
+        self._write_manifest()
+
+    def _evict(self):
+        """
+        Recopie les lignes les plus récemment utilisées dans une nouvelle génération.
+        """
+        keep_n = int(self.max_rows() * EVICT_TO)
+        keep = np.sort(np.argsort(self.used, kind="stable")[-keep_n:])
+
+        vectors = np.asarray(self.vectors()[keep])
+        by_row = {row: key for key, row in self.rows.items()}
+        keys = [by_row[int(r)] for r in keep]
+        used = self.used[keep]
+
+        old_gen = self._gen_dir()
+        self._vectors = None
+        self.generation, self.count, self.rows = None, 0, {}
+        self.used = np.zeros(0, dtype=np.int64)
+        self._append(keys, vectors)
+        self.used = used
+        self._save_used()
+
+        shutil.rmtree(old_gen, ignore_errors=True)
+        print(f"🧹 Cache embeddings : {len(by_row) - keep_n} vecteurs évincés ({self.count} conservés)")
+
+    def _save_used(self):
+        path = os.path.join(self._gen_dir(), "used.i64")
+        self.used.tofile(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self._used_dirty = False
+        self._used_saved_at = time.monotonic()
+
+    def flush(self):
+        """
+        Écrit used.i64 si des accès ne sont pas encore persistés.
+        """
+        with self._lock:
+            if self._used_dirty and self.generation:
+                self._save_used()
+
+    # ----------------- API -----------------
+    def encode(self, texts, encode_fn):
+        """
+        Embeddings bruts de `texts` : lus dans le cache, encode_fn(textes manquants) sinon.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        keys = [text_hash(t) for t in texts]
+
+        with self._lock:
+            rows = np.array([self.rows.get(k, -1) for k in keys], dtype=np.int64)
+            missing = {}
+            for i in np.flatnonzero(rows < 0):
+                missing.setdefault(keys[i], i)
+
+            self.hits += int((rows >= 0).sum())
+            self.misses += len(missing)
+
+            if missing:
+                new_vectors = np.asarray(encode_fn([texts[i] for i in missing.values()]), dtype=np.float32)
+
+                if self.dim != new_vectors.shape[1]:
+                    # premier ajout, ou modèle remplacé au même chemin : cache repris à zéro
+                    if self.generation:
+                        shutil.rmtree(self._gen_dir(), ignore_errors=True)
+                    self.generation, self.count, self.rows, self._vectors = None, 0, {}, None
+                    self.used = np.zeros(0, dtype=np.int64)
+                    self.dim = new_vectors.shape[1]
+                    os.makedirs(self.cache_dir, exist_ok=True)
+
+                    if (rows >= 0).any():
+                        missing = {}
+                        for i, k in enumerate(keys):
+                            missing.setdefault(k, i)
+                        new_vectors = np.asarray(encode_fn([texts[i] for i in missing.values()]), dtype=np.float32)
+
+                self._append(list(missing), new_vectors)
+                rows = np.array([self.rows[k] for k in keys], dtype=np.int64)
+
+            out = np.asarray(self.vectors()[rows], dtype=np.float32)
+            self.used[rows] = time.time_ns()
+            self._used_dirty = True
+
+            if self.count > self.max_rows():
+                self._evict()
+            elif time.monotonic() - self._used_saved_at >= USED_FLUSH_S:
+                self._save_used()
+
+        return out
+
+    def stats(self):
+        return {
+            "model": self.model_id,
+            "count": self.count,
+            "dim": self.dim,
+            "size_mb": round(self.count * 4 * (self.dim or 0) / 1e6, 1),
+            "max_mb": self.max_mb,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def get_cache(model_id=None):
+    model_id = str(model_id or Config.RAG_MODEL)
+    with _lock:
+        if model_id not in _caches:
+            _caches[model_id] = EmbeddingCache(model_id)
+        return _caches[model_id]
+
+
+@atexit.register
+def flush_all():
+    with _lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.flush()
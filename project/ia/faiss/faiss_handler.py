@@ -1,25 +1,36 @@
-import os, pickle, re, json, numpy as np
-from sentence_transformers import SentenceTransformer
+import os, pickle, re, json, shutil, time, random, numpy as np
+from collections.abc import Sequence
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.preprocessing import normalize as sk_normalize
 import faiss
 from config import Config
-from ia.history_handler import filter_relevant_history
+from ia.faiss import index_registry, source_index, index_factory, bm25_index, chunk_store, embedding_cache, projection, shards, cross_encoder
+from ia.faiss.query_features import build_query_features
+from ia import inference_service
 
-from rank_bm25 import BM25Okapi
 import re
 import numpy as np
 from sklearn.preprocessing import normalize as sk_normalize
 
 # 🔹 Paramètres
 INDEX_FILE = os.path.join(Config.INDEX_FAISS, "faiss_index.idx")
-META_FILE = os.path.join(Config.INDEX_FAISS, "faiss_metadata.pkl")
+CHUNK_STORE_DIR = os.path.join(Config.INDEX_FAISS, "faiss_chunks")
 
 INDEX_WORKFLOW_FILE = os.path.join(Config.INDEX_FAISS, "faiss_index_workflow.idx")
+CHUNK_STORE_WORKFLOW_DIR = os.path.join(Config.INDEX_FAISS, "faiss_chunks_workflow")
+
+# ancien format pickle {"chunks", "metadata"} : migré automatiquement vers le chunk store
+META_FILE = os.path.join(Config.INDEX_FAISS, "faiss_metadata.pkl")
 META_WORKFLOW_FILE = os.path.join(Config.INDEX_FAISS, "faiss_metadata_workflow.pkl")
 
 DIM = 1024  # dimension forcée pour BGE
 
+# fan-out des requêtes sur les shards (ia/faiss/shards.py)
+shard_executor = ThreadPoolExecutor(max_workers=Config.FAISS_SHARD_WORKERS)
+
 # ----------------- Préprocessing stopwords -----------------
+@lru_cache(maxsize=1)
 def preprocess_stopwords():
     with open("./ressources/french_stopwords.json", "r", encoding="utf-8") as f:
         stopwords = json.load(f)
@@ -32,38 +43,88 @@ def preprocess_stopwords():
 # ----------------- Projection embeddings -----------------
 def project_to_1024(vec):
     """
-    vec : np.array shape (n, 1024)
+    vec : np.array shape (n, d)
     retourne : np.array shape (n, 1024)
+    Projection calculée une fois et persistée (ia/faiss/projection.py).
     """
-    if vec.shape[1] == DIM:
-        return vec.astype(np.float32)
-    
-    np.random.seed(42)  # pour reproductibilité
-    proj = np.random.randn(vec.shape[1], DIM).astype(np.float32) / np.sqrt(vec.shape[1])
-    return np.dot(vec, proj)
+    return projection.project(vec, DIM)
 
 # ----------------- Index FAISS -----------------
-def load_faiss_index(workflow: bool):
-    if workflow:
-        if not (os.path.exists(INDEX_WORKFLOW_FILE) and os.path.exists(META_WORKFLOW_FILE)):
-            return None, None, None, None
-        index = faiss.read_index(INDEX_WORKFLOW_FILE)
-        meta_path = META_WORKFLOW_FILE
-    else:
-        if not (os.path.exists(INDEX_FILE) and os.path.exists(META_FILE)):
-            return None, None, None, None
-        index = faiss.read_index(INDEX_FILE)
-        meta_path = META_FILE
+def index_files(workflow):
+    """
+    workflow : True / False (index historiques) ou nom de shard ("general__factures").
+    """
+    key = shards.index_key(workflow)
+    if key == "workflow":
+        return "workflow", INDEX_WORKFLOW_FILE, CHUNK_STORE_WORKFLOW_DIR
+    if key == "general":
+        return "general", INDEX_FILE, CHUNK_STORE_DIR
+    suffix = shards.file_suffix(key)
+    return (
+        key,
+        os.path.join(Config.INDEX_FAISS, f"faiss_index{suffix}.idx"),
+        os.path.join(Config.INDEX_FAISS, f"faiss_chunks{suffix}")
+    )
+
+
+def sidecar_file(workflow, kind):
+    # faiss_sources.pkl, faiss_bm25_workflow.pkl, faiss_bm25_general__factures.pkl...
+    return os.path.join(Config.INDEX_FAISS, f"faiss_{kind}{shards.file_suffix(shards.index_key(workflow))}.pkl")
+
+
+def index_keys(workflow, families=None):
+    """
+    Index à interroger / mettre à jour pour `workflow` :
+    - nom de shard → ce shard seul
+    - True / False → shards de la base (filtrés par famille) + index historique s'il existe.
+      Si aucune des familles demandées n'a de shard, on retombe sur l'index historique.
+    """
+    if isinstance(workflow, str):
+        return [workflow]
+
+    base = shards.index_key(workflow)
+    keys = shards.list_shards(base, families)
+    _, legacy_path, _ = index_files(workflow)
+    if os.path.exists(legacy_path) and (families is None or not keys):
+        keys = [base] + keys
+    return keys
+
+
+def migrate_pickle_metadata(workflow: bool):
+    """
+    Conversion unique de l'ancien faiss_metadata*.pkl vers le chunk store.
+    """
+    key, _, store_dir = index_files(workflow)
+    if key not in shards.BASES:
+        return
+    meta_path = META_WORKFLOW_FILE if key == "workflow" else META_FILE
+
+    if os.path.exists(chunk_store.manifest_path(store_dir)) or not os.path.exists(meta_path):
+        return
 
     with open(meta_path, "rb") as f:
         data = pickle.load(f)
 
-    chunks = data["chunks"]
-    metadata = data["metadata"]
+    chunk_store.create_store(store_dir, data["chunks"], data["metadata"])
+    print(f"🔁 {meta_path} migré vers le chunk store {store_dir} ({len(data['chunks'])} chunks)")
 
-    embedder = SentenceTransformer(Config.RAG_MODEL)
 
-    # 🔥 Sécurité dimension
+def read_faiss_files(index_path, store_dir):
+    """
+    Lecture disque brute (appelée une seule fois par version de fichier via le registre).
+    Les textes / metadata restent sur disque (mmap) : rien n'est désérialisé ici.
+    """
+    index = faiss.read_index(index_path)
+    params = index_factory.load_index_params(index_path)
+    index_factory.apply_search_params(index, params)
+
+    store = chunk_store.open_store(store_dir)
+    chunks = store.texts
+    metadata = store.metadata
+
+    embedder = index_registry.get_embedder()
+
+    # 🔥 Sécurité dimension (une fois par chargement, pas par requête)
     test_emb = embedder.encode(
         ["__faiss_dim_check__"],
         normalize_embeddings=True
@@ -71,97 +132,399 @@ def load_faiss_index(workflow: bool):
 
     test_emb = np.atleast_2d(test_emb)
 
-    if test_emb.shape[1] != index.d:
+    # les embeddings sont projetés en DIM : on compare la dimension du modèle
+    # à celle utilisée au build (embed_dim, absent des index plus anciens)
+    embed_dim = params.get("embed_dim", index.d)
+    if test_emb.shape[1] != embed_dim or index.d != DIM:
         raise RuntimeError(
             f"Incompatible FAISS index dimension:\n"
-            f"FAISS index.d = {index.d}\n"
+            f"FAISS index.d = {index.d} (embed_dim build = {embed_dim})\n"
             f"Embedding dim = {test_emb.shape[1]}\n"
             f"Model = {Config.RAG_MODEL}"
         )
 
     print(f"✅ FAISS index chargé ({index.ntotal} vecteurs, dim={index.d})")
 
-    return chunks, metadata, embedder, index
+    return chunks, metadata, index
+
+
+def load_faiss_index(workflow: bool):
+    name, index_path, store_dir = index_files(workflow)
+    migrate_pickle_metadata(workflow)
+
+    loaded = index_registry.get_index(
+        name,
+        [index_path, chunk_store.manifest_path(store_dir)],
+        lambda: read_faiss_files(index_path, store_dir)
+    )
+    if loaded is None:
+        return None, None, None, None
+
+    chunks, metadata, index = loaded
+    return chunks, metadata, index_registry.get_embedder(), index
+
+
+def load_source_index(workflow: bool, metadata=None):
+    """
+    Index inversé token → sources (stocké à côté du chunk store).
+    Construit depuis `metadata` s'il n'existe pas encore sur disque.
+    """
+    name, _, _ = index_files(workflow)
+    path = sidecar_file(workflow, "sources")
+
+    sidx = index_registry.get_index(
+        f"{name}_sources",
+        [path],
+        lambda: source_index.load_source_index(path)
+    )
+    if sidx is None and metadata is not None:
+        sidx = source_index.build_source_index(metadata)
+        save_source_index(sidx, workflow)
+
+    return sidx
+
+
+def save_source_index(sidx, workflow: bool):
+    name, _, _ = index_files(workflow)
+    path = sidecar_file(workflow, "sources")
+
+    source_index.save_source_index(sidx, path)
+    index_registry.put_index(f"{name}_sources", [path], sidx)
 
 
-def save_faiss_index(index, chunks, metadata, workflow: bool = False):
+def load_bm25(workflow: bool, chunks=None, strict=True):
     """
-    Sauvegarde :
+    Index BM25 persistant du corpus (stocké à côté du chunk store).
+    (Re)construit depuis `chunks` s'il est absent, ou désaligné avec l'index FAISS
+    si strict (côté lecture, un léger décalage pendant une indexation est toléré :
+    les chunks pas encore dans le BM25 ont un score lexical nul).
+    """
+    name, _, _ = index_files(workflow)
+    path = sidecar_file(workflow, "bm25")
+
+    bm25 = index_registry.get_index(
+        f"{name}_bm25",
+        [path],
+        lambda: bm25_index.load_bm25_index(path)
+    )
+    stale = bm25 is None or (strict and len(bm25["doc_len"]) != len(chunks or []))
+    if chunks is not None and stale:
+        print(f"🔧 Construction index BM25 '{name}' ({len(chunks)} chunks)")
+        bm25 = bm25_index.build_bm25_index(chunks)
+        save_bm25(bm25, workflow)
+
+    return bm25
+
+
+def save_bm25(bm25, workflow: bool):
+    name, _, _ = index_files(workflow)
+    path = sidecar_file(workflow, "bm25")
+
+    bm25_index.save_bm25_index(bm25, path)
+    index_registry.put_index(f"{name}_bm25", [path], bm25)
+
+
+def _publish(name, index_path, store_dir, index):
+    # les autres requêtes du process voient directement la nouvelle version
+    store = chunk_store.open_store(store_dir)
+    index_registry.put_index(
+        name,
+        [index_path, chunk_store.manifest_path(store_dir)],
+        (store.texts, store.metadata, index)
+    )
+    return store
+
+
+def save_faiss_index(index, chunks, metadata, workflow: bool = False, vectors=None):
+    """
+    Sauvegarde complète :
     - index FAISS (.idx)
-    - chunks + metadata (.pkl)
+    - chunks + metadata (chunk store, nouvelle génération)
+    - vectors : vecteurs float32 à conserver pour le rescoring (index float16 / int8)
     """
 
-    if workflow:
-        index_path = INDEX_WORKFLOW_FILE
-        meta_path = META_WORKFLOW_FILE
-    else:
-        index_path = INDEX_FILE
-        meta_path = META_FILE
+    name, index_path, store_dir = index_files(workflow)
 
     os.makedirs(os.path.dirname(index_path), exist_ok=True)
 
+    # --- Sauvegarde chunks + metadata ---
+    chunk_store.create_store(store_dir, chunks, metadata, vectors)
+
     # --- Sauvegarde FAISS ---
     faiss.write_index(index, index_path)
 
-    # --- Sauvegarde metadata ---
-    with open(meta_path, "wb") as f:
-        pickle.dump(
-            {
-                "chunks": chunks,
-                "metadata": metadata
-            },
-            f
-        )
+    _publish(name, index_path, store_dir, index)
 
     print(
         f"💾 FAISS index sauvegardé :\n"
         f"   - {index_path}\n"
-        f"   - {meta_path}\n"
+        f"   - {store_dir}\n"
         f"   - vectors = {index.ntotal}, dim = {index.d}"
     )
 
 
-def build_faiss_index(chunks, metadata,workflow):
-    if not chunks:
-        return [], [], None, None
+def append_faiss_index(index, chunks_to_add, metadata_to_add, workflow: bool = False, vectors=None):
+    """
+    Sauvegarde incrémentale : seuls les nouveaux chunks sont écrits dans le store.
+    """
+    name, index_path, store_dir = index_files(workflow)
 
-    embedder = SentenceTransformer(Config.RAG_MODEL)
-    embeddings = embedder.encode(chunks, convert_to_numpy=True).astype("float32")
+    chunk_store.append_to_store(store_dir, chunks_to_add, metadata_to_add, vectors)
+    faiss.write_index(index, index_path)
+    store = _publish(name, index_path, store_dir, index)
+
+    print(
+        f"💾 FAISS index mis à jour : +{len(chunks_to_add)} chunks "
+        f"(vectors = {index.ntotal}, chunks = {len(store)})"
+    )
+    return store
+
+
+def embed_chunks(chunks, embedder):
+    # cache disque (modèle, hash du texte) : seuls les chunks jamais vus passent par l'encodeur
+    embeddings = embedding_cache.get_cache(Config.RAG_MODEL).encode(
+        chunks,
+        lambda texts: embedder.encode(texts, convert_to_numpy=True).astype("float32")
+    )
 
     # Projection sur 1024
     embeddings = project_to_1024(embeddings)
-    embeddings = sk_normalize(embeddings, axis=1)
+    return sk_normalize(embeddings, axis=1).astype("float32")
+
 
-    index = faiss.IndexFlatIP(DIM)
-    index.add(embeddings)
-    save_faiss_index(index, chunks, metadata,workflow)
+def build_faiss_index(chunks, metadata,workflow, embeddings=None):
+    if not chunks:
+        return [], [], None, None
+
+    embedder = index_registry.get_embedder()
+    if embeddings is None:
+        embeddings = embed_chunks(chunks, embedder)
+
+    # Type d'index configuré (flat / ivf_flat / ivf_pq / hnsw), entrainé si besoin
+    name, index_path, _ = index_files(workflow)
+    index, params = index_factory.create_index(
+        index_factory.index_mode(name), DIM, embeddings, index_factory.index_storage(name)
+    )
+    index_factory.add_vectors(index, embeddings, 0)
+    params["embed_dim"] = embedder.get_sentence_embedding_dimension()
+
+    # index compressé : vecteurs float32 conservés dans le chunk store (rescoring)
+    exact = embeddings if index_factory.keeps_exact_vectors(params) else None
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    index_factory.save_index_params(index_path, params)
+    save_faiss_index(index, chunks, metadata,workflow, vectors=exact)
+    save_source_index(source_index.build_source_index(metadata), workflow)
+    save_bm25(bm25_index.build_bm25_index(chunks), workflow)
 
     return chunks, metadata, embedder, index
 
-def faiss_index_handler(new_chunks, new_metadata, workflow:bool):
+def faiss_index_handler(new_chunks, new_metadata, workflow, embeddings=None):
+    """
+    embeddings : vecteurs déjà calculés pour new_chunks (pipeline d'indexation), sinon encodés ici
+    Avec FAISS_SHARDING, les chunks d'un index de base (True / False) sont répartis
+    par famille dans les shards <base>__<famille>.
+    """
+    if isinstance(workflow, str) or not Config.FAISS_SHARDING:
+        return _index_chunks(new_chunks, new_metadata, workflow, embeddings)
+
+    base = shards.index_key(workflow)
+    groups = {}
+    for i, meta in enumerate(new_metadata):
+        groups.setdefault(shards.shard_key(base, shards.family_of(meta)), []).append(i)
+
+    shards.register(list(groups))
+    results = {}
+    for key, rows in groups.items():
+        results[key] = _index_chunks(
+            [new_chunks[i] for i in rows],
+            [new_metadata[i] for i in rows],
+            key,
+            None if embeddings is None else embeddings[rows]
+        )
+    return results
+
+
+def _index_chunks(new_chunks, new_metadata, workflow, embeddings=None):
     chunks, metadata, embedder, index = load_faiss_index(workflow)
     if not chunks:
-        return build_faiss_index(new_chunks, new_metadata,workflow)
+        return build_faiss_index(new_chunks, new_metadata,workflow, embeddings=embeddings)
     
-    existing_files = [m.get("path") for m in metadata]
-    new_entries = [(c, m) for c, m in zip(new_chunks, new_metadata) if m.get("path") not in existing_files]
+    existing_files = set(metadata.distinct("path"))
+    keep = [i for i, m in enumerate(new_metadata) if m.get("path") not in existing_files]
     
-    if not new_entries:
+    if not keep:
         return chunks, metadata, embedder, index
 
-    chunks_to_add, metadata_to_add = zip(*new_entries)
-    embeddings_to_add = embedder.encode(list(chunks_to_add), convert_to_numpy=True).astype("float32")
+    chunks_to_add = [new_chunks[i] for i in keep]
+    metadata_to_add = [new_metadata[i] for i in keep]
+    sidx = load_source_index(workflow, metadata)
+    bm25 = load_bm25(workflow, chunks)
 
-    # Projection sur 1024
-    embeddings_to_add = project_to_1024(embeddings_to_add)
-    embeddings_to_add = sk_normalize(embeddings_to_add, axis=1)
+    if embeddings is not None:
+        embeddings_to_add = np.ascontiguousarray(embeddings[keep], dtype=np.float32)
+    else:
+        embeddings_to_add = embed_chunks(chunks_to_add, embedder)
 
-    index.add(embeddings_to_add)
-    chunks.extend(chunks_to_add)
-    metadata.extend(metadata_to_add)
-    save_faiss_index(index, chunks, metadata,workflow)
+    index_factory.add_vectors(index, embeddings_to_add, len(chunks))
+    exact = embeddings_to_add if metadata.store.vector_dim else None
+    store = append_faiss_index(index, chunks_to_add, metadata_to_add, workflow, vectors=exact)
+    chunks, metadata = store.texts, store.metadata
+
+    # index des sources : seules les nouvelles metadata sont ajoutées
+    source_index.add_metadata(sidx, metadata_to_add)
+    save_source_index(sidx, workflow)
+
+    # BM25 : seuls les nouveaux chunks sont tokenisés
+    bm25_index.add_documents(bm25, chunks_to_add)
+    save_bm25(bm25, workflow)
     return chunks, metadata, embedder, index
 
+def remove_documents(paths, workflow):
+    """
+    Supprime tous les chunks des documents `paths` (fichiers effacés ou modifiés) :
+    - remove_ids sur l'index FAISS (ids = ids du chunk store)
+    - tombstones dans le chunk store, décompte dans l'index des sources
+    Index historique sans ID map ou HNSW (pas de remove_ids) : compaction complète.
+    Index de base (True / False) : appliqué à chacun de ses shards.
+    """
+    if not isinstance(workflow, str):
+        return sum(remove_documents(paths, key) for key in index_keys(workflow))
+
+    chunks, metadata, embedder, index = load_faiss_index(workflow)
+    if not chunks:
+        return 0
+
+    name, index_path, store_dir = index_files(workflow)
+    ids = metadata.store.ids_for("path", paths)
+    if not len(ids):
+        return 0
+
+    removed_metadata = [metadata[i] for i in ids]
+
+    in_place = False
+    if index_factory.is_id_mapped(index):
+        try:
+            index.remove_ids(ids)
+            in_place = True
+        except RuntimeError:
+            pass
+
+    chunk_store.delete_from_store(store_dir, ids)
+
+    if in_place:
+        faiss.write_index(index, index_path)
+        _publish(name, index_path, store_dir, index)
+
+        sidx = load_source_index(workflow, metadata)
+        source_index.remove_metadata(sidx, removed_metadata)
+        save_source_index(sidx, workflow)
+
+        if index.ntotal == 0 and shards.family_of_key(workflow):
+            shards.unregister([workflow])
+            print(f"🗑️ Shard '{name}' vide : retiré du registre")
+    else:
+        rebuild_faiss_index(workflow)
+
+    print(f"🗑️ {len(ids)} chunks supprimés ({len(paths)} documents) de l'index '{name}'")
+    return len(ids)
+
+
+def _live_vectors(metadata, index, live):
+    """
+    Vecteurs des chunks `live` sans ré-encodage, None si impossible :
+    vecteurs float32 du store (index compressé) > vecteurs relus dans l'index.
+    """
+    exact = metadata.store.vectors()
+    if exact is not None:
+        return np.asarray(exact[live], dtype=np.float32)
+
+    vectors = index_factory.index_vectors(index)
+    if vectors is not None:
+        ids = index_factory.index_ids(index)
+        order = np.argsort(ids)
+        pos = order[np.clip(np.searchsorted(ids[order], live), 0, len(ids) - 1)]
+        if len(ids) and np.array_equal(ids[pos], live):
+            return vectors[pos]
+    return None
+
+
+def rebuild_faiss_index(workflow):
+    """
+    Reconstruit l'index avec le mode configuré (Config.FAISS_INDEX_MODE)
+    et compacte le chunk store (les chunks supprimés disparaissent, ids renumérotés).
+    Les vecteurs existants sont réutilisés si l'index actuel permet de les relire.
+    workflow = nom de shard → seul ce shard est reconstruit ; True / False → tous.
+    """
+    if not isinstance(workflow, str):
+        return {key: rebuild_faiss_index(key) for key in index_keys(workflow)}
+
+    chunks, metadata, embedder, index = load_faiss_index(workflow)
+    if not chunks:
+        return [], [], None, None
+
+    live = metadata.store.live_ids()
+    live_chunks = [chunks[i] for i in live]
+    live_metadata = [metadata[i] for i in live]
+    embeddings = _live_vectors(metadata, index, live)
+
+    return build_faiss_index(live_chunks, live_metadata, workflow, embeddings=embeddings)
+
+
+def shard_legacy_index(workflow: bool):
+    """
+    Migration : répartit l'index historique non shardé (general / workflow)
+    dans les shards par famille, en réutilisant ses vecteurs, puis le supprime.
+    """
+    base = shards.index_key(workflow)
+    chunks, metadata, embedder, index = load_faiss_index(base)
+    if not chunks:
+        return 0
+
+    live = metadata.store.live_ids()
+    embeddings = _live_vectors(metadata, index, live)
+    if embeddings is None:
+        embeddings = embed_chunks([chunks[i] for i in live], embedder)
+
+    # par lots : mémoire bornée sur les gros index
+    step = Config.INDEX_CHECKPOINT_CHUNKS
+    for start in range(0, len(live), step):
+        rows = live[start:start + step]
+        faiss_index_handler(
+            [chunks[i] for i in rows],
+            [metadata[i] for i in rows],
+            workflow,
+            embeddings=embeddings[start:start + step]
+        )
+
+    name, index_path, store_dir = index_files(base)
+    for path in (index_path, index_factory.params_path(index_path), sidecar_file(base, "sources"), sidecar_file(base, "bm25")):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    for entry in (name, f"{name}_sources", f"{name}_bm25"):
+        index_registry.invalidate(entry)
+
+    print(f"🔀 Index '{name}' réparti en shards : {shards.list_shards(base)}")
+    return len(live)
+
+
+def document_id_ranges(workflow):
+    """
+    {path: [premier id, dernier id + 1]} des documents présents dans l'index
+    (ids propres à chaque shard pour un index de base).
+    """
+    if not isinstance(workflow, str):
+        ranges = {}
+        for key in index_keys(workflow):
+            ranges.update(document_id_ranges(key))
+        return ranges
+
+    chunks, metadata, embedder, index = load_faiss_index(workflow)
+    if not chunks:
+        return {}
+    return metadata.store.id_ranges("path")
+
 # ----------------- TF-IDF boost -----------------
 def apply_tfidf_sort(
         query,
@@ -171,32 +534,30 @@ def apply_tfidf_sort(
         pos_factor=0.08,
         rare_factor=0.2,
         mix_query=0.30,
-        mode="sum"
+        mode="sum",
+        features=None
     ):
     """
     PONDÉRATION SANS CORPUS :
     - importance = combinaison longueur + rareté + position + non-stopword
     - self-contained, stable, aucune dépendance extérieure
     - excellent pour moteurs RAG web
+    - features : sortie de build_query_features (sinon calculée ici, un seul encode)
     """
 
-    import numpy as np
-    import re
-
     # -----------------------------
-    # 1) Tokenisation
+    # 1) Tokenisation + embeddings batch (query_features)
     # -----------------------------
-    tokens = re.findall(r"[a-zA-Z0-9éàèùçêôî]+", query.lower())
+    if features is None:
+        features = build_query_features(query, embedder=embedder)
+
+    tokens = features["tokens"]
     if not tokens:
-        emb = embedder.encode([query], convert_to_numpy=True)[0]
-        return query, emb
+        return query, features["query_vec"]
 
     stopwords = set(preprocess_stopwords())
 
-    # -----------------------------
-    # 2) Embeddings batch
-    # -----------------------------
-    token_emb = embedder.encode(tokens, convert_to_numpy=True)
+    token_emb = features["token_vecs"]
 
     # -----------------------------
     # 3) Pondération SELF-IDF
@@ -244,7 +605,7 @@ def apply_tfidf_sort(
     # -----------------------------
     # 5) Blending avec embedding brut
     # -----------------------------
-    orig = embedder.encode([query], convert_to_numpy=True)[0]
+    orig = features["query_vec"]
     orig = orig / (np.linalg.norm(orig) + 1e-8)
 
     vec = (1 - mix_query) * vec + mix_query * orig
@@ -254,48 +615,49 @@ def apply_tfidf_sort(
 
 
 # ----------------- Boost metadata -----------------
-def augment_query_with_metadata(query_vec: np.ndarray, query: str, metadata_list: list, embedder):
+def augment_query_with_metadata(query_vec: np.ndarray, query: str, metadata_list: list, embedder, features=None, sidx=None):
+    if features is None:
+        features = build_query_features(query, embedder=embedder)
+
+    # Index inversé des sources (sinon construit à la volée depuis metadata_list)
+    if sidx is None:
+        sidx = source_index.build_source_index(metadata_list)
+
     # Extraire les mots du query
-    tokens = re.findall(r"[a-zA-Z0-9éèêàùôîç]+", query.lower())
+    tokens = features["tokens"]
 
     # Charger stopwords
     stopwords = set(preprocess_stopwords())
 
-    matched_vecs = []
+    # Chaque entrée metadata matchée ajoute une fois le vecteur du token :
+    # moyenne(query_vec, matchs...) calculée sans matérialiser les répétitions
+    query_rows = np.atleast_2d(query_vec)
+    total = query_rows.sum(axis=0)
+    n = query_rows.shape[0]
 
-    for meta in metadata_list:
-        source = meta.get("source", "")
-        if not isinstance(source, str):
+    for tok in tokens:
+        if tok in stopwords:
             continue
 
-        source_low = source.lower()
-
-        # For each word in query (not in stopwords)
-        for tok in tokens:
-            if tok in stopwords:
-                continue
-
-            # search word inside metadata source
-            if re.search(re.escape(tok), source_low):
-                #print(f"[BOOST] '{tok}' found in metadata source '{source_low}'")
-                m_vec = embedder.encode([tok], convert_to_numpy=True)
-                matched_vecs.append(m_vec)
+        count = source_index.match_count(sidx, tok)
+        if count:
+            #print(f"[BOOST] '{tok}' found in {count} metadata sources")
+            total = total + count * features["token_vec"][tok]
+            n += count
 
     # Si des mots matchent → booster
-    if matched_vecs:
-        matched_vecs = np.vstack(matched_vecs)
-        boosted = np.mean(np.vstack([query_vec, matched_vecs]), axis=0, keepdims=True)
-        return boosted
+    if n > query_rows.shape[0]:
+        return (total / n)[None, :]
 
     print("Metadata not matched in query.")
-    return query_vec
+    return query_rows  # toujours (1, d) : la requête brute est 1-D sans historique
 
 
 # ----------------- Ultra ReRanking -----------------
 def ultra_reranker_scores(sims, eps=1e-9):
-    sims = np.array(sims, dtype=float)
+    sims = np.asarray(sims, dtype=np.float32)
     similarities = np.clip(sims, 0, 1)
-    top_sim = np.max(similarities)
+    top_sim = similarities.max()
     contrasts = top_sim - similarities
     alpha = 50
     boosts = 1 / (1 + np.exp(-alpha * (contrasts - 0.05)))
@@ -303,65 +665,179 @@ def ultra_reranker_scores(sims, eps=1e-9):
     final_scores = (1 - (raw_scores - raw_scores.min()) / (raw_scores.max() - raw_scores.min() + eps)) * sims # * sims important
     return final_scores, similarities, contrasts, boosts
 
+
+class RetrievedChunks(Sequence):
+    """
+    Résultats de retrieve() triés par score : {"text", "metadata", "score"}
+    construits à la demande (seuls les chunks réellement lus sont décodés du store).
+    + "rerank_score" pour les chunks rerankés par le cross-encoder.
+    """
+
+    def __init__(self, parts, part_of, ids, scores, rerank_scores=None):
+        self.parts = parts
+        self.part_of = part_of
+        self.ids = ids
+        self.scores = scores
+        self.rerank_scores = rerank_scores
+        self._items = [None] * len(ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def chunk_ids(self):
+        """
+        (index / shard, id du chunk) de chaque résultat, dans l'ordre.
+        """
+        return [(self.parts[p]["key"], int(i)) for p, i in zip(self.part_of, self.ids)]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        item = self._items[i]
+        if item is None:
+            part = self.parts[self.part_of[i]]
+            item = self._items[i] = {
+                "text": part["chunks"][self.ids[i]],
+                "metadata": part["metadata"][self.ids[i]],
+                "score": float(self.scores[i])
+            }
+            if self.rerank_scores is not None and i < len(self.rerank_scores):
+                item["rerank_score"] = float(self.rerank_scores[i])
+        return item
+
+
 # ----------------- Retrieval -----------------
 
 
-def retrieve(user_ip: str, query: str, top_k: int = Config.nb_chunks_to_use, query_weight: float = 1, workflow = False):
+def _search_shard(key, query, base_vec, features, query_tokens, top_k, embedder):
+    """
+    Candidats d'un shard : similarités FAISS brutes + scores BM25 bruts
+    (normalisés après fusion de tous les shards).
+    """
+    chunks, metadata, _, index = load_faiss_index(key)
+    # chunks compte aussi les tombstones : un index vidé par remove_ids a ntotal = 0
+    if not chunks or not index or index.ntotal == 0:
+        return None
+
+    # ---------------- Metadata boost (sources du shard)
+    sidx = load_source_index(key, metadata)
+    query_vec = augment_query_with_metadata(base_vec, query, metadata, embedder, features=features, sidx=sidx)
+
+    # ---------------- FAISS retrieval sur tout le shard
+    query_vec = project_to_1024(query_vec)
+    query_vec = sk_normalize(query_vec, axis=1)
+    # index float16 / int8 : rescoring exact sur les vecteurs float32 du store (mmap)
+    sims, indices = index_factory.search(index, query_vec, top_k, exact_vectors=metadata.store.vectors())
+
+    # IVF / HNSW (ou corpus < top_k) : FAISS complète avec des ids -1
+    # (ids hors store : index et store en cours d'écriture par un autre process)
+    valid = (indices[0] >= 0) & (indices[0] < len(chunks))
+    if not valid.any():
+        return None
+    sims, ids = sims[0][valid], indices[0][valid]
+
+    # ---------------- BM25 sur les résultats FAISS (index persistant, IDF du shard)
+    bm25 = load_bm25(key, chunks, strict=False)
+    bm25_scores = bm25_index.get_scores(bm25, query_tokens, ids)
+
+    return {"key": key, "chunks": chunks, "metadata": metadata, "sims": sims, "ids": ids, "bm25": bm25_scores}
+
+
+def retrieve(user_ip: str, query: str, top_k: int = Config.nb_chunks_to_use, query_weight: float = 1, workflow = False, families=None):
+    """
+    workflow : True / False (index de base, tous ses shards) ou nom de shard.
+    families : restreint la recherche aux shards de ces familles (ex : ["documentation_machines"]).
+    Les shards sont interrogés en parallèle, les candidats fusionnés par similarité
+    puis scorés ensemble. Le boost metadata dépend des sources de chaque shard :
+    les scores diffèrent de ceux d'un index unique.
+    """
+    if inference_service.remote_enabled():
+        # index + embedder chargés une seule fois, dans le démon d'inférence
+        return inference_service.client().retrieve(
+            user_ip=user_ip, query=query, top_k=top_k, query_weight=query_weight,
+            workflow=workflow, families=families,
+        )
+
     print("--- FAISS →  filtrage fin with BM25 rerank ---")
-    chunks, metadata, embedder, index = load_faiss_index(workflow)
-    if not embedder or not chunks or not index:
+    keys = index_keys(workflow, families)
+    if not keys:
         return []
+    embedder = index_registry.get_embedder()
+
+    # ---------------- Query features : tokens + query + historique en un seul encode (commun aux shards)
+    features = build_query_features(query, user_ip=user_ip, embedder=embedder)
 
     # ---------------- TF-IDF boost pour query
-    tf_prompt, query_vec = apply_tfidf_sort(query, embedder)
+    tf_prompt, query_vec = apply_tfidf_sort(query, embedder, features=features)
 
     # ---------------- Fusion avec historique
-    filtered_history = filter_relevant_history(user_ip, query)
+    filtered_history = features["history"]
     if filtered_history:
-        hist_vecs = sk_normalize(embedder.encode(filtered_history, convert_to_numpy=True), axis=1)
+        hist_vecs = sk_normalize(features["history_vecs"], axis=1)
         hist_mean = np.mean(hist_vecs, axis=0, keepdims=True)
         hist_w = min(0.5, len(filtered_history)/10)
         query_vec = sk_normalize(query_weight * query_vec + (1 - hist_w) * hist_mean, axis=1)
 
-    # ---------------- Metadata boost
-    query_vec = augment_query_with_metadata(query_vec, query, metadata, embedder)
+    query_tokens = bm25_index.tokenize(tf_prompt)
 
-    # ---------------- FAISS retrieval sur tout le corpus
-    query_vec = project_to_1024(query_vec)
-    query_vec = sk_normalize(query_vec, axis=1)
-    sims, indices = index.search(query_vec, top_k)
-    faiss_scores, _, _, _ = ultra_reranker_scores(sims[0])
+    # ---------------- Fan-out sur les shards
+    def search(key):
+        return _search_shard(key, query, query_vec, features, query_tokens, top_k, embedder)
 
-    # ---------------- BM25 rerank sur les résultats FAISS
-    candidate_chunks = [chunks[i] for i in indices[0]]
-    candidate_metadata = [metadata[i] for i in indices[0]]
+    if len(keys) == 1:
+        parts = [search(keys[0])]
+    else:
+        parts = list(shard_executor.map(search, keys))
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return []
+
+    # ---------------- Rerank vectorisé sur les candidats fusionnés
+    t0 = time.perf_counter()
+    sims = np.concatenate([p["sims"] for p in parts])
+    raw_bm25 = np.concatenate([p["bm25"] for p in parts])
+    part_of = np.concatenate([np.full(len(p["ids"]), j, dtype=np.int32) for j, p in enumerate(parts)])
+    ids = np.concatenate([p["ids"] for p in parts])
 
-    tokenized_candidates = [re.findall(r"\b[a-zA-Z0-9éèêàùôîç]+\b", c.lower()) for c in candidate_chunks]
-    bm25 = BM25Okapi(tokenized_candidates)
-    query_tokens = re.findall(r"\b[a-zA-Z0-9éèêàùôîç]+\b", tf_prompt.lower())
-    bm25_scores = bm25.get_scores(query_tokens)
+    # top-k global (plusieurs shards) : sélection sans tri complet
+    if len(sims) > top_k:
+        top = np.argpartition(-sims, top_k - 1)[:top_k]
+        sims, raw_bm25, part_of, ids = sims[top], raw_bm25[top], part_of[top], ids[top]
 
-    # ---------------- Normalisation BM25
-    bm25_scores = bm25_scores / (bm25_scores.max() + 1e-10)
+    faiss_scores, _, _, _ = ultra_reranker_scores(sims)
 
-    # ---------------- Combinaison FAISS + BM25
+    # ---------------- Normalisation BM25 + combinaison FAISS / BM25
+    bm25_scores = raw_bm25 / (raw_bm25.max() + 1e-10)
     combined_scores = 0.7 * faiss_scores + 0.3 * bm25_scores
 
-    # ---------------- Construction des résultats
+    # ---------------- Seuil + tri des seuls chunks retenus
     seuil_min = Config.RAG_MIN_SCORE
-    if (workflow) : 
+    if shards.base_of(workflow) == "workflow":
         seuil_min = Config.RAG_MIN_SCORE_WORKFLOW
-    
-    results = []
-    for score, chunk, meta in zip(combined_scores, candidate_chunks, candidate_metadata):
-        if score >= seuil_min:
-            results.append({
-                "text": chunk,
-                "metadata": meta,
-                "score": float(score)
-            })
-            print(f"[ADD] {meta.get('source','-')} score_combined: {score:.6f}")
-
-    results = sorted(results, key=lambda x: x["score"], reverse=True)
-    print("RAG RESULT size  : ", len(results))
-    return results
\ No newline at end of file
+
+    keep = np.flatnonzero(combined_scores >= seuil_min)
+    keep = keep[np.argsort(-combined_scores[keep], kind="stable")]
+
+    # ---------------- Rerank cross-encoder (optionnel) des N premiers
+    rerank = None
+    if cross_encoder.enabled() and len(keep):
+        head = keep[:Config.RAG_RERANK_TOP_N]
+        texts = [parts[part_of[j]]["chunks"][ids[j]] for j in head]
+        ce_scores = cross_encoder.rerank_scores(query, texts)
+        if ce_scores is not None:
+            # budget de latence : seuls les len(ce_scores) premiers sont rerankés
+            n = len(ce_scores)
+            order = np.argsort(-ce_scores, kind="stable")
+            keep = np.concatenate([head[:n][order], keep[n:]])
+            rerank = ce_scores[order]
+
+    results = RetrievedChunks(parts, part_of[keep], ids[keep], combined_scores[keep], rerank)
+    rerank_ms = (time.perf_counter() - t0) * 1000
+
+    # ---------------- Log échantillonné (aucune lecture du store sinon)
+    if Config.RAG_LOG_SAMPLE_RATE and random.random() < Config.RAG_LOG_SAMPLE_RATE:
+        for r in results[:Config.RAG_LOG_TOP]:
+            print(f"[ADD] {r['metadata'].get('source','-')} score_combined: {r['score']:.6f}")
+
+    print(f"RAG RESULT size  : {len(results)} / {len(sims)} candidats (rerank {rerank_ms:.2f} ms)")
+    return results
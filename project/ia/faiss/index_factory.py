@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import numpy as np
+import faiss
+from config import Config
+
+# ============================================================
+# FACTORY D'INDEX FAISS : FLAT / IVF-FLAT / IVF-PQ / HNSW
+# ============================================================
+# - flat     : recherche exacte (référence)
+# - ivf_flat : partition k-means, on ne scanne que `nprobe` listes
+# - ivf_pq   : IVF + compression PQ (RAM / 16 environ)
+# - hnsw     : graphe, pas d'entrainement, `efSearch` règle le compromis
+# Les paramètres de recherche (nprobe / efSearch) sont persistés à côté de l'index.
+#
+# Stockage (flat / ivf_flat / hnsw) : float32, float16 (SQfp16) ou int8 (SQ8).
+# En float16 / int8 la recherche se fait sur l'index compressé, puis les
+# top_k x FAISS_RESCORE_FACTOR candidats sont rescorés sur les vecteurs float32 (mmap).
+
+MODES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+STORAGES = ("float32", "float16", "int8")
+SQ_CODES = {"float16": "SQfp16", "int8": "SQ8"}
+PQ_NBITS = 8
+
+
+def _setting(values, name, default):
+    # shard "general__factures" : réglage du shard s'il existe, sinon celui de sa base
+    return values.get(name, values.get(name.split("__")[0], default))
+
+
+def index_mode(name):
+    mode = _setting(Config.FAISS_INDEX_MODE, name, "flat")
+    if mode not in MODES:
+        raise ValueError(f"FAISS_INDEX_MODE inconnu pour '{name}' : {mode} (attendu : {MODES})")
+    return mode
+
+
+def index_storage(name):
+    storage = _setting(Config.FAISS_STORAGE, name, "float32")
+    if storage not in STORAGES:
+        raise ValueError(f"FAISS_STORAGE inconnu pour '{name}' : {storage} (attendu : {STORAGES})")
+    return storage
+
+
+def effective_nlist(n):
+    # ~39 points d'entrainement par centroïde minimum (recommandation FAISS)
+    return max(1, min(Config.FAISS_NLIST, int(4 * np.sqrt(n)), n // 39))
+
+
+def params_path(index_path):
+    return index_path + ".params.json"
+
+
+def save_index_params(index_path, params):
+    with open(params_path(index_path), "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+
+
+def load_index_params(index_path):
+    path = params_path(index_path)
+    if not os.path.exists(path):
+        return {"mode": "flat"}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def base_index(index):
+    """
+    Index sous-jacent d'un IndexIDMap2 (les paramètres de recherche s'y appliquent).
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def is_id_mapped(index):
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+
+def add_vectors(index, vectors, start):
+    """
+    Ajoute des vecteurs avec les ids store [start, start + n).
+    Index historique sans ID map : ids implicites = ordre d'ajout.
+    """
+    if is_id_mapped(index):
+        index.add_with_ids(vectors, np.arange(start, start + len(vectors), dtype=np.int64))
+    else:
+        index.add(vectors)
+
+
+def apply_search_params(index, params):
+    mode = params.get("mode", "flat")
+    index = base_index(index)
+    ps = faiss.ParameterSpace()
+    if mode in ("ivf_flat", "ivf_pq"):
+        ps.set_index_parameter(index, "nprobe", int(params.get("nprobe", Config.FAISS_NPROBE)))
+    elif mode == "hnsw":
+        ps.set_index_parameter(index, "efSearch", int(params.get("efSearch", Config.FAISS_EF_SEARCH)))
+    return index
+
+
+def _train_sample(embeddings):
+    n = embeddings.shape[0]
+    if n <= Config.FAISS_TRAIN_SAMPLE:
+        return embeddings
+    rng = np.random.default_rng(42)
+    return embeddings[rng.choice(n, Config.FAISS_TRAIN_SAMPLE, replace=False)]
+
+
+def create_index(mode, dim, embeddings, storage="float32"):
+    """
+    Crée (et entraine si besoin) un index vide prêt pour add_vectors(index, embeddings, 0).
+    Retourne (index, params). Sur un corpus trop petit pour l'entrainement,
+    on dégrade vers le mode le plus proche possible.
+    """
+    n = embeddings.shape[0]
+
+    if mode == "ivf_pq" and storage != "float32":
+        print(f"⚠️ ivf_pq est déjà compressé : stockage {storage} ignoré")
+        storage = "float32"
+
+    if mode == "ivf_pq" and n < (1 << PQ_NBITS):
+        print(f"⚠️ {n} vecteurs < {1 << PQ_NBITS} : entrainement PQ impossible → ivf_flat")
+        mode = "ivf_flat"
+
+    if mode in ("ivf_flat", "ivf_pq") and effective_nlist(n) < 2:
+        print(f"⚠️ {n} vecteurs : corpus trop petit pour IVF → flat")
+        mode = "flat"
+
+    params = {"mode": mode, "storage": storage}
+    coding = SQ_CODES.get(storage, "Flat")
+
+    if mode == "flat":
+        if storage == "float32":
+            index = faiss.IndexFlatIP(dim)
+        else:
+            index = faiss.index_factory(dim, coding, faiss.METRIC_INNER_PRODUCT)
+
+    elif mode == "hnsw":
+        index = faiss.index_factory(dim, f"HNSW{Config.FAISS_HNSW_M},{coding}", faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = Config.FAISS_HNSW_EF_CONSTRUCTION
+        params["efSearch"] = Config.FAISS_EF_SEARCH
+
+    else:
+        nlist = effective_nlist(n)
+        if mode == "ivf_pq":
+            coding = f"PQ{Config.FAISS_PQ_M}x{PQ_NBITS}"
+        index = faiss.index_factory(dim, f"IVF{nlist},{coding}", faiss.METRIC_INNER_PRODUCT)
+
+        t0 = time.perf_counter()
+        index.train(np.ascontiguousarray(_train_sample(embeddings), dtype=np.float32))
+        print(f"🧠 Entrainement {mode} (nlist={nlist}) en {time.perf_counter() - t0:.2f}s")
+
+        params["nlist"] = nlist
+        params["nprobe"] = min(Config.FAISS_NPROBE, nlist)
+
+    if not index.is_trained:
+        # SQ8 : bornes min / max par dimension
+        index.train(np.ascontiguousarray(_train_sample(embeddings), dtype=np.float32))
+
+    apply_search_params(index, params)
+
+    # ids explicites = ids du chunk store (suppression ciblée via remove_ids)
+    return faiss.IndexIDMap2(index), params
+
+
+def keeps_exact_vectors(params):
+    return params.get("storage", "float32") != "float32"
+
+
+def search(index, queries, k, exact_vectors=None, factor=None):
+    """
+    index.search, avec rescoring exact si l'index est compressé :
+    top (k x factor) candidats approchés → produit scalaire sur les vecteurs float32
+    (exact_vectors, ligne = id store) → top k. Même sortie que index.search (ids -1 en fin).
+    Index vide : aucun résultat (faiss refuse k = 0).
+    """
+    k = min(k, index.ntotal)
+    if k <= 0:
+        return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+    if exact_vectors is None:
+        return index.search(queries, k)
+
+    factor = factor or Config.FAISS_RESCORE_FACTOR
+    _, cand = index.search(queries, min(k * factor, index.ntotal))
+
+    sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for q, row in enumerate(cand):
+        row = row[(row >= 0) & (row < len(exact_vectors))]
+        if not len(row):
+            continue
+        order = np.argsort(row)  # lecture mmap dans l'ordre du fichier
+        exact = np.asarray(exact_vectors[row[order]], dtype=np.float32) @ queries[q]
+        top = np.argsort(-exact, kind="stable")[:k]
+        sims[q, :len(top)] = exact[top]
+        ids[q, :len(top)] = row[order][top]
+    return sims, ids
+
+
+# ============================================================
+# RAPPORT RECALL / LATENCE VS FLAT
+# ============================================================
+
+def index_ids(index):
+    """
+    Ids store des vecteurs, dans l'ordre interne de l'index.
+    """
+    if is_id_mapped(index):
+        return faiss.vector_to_array(index.id_map).astype(np.int64)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+
+def index_vectors(index):
+    """
+    Vecteurs stockés dans l'index (ordre de index_ids), None si non reconstructibles
+    (IVF-PQ, ou IVF sans direct map).
+    """
+    try:
+        return base_index(index).reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        return None
+
+
+def benchmark_index_modes(embeddings, modes=MODES, k=100, n_queries=200, storages=("float32",)):
+    """
+    Compare chaque (mode, stockage) à la recherche exacte (IndexFlatIP) :
+    recall@k, latence par requête (p50 / p95), taille sérialisée, temps de build.
+    Les stockages compressés sont mesurés sans puis avec rescoring float32.
+    Requêtes = échantillon des vecteurs du corpus.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, dim = embeddings.shape
+    k = min(k, n)
+
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(n, min(n_queries, n), replace=False)]
+
+    flat = faiss.IndexFlatIP(dim)
+    flat.add(embeddings)
+    _, truth = flat.search(queries, k)
+
+    report = []
+    for mode in modes:
+        for storage in storages:
+            if mode == "ivf_pq" and storage != "float32":
+                continue
+
+            t0 = time.perf_counter()
+            index, params = create_index(mode, dim, embeddings, storage)
+            add_vectors(index, embeddings, 0)
+            build_s = time.perf_counter() - t0
+            size_mb = round(faiss.serialize_index(index).nbytes / 1e6, 2)
+
+            variants = [False, True] if keeps_exact_vectors(params) else [False]
+            for rescore in variants:
+                exact = embeddings if rescore else None
+
+                latencies = []
+                found = np.empty_like(truth)
+                for i, q in enumerate(queries):
+                    t = time.perf_counter()
+                    _, ids = search(index, q[None, :], k, exact_vectors=exact)
+                    latencies.append((time.perf_counter() - t) * 1000)
+                    found[i] = ids[0]
+
+                recall = np.mean([
+                    len(set(found[i][found[i] >= 0]) & set(truth[i])) / k
+                    for i in range(len(queries))
+                ])
+
+                report.append({
+                    "mode": params["mode"],
+                    "storage": params["storage"],
+                    "rescore": rescore,
+                    "params": params,
+                    "recall_at_k": round(float(recall), 4),
+                    "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+                    "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+                    "size_mb": size_mb,
+                    "build_s": round(build_s, 2),
+                })
+
+    return report
+
+
+def print_report(name, report, k):
+    print(f"\n=== {name} : recall@{k} vs flat ===")
+    print(f"{'mode':<10}{'stockage':<10}{'rescore':<9}{'recall':>8}{'p50 ms':>10}{'p95 ms':>10}{'MB':>10}{'build s':>10}")
+    for r in report:
+        print(
+            f"{r['mode']:<10}{r['storage']:<10}{'oui' if r['rescore'] else 'non':<9}{r['recall_at_k']:>8.3f}"
+            f"{r['latency_ms_p50']:>10.3f}{r['latency_ms_p95']:>10.3f}{r['size_mb']:>10.2f}{r['build_s']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    # python -m ia.faiss.index_factory  → rapport pour chaque index / shard (general, workflow, general__factures...)
+    # (chaque mode x stockage float32 / float16 / int8, avec et sans rescoring)
+    from ia.faiss.faiss_handler import load_faiss_index, embed_chunks, index_keys
+
+    k = 100
+    for name in index_keys(False) + index_keys(True):
+        chunks, metadata, embedder, index = load_faiss_index(name)
+        if not chunks:
+            print(f"⚠️ index '{name}' absent")
+            continue
+
+        vectors = metadata.store.vectors()
+        if vectors is not None:
+            vectors = np.asarray(vectors[metadata.store.live_ids()])
+        else:
+            vectors = index_vectors(index)
+        if vectors is None:
+            vectors = embed_chunks(chunks, embedder)
+
+        report = benchmark_index_modes(vectors, k=k, storages=STORAGES)
+        print_report(name, report, k)
+
+        out = os.path.join(Config.INDEX_FAISS, f"index_modes_report_{name}.json")
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 {out}")
@@ -0,0 +1,213 @@
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from config import Config
+
+# ============================================================
+# PIPELINE D'INDEXATION EN FLUX
+# ============================================================
+# parse (pool de process)  →  file bornée  →  embedding par lots (thread)
+#                          →  file bornée  →  ajout index + manifest (thread)
+# - les fichiers sont soumis au fil de l'eau (au plus 2 x workers en vol)
+# - les files bornées bloquent l'étage amont : mémoire plate quelle que soit l'archive
+# - un lot ne coupe jamais un fichier : un fichier est indexé entièrement ou pas du tout
+# - commit_fn est appelé tous les `checkpoint_chunks` : c'est le point de reprise
+
+STAGES = ("parse", "embed", "append")
+_DONE = None
+
+
+def new_stats():
+    return {
+        "started": time.perf_counter(),
+        "stages": {s: {"files": 0, "chunks": 0, "busy_s": 0.0} for s in STAGES},
+    }
+
+
+def _tick(stats, stage, files, chunks, seconds):
+    s = stats["stages"][stage]
+    s["files"] += files
+    s["chunks"] += chunks
+    s["busy_s"] += seconds
+
+
+def stats_report(stats):
+    elapsed = time.perf_counter() - stats["started"]
+    report = {"elapsed_s": round(elapsed, 2)}
+    for stage, s in stats["stages"].items():
+        report[stage] = {
+            "files": s["files"],
+            "chunks": s["chunks"],
+            "busy_s": round(s["busy_s"], 2),
+            "chunks_per_s": round(s["chunks"] / elapsed, 1) if elapsed else 0.0,
+        }
+    return report
+
+
+def print_stats(stats, label=""):
+    r = stats_report(stats)
+    print(
+        f"📊 {label} {r['elapsed_s']:.1f}s | "
+        + " | ".join(
+            f"{stage}: {r[stage]['files']} fichiers, {r[stage]['chunks']} chunks "
+            f"({r[stage]['chunks_per_s']:.1f}/s, actif {r[stage]['busy_s']:.1f}s)"
+            for stage in STAGES
+        )
+    )
+
+
+def _parse(parse_fn, path):
+    # exécuté dans un process du pool
+    t0 = time.perf_counter()
+    chunks, metadata, error = parse_fn(path)
+    return path, chunks, metadata, error, time.perf_counter() - t0
+
+
+def _put(q, item, failed):
+    # put bloquant, mais abandonné si l'étage aval a planté
+    while not failed:
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+    raise failed[0]
+
+
+def _get(q, failed):
+    while not failed:
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    raise failed[0]
+
+
+def _stage(fn, failed):
+    def run():
+        try:
+            fn()
+        except BaseException as e:
+            failed.append(e)
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+
+def run_pipeline(
+        paths,
+        parse_fn,
+        embed_fn,
+        commit_fn,
+        workers=None,
+        queue_size=None,
+        batch_chunks=None,
+        checkpoint_chunks=None
+):
+    """
+    parse_fn(path)                         -> (chunks, metadata, error)   [picklable]
+    embed_fn(chunks)                       -> np.array (n, dim)
+    commit_fn(files, chunks, metadata, emb) : files = [(path, nb_chunks, error)]
+    Retourne le rapport de débit par étage.
+    """
+    workers = workers or Config.INDEX_WORKERS
+    queue_size = queue_size or Config.INDEX_QUEUE_SIZE
+    batch_chunks = batch_chunks or Config.INDEX_BATCH_CHUNKS
+    checkpoint_chunks = checkpoint_chunks or Config.INDEX_CHECKPOINT_CHUNKS
+
+    stats = new_stats()
+    failed = []
+    embed_q = queue.Queue(maxsize=queue_size)
+    append_q = queue.Queue(maxsize=queue_size)
+
+    # ----------------- Étage embedding -----------------
+    def embed_stage():
+        while True:
+            batch = _get(embed_q, failed)
+            if batch is _DONE:
+                _put(append_q, _DONE, failed)
+                return
+
+            chunks = [c for _, file_chunks, _, _ in batch for c in file_chunks]
+            t0 = time.perf_counter()
+            embeddings = embed_fn(chunks) if chunks else None
+            _tick(stats, "embed", len(batch), len(chunks), time.perf_counter() - t0)
+            _put(append_q, (batch, embeddings), failed)
+
+    # ----------------- Étage ajout index -----------------
+    def append_stage():
+        pending, pending_emb, n_pending = [], [], 0
+
+        def commit():
+            nonlocal pending, pending_emb, n_pending
+            if not pending:
+                return
+
+            files = [(path, len(chunks), error) for path, chunks, _, error in pending]
+            chunks = [c for _, file_chunks, _, _ in pending for c in file_chunks]
+            metadata = [m for _, _, file_meta, _ in pending for m in file_meta]
+            embeddings = np.concatenate(pending_emb) if pending_emb else None
+
+            t0 = time.perf_counter()
+            commit_fn(files, chunks, metadata, embeddings)
+            _tick(stats, "append", len(files), len(chunks), time.perf_counter() - t0)
+            print_stats(stats, "[INDEX]")
+
+            pending, pending_emb, n_pending = [], [], 0
+
+        while True:
+            item = _get(append_q, failed)
+            if item is _DONE:
+                commit()
+                return
+
+            batch, embeddings = item
+            pending.extend(batch)
+            if embeddings is not None:
+                pending_emb.append(embeddings)
+                n_pending += len(embeddings)
+            if n_pending >= checkpoint_chunks:
+                commit()
+
+    threads = [_stage(embed_stage, failed), _stage(append_stage, failed)]
+
+    # ----------------- Étage parse (pool de process) -----------------
+    paths = iter(paths)
+    batch, n_batch = [], 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+
+        def fill():
+            for path in paths:
+                in_flight.add(pool.submit(_parse, parse_fn, path))
+                if len(in_flight) >= 2 * workers:
+                    break
+
+        fill()
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for f in done:
+                path, chunks, metadata, error, seconds = f.result()
+                _tick(stats, "parse", 1, len(chunks), seconds)
+                batch.append((path, chunks, metadata, error))
+                n_batch += len(chunks)
+
+            if n_batch >= batch_chunks:
+                _put(embed_q, batch, failed)
+                batch, n_batch = [], 0
+            fill()
+
+    _put(embed_q, batch, failed)
+    _put(embed_q, _DONE, failed)
+
+    for t in threads:
+        while t.is_alive() and not failed:
+            t.join(timeout=0.5)
+    if failed:
+        raise failed[0]
+
+    print_stats(stats, "[INDEX TERMINÉ]")
+    return stats_report(stats)
@@ -0,0 +1,178 @@
+import os
+import time
+import threading
+from sentence_transformers import SentenceTransformer
+from config import Config
+from ia import inference_service
+
+# ============================================================
+# REGISTRE PROCESS-WIDE : EMBEDDER + INDEX FAISS
+# ============================================================
+# Un seul SentenceTransformer et une seule copie de chaque index par process.
+# Chaque entrée est rechargée (hot-swap) dès que ses fichiers changent sur disque.
+
+_lock = threading.RLock()
+_embedder = None
+_entries = {}  # {name: {"value": ..., "stamp": ..., "loaded_at": ...}}
+_version = 0   # incrémenté à chaque (re)chargement / remplacement d'index (invalidation des caches)
+
+_metrics = {
+    "embedder_loads": 0,
+    "embedder_load_time_s": 0.0,
+    "embedder_hits": 0,
+    "index": {}  # {name: {"loads", "reloads", "hits", "load_time_s", "last_load_time_s"}}
+}
+
+
+def _index_metrics(name):
+    return _metrics["index"].setdefault(name, {
+        "loads": 0,
+        "reloads": 0,
+        "hits": 0,
+        "load_time_s": 0.0,
+        "last_load_time_s": 0.0,
+    })
+
+
+def _files_stamp(paths):
+    """
+    Signature (mtime, taille) des fichiers surveillés.
+    None si un fichier manque.
+    """
+    stamp = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+        except OSError:
+            return None
+        stamp.append((p, st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+
+# ----------------- Embedder -----------------
+def get_embedder():
+    global _embedder
+
+    if inference_service.remote_enabled():
+        return inference_service.client().embedder()  # embedder chargé dans le démon d'inférence
+
+    if _embedder is not None:
+        _metrics["embedder_hits"] += 1
+        return _embedder
+
+    with _lock:
+        if _embedder is None:
+            t0 = time.perf_counter()
+            _embedder = SentenceTransformer(Config.RAG_MODEL)
+            dt = time.perf_counter() - t0
+            _metrics["embedder_loads"] += 1
+            _metrics["embedder_load_time_s"] += dt
+            print(f"✅ Embedder chargé ({Config.RAG_MODEL}) en {dt:.2f}s")
+        else:
+            _metrics["embedder_hits"] += 1
+
+    return _embedder
+
+
+# ----------------- Index -----------------
+def get_index(name, paths, loader):
+    """
+    Retourne la valeur chargée par loader() pour l'entrée `name`.
+    - paths  : fichiers surveillés (hot-swap si mtime/taille changent)
+    - loader : fonction sans argument qui lit les fichiers
+    Retourne None si un des fichiers est absent.
+    """
+    stamp = _files_stamp(paths)
+    m = _index_metrics(name)
+
+    if stamp is None:
+        with _lock:
+            if _entries.pop(name, None) is not None:
+                _bump()
+        return None
+
+    entry = _entries.get(name)
+    if entry is not None and entry["stamp"] == stamp:
+        m["hits"] += 1
+        return entry["value"]
+
+    with _lock:
+        entry = _entries.get(name)
+        if entry is not None and entry["stamp"] == stamp:
+            m["hits"] += 1
+            return entry["value"]
+
+        t0 = time.perf_counter()
+        value = loader()
+        dt = time.perf_counter() - t0
+
+        if entry is not None:
+            m["reloads"] += 1
+            print(f"🔄 Index '{name}' modifié sur disque → rechargé en {dt:.2f}s")
+        m["loads"] += 1
+        m["load_time_s"] += dt
+        m["last_load_time_s"] = dt
+
+        # swap atomique : les requêtes en cours gardent l'ancienne référence
+        _entries[name] = {
+            "value": value,
+            "stamp": _files_stamp(paths) or stamp,
+            "loaded_at": time.time(),
+        }
+        if entry is not None:
+            _bump()  # rechargement seulement : un premier chargement ne rend aucun cache obsolète
+        return value
+
+
+def put_index(name, paths, value):
+    """
+    Enregistre une valeur fraîchement construite (après save) sans relire le disque.
+    """
+    with _lock:
+        _entries[name] = {
+            "value": value,
+            "stamp": _files_stamp(paths),
+            "loaded_at": time.time(),
+        }
+        _bump()
+
+
+def invalidate(name=None):
+    with _lock:
+        if name is None:
+            _entries.clear()
+        else:
+            _entries.pop(name, None)
+        _bump()
+
+
+def _bump():
+    global _version
+    _version += 1
+
+
+def version():
+    """
+    Change dès qu'un index du process est chargé, rechargé ou remplacé.
+    """
+    if inference_service.remote_enabled():
+        return inference_service.client().index_version()
+    return _version
+
+
+def get_metrics():
+    with _lock:
+        return {
+            "embedder_loaded": _embedder is not None,
+            "embedder_loads": _metrics["embedder_loads"],
+            "embedder_load_time_s": round(_metrics["embedder_load_time_s"], 3),
+            "embedder_hits": _metrics["embedder_hits"],
+            "index": {
+                name: {
+                    **{k: (round(v, 3) if isinstance(v, float) else v) for k, v in m.items()},
+                    "loaded": name in _entries,
+                    "loaded_at": _entries[name]["loaded_at"] if name in _entries else None,
+                }
+                for name, m in _metrics["index"].items()
+            },
+        }
@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+import numpy as np
+from config import Config
+
+# ============================================================
+# PROJECTION ALÉATOIRE VERS 1024 DIMENSIONS
+# ============================================================
+# Utilisée quand l'embedder ne sort pas 1024 dimensions (modèles plus petits).
+# - matrice calculée une seule fois puis persistée à côté des index FAISS :
+#   l'index et les requêtes utilisent exactement la même projection
+# - générateur local RandomState(42) : mêmes valeurs que l'ancien
+#   np.random.seed(42) + randn (index existants compatibles), sans toucher à l'état global
+# - requêtes unitaires : produit matriciel dans un buffer préalloué par thread
+
+SEED = 42
+
+_lock = threading.Lock()
+_projections = {}
+_buffers = threading.local()
+
+
+def projection_path(in_dim, out_dim):
+    return os.path.join(Config.INDEX_FAISS, f"projection_{in_dim}x{out_dim}.npy")
+
+
+def random_projection(in_dim, out_dim):
+    rng = np.random.RandomState(SEED)
+    return rng.randn(in_dim, out_dim).astype(np.float32) / np.float32(np.sqrt(in_dim))
+
+
+def get_projection(in_dim, out_dim):
+    key = (in_dim, out_dim)
+    proj = _projections.get(key)
+    if proj is not None:
+        return proj
+
+    with _lock:
+        proj = _projections.get(key)
+        if proj is None:
+            path = projection_path(in_dim, out_dim)
+            if os.path.exists(path):
+                proj = np.load(path)
+            else:
+                proj = random_projection(in_dim, out_dim)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                np.save(path, proj)
+                print(f"🎲 Projection {in_dim} → {out_dim} créée : {path}")
+            _projections[key] = proj
+    return proj
+
+
+def _buffer(out_dim):
+    buf = getattr(_buffers, "vec", None)
+    if buf is None or buf.shape[1] != out_dim:
+        buf = np.empty((1, out_dim), dtype=np.float32)
+        _buffers.vec = buf
+    return buf
+
+
+def project(vec, out_dim):
+    """
+    vec : (n, d) ou (d,) → (n, out_dim) float32.
+    Pour n = 1 le résultat est le buffer du thread : à copier / normaliser avant l'appel suivant.
+    """
+    vec = np.atleast_2d(np.asarray(vec, dtype=np.float32))
+    if vec.shape[1] == out_dim:
+        return vec
+
+    proj = get_projection(vec.shape[1], out_dim)
+    if vec.shape[0] == 1:
+        return np.dot(vec, proj, out=_buffer(out_dim))
+    return vec @ proj
+
+
+def benchmark(in_dim=384, out_dim=1024, n_queries=2000):
+    """
+    Coût par requête : ancienne version (reseed + randn + matmul à chaque appel)
+    vs projection persistée + buffer préalloué.
+    """
+    queries = np.random.default_rng(0).standard_normal((n_queries, in_dim)).astype(np.float32)
+
+    def legacy(vec):
+        np.random.seed(SEED)
+        proj = np.random.randn(vec.shape[1], out_dim).astype(np.float32) / np.sqrt(vec.shape[1])
+        return np.dot(vec, proj)
+
+    report = {}
+    for name, fn in (("legacy", legacy), ("cached", lambda v: project(v, out_dim))):
+        fn(queries[:1])  # chauffe (création / lecture de la matrice)
+        t0 = time.perf_counter()
+        for q in queries:
+            fn(q[None, :])
+        report[name] = round((time.perf_counter() - t0) / n_queries * 1e6, 1)
+
+    assert np.allclose(legacy(queries[:1]), project(queries[:1], out_dim), atol=1e-5)
+    return {"in_dim": in_dim, "out_dim": out_dim, "us_per_query": report,
+            "speedup": round(report["legacy"] / report["cached"], 1)}
+
+
+if __name__ == "__main__":
+    # python -m ia.faiss.projection  → coût par requête pour des modèles 384 / 768 dims
+    for dim in (384, 768):
+        print(benchmark(dim))
@@ -0,0 +1,105 @@
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import Config
+from ia.faiss import index_registry
+from ia.history_handler import get_user_history, rank_relevant_history
+
+# ============================================================
+# QUERY FEATURES : UN SEUL ENCODE PAR REQUÊTE
+# ============================================================
+# Tous les textes nécessaires à une requête (tokens, query complète, historique)
+# sont dédupliqués puis encodés en un seul batch. Les tokens matchés dans les
+# metadata sont un sous-ensemble des tokens de la query : ils sont déjà dans le batch.
+
+TOKEN_RE = re.compile(r"[a-zA-Z0-9éèêàùôîç]+")
+
+_cache = OrderedDict()  # {(model, text): np.array}
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "batches": 0}
+
+
+def tokenize_query(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+def encode_texts(embedder, texts):
+    """
+    Encode `texts` (ordre conservé) avec cache LRU persistant entre requêtes.
+    Les textes absents du cache sont encodés en un seul appel embedder.encode().
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    model_key = Config.RAG_MODEL
+    unique = list(dict.fromkeys(texts))
+    found = {}
+    missing = []
+
+    with _cache_lock:
+        for t in unique:
+            v = _cache.get((model_key, t))
+            if v is not None:
+                _cache.move_to_end((model_key, t))
+                found[t] = v
+                _cache_stats["hits"] += 1
+            else:
+                missing.append(t)
+
+    if missing:
+        vecs = np.atleast_2d(embedder.encode(missing, convert_to_numpy=True)).astype(np.float32)
+
+        with _cache_lock:
+            _cache_stats["misses"] += len(missing)
+            _cache_stats["batches"] += 1
+            for t, v in zip(missing, vecs):
+                found[t] = v
+                _cache[(model_key, t)] = v
+            while len(_cache) > Config.QUERY_EMBED_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    return np.vstack([found[t] for t in texts])
+
+
+def build_query_features(query, user_ip=None, embedder=None, top_k_history=3, min_similarity=0.8):
+    """
+    Retourne :
+    - tokens / token_vecs : tokens de la query et leurs embeddings (n, d)
+    - token_vec           : {token: embedding}
+    - query_vec           : embedding brut de la query complète (d,)
+    - history / history_vecs : historique pertinent et ses embeddings
+    """
+    if embedder is None:
+        embedder = index_registry.get_embedder()
+
+    tokens = tokenize_query(query)
+    history = get_user_history(user_ip) if user_ip else []
+
+    vecs = encode_texts(embedder, tokens + [query] + history)
+
+    n = len(tokens)
+    token_vecs = vecs[:n]
+    query_vec = vecs[n]
+    all_history_vecs = vecs[n + 1:]
+
+    relevant = []
+    if history:
+        relevant = rank_relevant_history(query_vec, all_history_vecs, top_k_history, min_similarity)
+        if relevant:
+            print(f"[HISTORY] Found {len(relevant)} relevant history items for user {user_ip}.")
+
+    return {
+        "query": query,
+        "tokens": tokens,
+        "token_vecs": token_vecs,
+        "token_vec": {t: v for t, v in zip(tokens, token_vecs)},
+        "query_vec": query_vec,
+        "history": [history[i] for i in relevant],
+        "history_vecs": all_history_vecs[relevant] if relevant else None,
+    }
+
+
+def get_cache_stats():
+    with _cache_lock:
+        return {**_cache_stats, "size": len(_cache), "max_size": Config.QUERY_EMBED_CACHE_SIZE}
@@ -3,15 +3,15 @@ import os
 import re
 import json
 import asyncio
-from urllib.parse import urljoin, urlparse
 
 import pandas as pd
-from bs4 import BeautifulSoup
 from PyPDF2 import PdfReader
 from docx import Document
-from playwright.async_api import async_playwright
 
-from ia.faiss.faiss_handler import retrieve, faiss_index_handler
+from ia.faiss.faiss_handler import (
+    retrieve, faiss_index_handler, remove_documents, document_id_ranges, embed_chunks, shard_legacy_index
+)
+from ia.faiss import archive_manifest, index_pipeline, index_registry, web_crawler
 from config import Config
 
 # ============================================================
@@ -23,6 +23,11 @@ HARD_MAX_CHARS = 2400   # coupure de sécurité (~650 tokens)
 MIN_CHARS = 120         # évite le bruit
 OVERLAP_CHARS = 120     # continuité sémantique sans explosion
 
+ARCHIVE_EXTENSIONS = (".txt", ".md", ".log", ".sql", ".json", ".pdf", ".docx", ".csv", ".xlsx", ".xls")
+
+MANIFEST_FILE = os.path.join(Config.INDEX_FAISS, "archive_manifest.json")
+MANIFEST_WORKFLOW_FILE = os.path.join(Config.INDEX_FAISS, "archive_manifest_workflow.json")
+
 
 # ============================================================
 # UTILS
@@ -138,17 +143,12 @@ def smart_chunk_auto(content, filename=""):
 # WEB SCRAPING
 # ============================================================
 
-async def scrap_page(url, start_url, to_visit, visited, documents, all_chunks, metadata):
-    try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            await page.goto(url, wait_until="domcontentloaded", timeout=60000)
-            html = await page.content()
-            await browser.close()
-
-        soup = BeautifulSoup(html, "html.parser")
-
+def page_extractor(documents, all_chunks, metadata):
+    """
+    Callback du crawler : chunks + metadata d'une page déjà parsée.
+    Retourne le nb de blocs de texte (0 → page à rendre avec Chromium).
+    """
+    def on_page(url, start_url, soup):
         for tag in soup(["script", "style", "nav", "footer", "header", "noscript"]):
             tag.decompose()
 
@@ -171,24 +171,21 @@ async def scrap_page(url, start_url, to_visit, visited, documents, all_chunks, m
                     "chunk": i
                 })
 
-        documents.append({
-            "url": url,
-            "text": soup.get_text(" ", strip=True)
-        })
-
-        for link in soup.find_all("a", href=True):
-            new_url = urljoin(url, link["href"])
-            if urlparse(new_url).netloc == urlparse(start_url).netloc:
-                if new_url not in visited and new_url not in to_visit:
-                    to_visit.append(new_url)
+        if blocks:
+            documents.append({
+                "url": url,
+                "text": soup.get_text(" ", strip=True)
+            })
+        return len(blocks)
 
-        await asyncio.sleep(0.1)
-
-    except Exception as e:
-        print(f"[WEB ERROR] {url}: {e}")
+    return on_page
 
 
 async def scrap_web_ressource(max_pages_per_site=10):
+    """
+    Retourne (all_chunks, metadata, http_cache) : le cache ETag n'est à sauvegarder
+    (web_crawler.save_http_cache) qu'une fois les chunks indexés.
+    """
     urls = []
 
     for file in os.listdir(Config.RAG_WEB_ARCHIVE_PATH):
@@ -198,95 +195,179 @@ async def scrap_web_ressource(max_pages_per_site=10):
                 urls.extend(data.get("urls", []))
 
     documents, all_chunks, metadata = [], [], []
+    http_cache = web_crawler.load_http_cache()
 
-    for start_url in urls:
-        visited, to_visit = set(), [start_url]
-        while to_visit and len(visited) < max_pages_per_site:
-            url = to_visit.pop(0)
-            if url in visited:
-                continue
-            visited.add(url)
-            await scrap_page(url, start_url, to_visit, visited, documents, all_chunks, metadata)
+    async with web_crawler.Crawler(page_extractor(documents, all_chunks, metadata), cache=http_cache) as crawler:
+        await crawler.crawl(urls, max_pages_per_site)
 
-    return  all_chunks, metadata
+    return all_chunks, metadata, http_cache
 
 
 # ============================================================
 # LOCAL ARCHIVE
 # ============================================================
 
-def chunk_documents_from_archive(archive):
-    all_chunks, metadata = [], []
-
+def list_archive_files(archive):
+    paths = []
     for root, _, files in os.walk(archive):
         for filename in files:
-            path = os.path.join(root, filename)
-            try:
-                text = ""
+            if filename.lower().endswith(ARCHIVE_EXTENSIONS):
+                paths.append(os.path.join(root, filename))
+    return paths
+
+
+def extract_text(path):
+    filename = os.path.basename(path)
+    text = ""
 
-                if filename.lower().endswith((".txt", ".md", ".log", ".sql", ".json")):
-                    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                        text = f.read()
+    if filename.lower().endswith((".txt", ".md", ".log", ".sql", ".json")):
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()
 
-                elif filename.lower().endswith(".pdf"):
-                    reader = PdfReader(path)
-                    for p in reader.pages:
-                        if p.extract_text():
-                            text += p.extract_text() + "\n"
+    elif filename.lower().endswith(".pdf"):
+        reader = PdfReader(path)
+        pages = (p.extract_text() for p in reader.pages)
+        text = "".join(t + "\n" for t in pages if t)
 
-                elif filename.lower().endswith(".docx"):
-                    doc = Document(path)
-                    text = "\n".join(p.text for p in doc.paragraphs if p.text.strip())
+    elif filename.lower().endswith(".docx"):
+        doc = Document(path)
+        text = "\n".join(p.text for p in doc.paragraphs if p.text.strip())
 
-                elif filename.lower().endswith(".csv"):
-                    df = pd.read_csv(path, dtype=str, sep=None, engine="python")
-                    text = df.to_string(index=False)
+    elif filename.lower().endswith(".csv"):
+        df = pd.read_csv(path, dtype=str, sep=None, engine="python")
+        text = df.to_string(index=False)
 
-                elif filename.lower().endswith((".xlsx", ".xls")):
-                    df = pd.read_excel(path, dtype=str)
-                    text = df.to_string(index=False)
+    elif filename.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(path, dtype=str)
+        text = df.to_string(index=False)
 
-                if not text.strip():
-                    continue
+    return text
 
-                chunks = apply_overlap(smart_chunk_auto(text, filename))
 
-                for i, c in enumerate(chunks):
-                    all_chunks.append(c)
-                    metadata.append({
-                        "type": os.path.splitext(filename)[1][1:],
-                        "source": filename,
-                        "path": path,
-                        "chunk": i
-                    })
+def chunk_file(path):
+    """
+    Extraction + chunking d'un fichier (exécuté dans les process du pipeline).
+    Retourne (chunks, metadata, error).
+    """
+    filename = os.path.basename(path)
+    try:
+        text = extract_text(path)
+    except Exception as e:
+        print(f"[ARCHIVE ERROR] {path}: {e}")
+        return [], [], str(e)
+
+    if not text.strip():
+        return [], [], None
+
+    chunks = apply_overlap(smart_chunk_auto(text, filename))
+    metadata = [
+        {
+            "type": os.path.splitext(filename)[1][1:],
+            "source": filename,
+            "path": path,
+            "chunk": i
+        }
+        for i in range(len(chunks))
+    ]
+    return chunks, metadata, None
+
+
+def chunk_documents_from_archive(archive, paths=None, errors=None):
+    """
+    Version séquentielle (petits volumes / debug).
+    paths  : sous-ensemble de fichiers à traiter (par défaut toute l'archive)
+    errors : liste complétée avec les fichiers en erreur
+    """
+    all_chunks, metadata = [], []
 
-            except Exception as e:
-                print(f"[ARCHIVE ERROR] {path}: {e}")
+    if paths is None:
+        paths = list_archive_files(archive)
+
+    for path in paths:
+        chunks, meta, error = chunk_file(path)
+        all_chunks.extend(chunks)
+        metadata.extend(meta)
+        if error and errors is not None:
+            errors.append(path)
 
     return all_chunks, metadata
 
 
+def _embed_batch(chunks):
+    return embed_chunks(chunks, index_registry.get_embedder())
+
+
+def index_archive(archive, workflow: bool):
+    """
+    Réindexation incrémentale d'une archive locale :
+    seuls les fichiers nouveaux ou modifiés (hash) sont relus et encodés,
+    les chunks des fichiers modifiés ou supprimés sont retirés de l'index.
+    Extraction / embedding / ajout tournent en pipeline (index_pipeline) ;
+    le manifest est sauvegardé à chaque checkpoint : un arrêt en cours de route
+    reprend là où il s'était arrêté.
+    """
+    manifest_file = MANIFEST_WORKFLOW_FILE if workflow else MANIFEST_FILE
+    manifest = archive_manifest.load_manifest(manifest_file)
+
+    if Config.FAISS_SHARDING:
+        # index historique monolithique → shards par famille (une seule fois)
+        shard_legacy_index(workflow)
+
+    plan = archive_manifest.plan_reindex(manifest, archive, list_archive_files(archive))
+    print(
+        f"[REINDEX] {archive} : {len(plan['new'])} nouveaux, {len(plan['changed'])} modifiés, "
+        f"{len(plan['deleted'])} supprimés, {len(plan['unchanged'])} inchangés"
+    )
+
+    # fichiers "nouveaux" déjà présents dans le store : reste d'un run interrompu
+    # entre l'écriture du store et celle du manifest → on repart de zéro pour eux
+    indexed = document_id_ranges(workflow)
+    orphans = [p for p in plan["new"] if p in indexed]
+
+    stale = plan["changed"] + plan["deleted"] + orphans
+    if stale:
+        remove_documents(stale, workflow)
+        archive_manifest.forget_files(manifest, stale)
+
+    to_parse = plan["new"] + plan["changed"]
+    if not to_parse:
+        if stale:
+            archive_manifest.refresh_ranges(manifest, document_id_ranges(workflow))
+            archive_manifest.save_manifest(manifest, manifest_file)
+        return bool(stale)
+
+    def commit(files, chunks, metadata, embeddings):
+        if chunks:
+            faiss_index_handler(chunks, metadata, workflow, embeddings=embeddings)
+        errors = [path for path, _, error in files if error]
+        archive_manifest.record_files(manifest, [path for path, _, _ in files], plan["hashes"], {}, errors)
+        archive_manifest.save_manifest(manifest, manifest_file)
+
+    index_pipeline.run_pipeline(to_parse, chunk_file, _embed_batch, commit)
+
+    archive_manifest.refresh_ranges(manifest, document_id_ranges(workflow))
+    archive_manifest.save_manifest(manifest, manifest_file)
+    return True
+
+
 # ============================================================
 # MAIN
 # ============================================================
 
 def main():
 
-    all_chunks_local, metadata_local = chunk_documents_from_archive(Config.WORKFLOW_ARCHIVE)
-    if all_chunks_local:
-        faiss_index_handler(all_chunks_local, metadata_local, True)
+    if index_archive(Config.WORKFLOW_ARCHIVE, True):
         print("✅ Indexation workflow terminée")
         
-    all_chunks_local, metadata_local = chunk_documents_from_archive(Config.RAG_ARCHIVE_PATH)
-    if all_chunks_local:
-        faiss_index_handler(all_chunks_local, metadata_local, False)
+    if index_archive(Config.RAG_ARCHIVE_PATH, False):
         print("✅ Indexation locale terminée")
 
 
-    all_chunks_web, metadata_web = asyncio.run(scrap_web_ressource())
+    all_chunks_web, metadata_web, http_cache = asyncio.run(scrap_web_ressource())
     if all_chunks_web:
         faiss_index_handler(all_chunks_web, metadata_web, False)
         print("✅ Indexation web terminée")
+    web_crawler.save_http_cache(http_cache)
 
     print("--- SUCCESS FAISS ARCHIVE ---")
 
@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import threading
+from config import Config
+
+# ============================================================
+# SHARDS FAISS PAR FAMILLE DE DOCUMENTS
+# ============================================================
+# Chaque index de base ("general" / "workflow") est découpé en shards :
+#   <base>__<famille>   ex : general__factures, general__web, workflow__documentation_machines
+# Famille = premier dossier sous la racine de l'archive (sinon type de document).
+# Un shard = un index FAISS complet (chunk store, BM25, sources, params) :
+# il se reconstruit seul et le routeur ne cherche que dans les familles utiles.
+# Les index historiques non shardés ("general" / "workflow") restent interrogés.
+
+SEP = "__"
+BASES = ("general", "workflow")
+REGISTRY_FILE = os.path.join(Config.INDEX_FAISS, "faiss_shards.json")
+
+_lock = threading.Lock()
+
+
+def index_key(workflow):
+    """
+    Clé d'index : bool historique (workflow True / False) ou nom de shard.
+    """
+    if isinstance(workflow, str):
+        return workflow
+    return "workflow" if workflow else "general"
+
+
+def base_of(workflow):
+    return index_key(workflow).split(SEP)[0]
+
+
+def family_of_key(key):
+    return key.split(SEP, 1)[1] if SEP in key else None
+
+
+def file_suffix(key):
+    # noms historiques conservés : faiss_index.idx / faiss_index_workflow.idx
+    return "" if key == "general" else f"_{key}"
+
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_") or "divers"
+
+
+def family_of(meta):
+    """
+    Famille d'un chunk : "web", sinon premier dossier du chemin sous l'archive.
+    """
+    if meta.get("type") == "web":
+        return "web"
+
+    path = os.path.normpath(meta.get("path") or "")
+    for root in (Config.WORKFLOW_ARCHIVE, Config.RAG_ARCHIVE_PATH):
+        root = os.path.normpath(root)
+        if path.startswith(root + os.sep):
+            parts = os.path.relpath(path, root).split(os.sep)
+            if len(parts) > 1:
+                return _slug(parts[0])
+            break
+
+    return _slug(meta.get("type") or "divers")
+
+
+def shard_key(base, family):
+    return f"{base}{SEP}{family}"
+
+
+# ----------------- Registre des shards -----------------
+def load_registry():
+    if not os.path.exists(REGISTRY_FILE):
+        return {}
+    with open(REGISTRY_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def register(keys):
+    with _lock:
+        registry = load_registry()
+        new = [k for k in keys if k not in registry]
+        if not new:
+            return
+        for k in new:
+            registry[k] = {"base": base_of(k), "family": family_of_key(k)}
+        os.makedirs(os.path.dirname(REGISTRY_FILE), exist_ok=True)
+        tmp = REGISTRY_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(registry, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, REGISTRY_FILE)
+
+
+def unregister(keys):
+    """
+    Retire des shards vidés (tous leurs documents supprimés) : plus interrogés.
+    Un nouveau document de la famille les réenregistre (register).
+    """
+    with _lock:
+        registry = load_registry()
+        gone = [k for k in keys if k in registry]
+        if not gone:
+            return
+        for k in gone:
+            del registry[k]
+        tmp = REGISTRY_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(registry, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, REGISTRY_FILE)
+
+
+def list_shards(base, families=None):
+    """
+    Shards enregistrés pour `base`, restreints à `families` si fourni.
+    """
+    wanted = None if families is None else {_slug(f) for f in families}
+    return sorted(
+        k for k, v in load_registry().items()
+        if v["base"] == base and (wanted is None or v["family"] in wanted)
+    )
@@ -0,0 +1,110 @@
+import os
+import pickle
+
+# ============================================================
+# INDEX INVERSÉ DES NOMS DE SOURCES (BOOST METADATA)
+# ============================================================
+# Remplace le scan linéaire re.search(token, source) sur toutes les metadata :
+# - une entrée par source distincte (avec le nombre de chunks associés)
+# - index n-gram (trigrammes) → ids de sources
+# Un token est résolu par intersection des postings de ses trigrammes,
+# puis vérification "token in source" sur les quelques candidats.
+
+NGRAM = 3
+VERSION = 1
+
+
+def new_source_index():
+    return {
+        "version": VERSION,
+        "sources": [],      # [source_low]
+        "source_ids": {},   # {source_low: id}
+        "counts": [],       # [nb de chunks metadata pour cette source]
+        "grams": {},        # {trigramme: set(ids)}
+    }
+
+
+def _grams(text):
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def add_metadata(sidx, metadata_list):
+    """
+    Ajout incrémental : seules les nouvelles metadata sont parcourues.
+    """
+    for meta in metadata_list:
+        source = meta.get("source", "")
+        if not isinstance(source, str):
+            continue
+
+        source_low = source.lower()
+        sid = sidx["source_ids"].get(source_low)
+
+        if sid is None:
+            sid = len(sidx["sources"])
+            sidx["sources"].append(source_low)
+            sidx["source_ids"][source_low] = sid
+            sidx["counts"].append(0)
+            for g in _grams(source_low):
+                sidx["grams"].setdefault(g, set()).add(sid)
+
+        sidx["counts"][sid] += 1
+
+    return sidx
+
+
+def remove_metadata(sidx, metadata_list):
+    """
+    Retrait de metadata supprimées (fichiers effacés / modifiés).
+    """
+    for meta in metadata_list:
+        source = meta.get("source", "")
+        if not isinstance(source, str):
+            continue
+
+        sid = sidx["source_ids"].get(source.lower())
+        if sid is not None and sidx["counts"][sid] > 0:
+            sidx["counts"][sid] -= 1
+
+    return sidx
+
+
+def build_source_index(metadata_list):
+    return add_metadata(new_source_index(), metadata_list)
+
+
+def match_count(sidx, token):
+    """
+    Nombre d'entrées metadata dont la source contient `token`
+    (même sémantique que l'ancien re.search(re.escape(tok), source_low)).
+    """
+    if len(token) >= NGRAM:
+        candidates = None
+        for g in _grams(token):
+            ids = sidx["grams"].get(g)
+            if not ids:
+                return 0
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                return 0
+    else:
+        # tokens courts : pas de trigramme, on parcourt les sources distinctes
+        candidates = range(len(sidx["sources"]))
+
+    sources = sidx["sources"]
+    counts = sidx["counts"]
+    return sum(counts[sid] for sid in candidates if token in sources[sid])
+
+
+def save_source_index(sidx, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(sidx, f)
+
+
+def load_source_index(path):
+    with open(path, "rb") as f:
+        sidx = pickle.load(f)
+    if sidx.get("version") != VERSION:
+        return None
+    return sidx
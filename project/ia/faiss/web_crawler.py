@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urljoin, urlparse, urldefrag
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import aiohttp
+from bs4 import BeautifulSoup
+from playwright.async_api import async_playwright
+
+from config import Config
+
+# ============================================================
+# CRAWLER WEB CONCURRENT
+# ============================================================
+# - un seul Chromium partagé, pool de pages réutilisées (WEB_BROWSER_PAGES)
+# - chemin rapide HTTP (aiohttp) pour les pages statiques, Chromium seulement
+#   si la page n'apporte aucun contenu sans JS (mode "auto")
+# - GET conditionnel (ETag / Last-Modified) : une page inchangée (304) n'est
+#   ni retéléchargée ni rechunkée, ses liens sont repris du cache
+# - frontière par site : deque + set, limite de requetes par domaine
+#
+# on_page(url, start_url, soup) -> nb de blocs extraits (0 = page vide)
+# Les liens sont lus APRÈS on_page (qui retire nav / footer / header).
+
+HTTP_CACHE_FILE = os.path.join(Config.INDEX_FAISS, "web_http_cache.json")
+USER_AGENT = "Mozilla/5.0 (compatible; rag-crawler)"
+
+
+def load_http_cache(path=HTTP_CACHE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_http_cache(cache, path=HTTP_CACHE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def same_site_links(soup, url, start_url):
+    netloc = urlparse(start_url).netloc
+    links = []
+    for link in soup.find_all("a", href=True):
+        new_url = urldefrag(urljoin(url, link["href"]))[0]
+        if urlparse(new_url).netloc == netloc:
+            links.append(new_url)
+    return links
+
+
+class Crawler:
+
+    def __init__(self, on_page, cache=None, mode=None, concurrency=None, per_domain=None, browser_pages=None):
+        self.on_page = on_page
+        self.cache = {} if cache is None else cache
+        self.mode = mode or Config.WEB_CRAWL_MODE
+        self.per_domain = per_domain or Config.WEB_CRAWL_PER_DOMAIN
+        self.browser_pages = browser_pages or Config.WEB_BROWSER_PAGES
+
+        self._global = asyncio.Semaphore(concurrency or Config.WEB_CRAWL_CONCURRENCY)
+        self._domains = {}
+        self._session = None
+        self._playwright = None
+        self._browser = None
+        self._pages = None
+        self._browser_lock = asyncio.Lock()
+
+        self.stats = {"http": 0, "browser": 0, "not_modified": 0, "skipped": 0, "errors": 0}
+
+    # ----------------- Ressources partagées -----------------
+    async def __aenter__(self):
+        timeout = aiohttp.ClientTimeout(total=Config.WEB_CRAWL_TIMEOUT)
+        self._session = aiohttp.ClientSession(timeout=timeout, headers={"User-Agent": USER_AGENT})
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        if self._browser is not None:
+            await self._browser.close()
+            await self._playwright.stop()
+
+    async def _page_pool(self):
+        # Chromium lancé une seule fois, au premier besoin
+        async with self._browser_lock:
+            if self._browser is None:
+                self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+                self._pages = asyncio.Queue()
+                for _ in range(self.browser_pages):
+                    context = await self._browser.new_context(user_agent=USER_AGENT)
+                    self._pages.put_nowait(await context.new_page())
+        return self._pages
+
+    def _domain_limit(self, url):
+        netloc = urlparse(url).netloc
+        if netloc not in self._domains:
+            self._domains[netloc] = asyncio.Semaphore(self.per_domain)
+        return self._domains[netloc]
+
+    # ----------------- Fetch -----------------
+    async def _fetch_http(self, url):
+        """
+        (status, html) ; status 304 si inchangé depuis le dernier passage.
+        """
+        entry = self.cache.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        async with self._session.get(url, headers=headers) as resp:
+            if resp.status == 304:
+                return 304, None, resp.headers
+            resp.raise_for_status()
+            if "html" not in resp.headers.get("Content-Type", "html"):
+                return resp.status, None, resp.headers
+            return resp.status, await resp.text(errors="ignore"), resp.headers
+
+    async def _fetch_browser(self, url):
+        pages = await self._page_pool()
+        page = await pages.get()
+        try:
+            await page.goto(url, wait_until="domcontentloaded", timeout=Config.WEB_CRAWL_TIMEOUT * 1000)
+            return await page.content()
+        finally:
+            pages.put_nowait(page)
+
+    async def fetch(self, url, start_url):
+        """
+        Traite une page et retourne ses liens internes au site.
+        """
+        # domaine d'abord : une requete en attente de son domaine ne bloque pas un slot global
+        async with self._domain_limit(url), self._global:
+            try:
+                html, headers = None, {}
+
+                if self.mode in ("auto", "http"):
+                    status, html, headers = await self._fetch_http(url)
+                    if status == 304:
+                        self.stats["not_modified"] += 1
+                        return self.cache.get(url, {}).get("links", [])
+                    if html is None:
+                        self.stats["skipped"] += 1
+                        return []
+
+                    soup = BeautifulSoup(html, "html.parser")
+                    if self.on_page(url, start_url, soup) or self.mode == "http":
+                        self.stats["http"] += 1
+                        return self._remember(url, start_url, soup, headers)
+
+                # page rendue en JS (ou mode "browser")
+                html = await self._fetch_browser(url)
+                soup = BeautifulSoup(html, "html.parser")
+                self.on_page(url, start_url, soup)
+                self.stats["browser"] += 1
+                return self._remember(url, start_url, soup, headers)
+
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[WEB ERROR] {url}: {e}")
+                return []
+
+    def _remember(self, url, start_url, soup, headers):
+        links = same_site_links(soup, url, start_url)
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if etag or last_modified:
+            self.cache[url] = {"etag": etag, "last_modified": last_modified, "links": links}
+        else:
+            self.cache.pop(url, None)
+        return links
+
+    # ----------------- Frontière -----------------
+    async def crawl_site(self, start_url, max_pages):
+        start_url = urldefrag(start_url)[0]
+        frontier = deque([start_url])
+        seen = {start_url}
+        running = set()
+        visited = 0
+
+        while frontier or running:
+            while frontier and visited < max_pages and len(running) < self.per_domain:
+                running.add(asyncio.create_task(self.fetch(frontier.popleft(), start_url)))
+                visited += 1
+
+            if not running:
+                break
+
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for link in task.result():
+                    if link not in seen:
+                        seen.add(link)
+                        frontier.append(link)
+
+        return visited
+
+    async def crawl(self, start_urls, max_pages_per_site):
+        t0 = time.perf_counter()
+        visited = await asyncio.gather(*(self.crawl_site(u, max_pages_per_site) for u in start_urls))
+        elapsed = time.perf_counter() - t0
+        pages = sum(visited)
+        print(
+            f"🌐 {pages} pages en {elapsed:.2f}s ({pages / elapsed if elapsed else 0:.1f} pages/s) | "
+            + ", ".join(f"{k}={v}" for k, v in self.stats.items())
+        )
+        return pages
+
+
+# ============================================================
+# BENCHMARK : SERVEUR HTTP LOCAL (FIXTURE)
+# ============================================================
+# python -m ia.faiss.web_crawler [nb_pages]
+# Site synthétique : /page/<i> (HTML statique, ETag stable, 3 liens par page),
+# latence simulée par requete. Mesure pages/s à froid puis avec le cache ETag.
+
+FIXTURE_LATENCY_S = 0.02
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    n_pages = 200
+
+    def do_GET(self):
+        time.sleep(FIXTURE_LATENCY_S)
+        try:
+            i = int(self.path.rstrip("/").rsplit("/", 1)[-1])
+        except ValueError:
+            i = 0
+        if not self.path.startswith("/page/") or not 0 <= i < self.n_pages:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = f'"page-{i}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        links = "".join(f'<a href="/page/{(i * 3 + k) % self.n_pages}">lien {k}</a>' for k in (1, 2, 3))
+        body = (
+            f"<html><body><article><h1>Page {i}</h1>"
+            f"<p>{'Contenu de test pour le benchmark du crawler. ' * 8}</p>"
+            f"{links}</article></body></html>"
+        ).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fixture_server(n_pages=200):
+    _FixtureHandler.n_pages = n_pages
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def benchmark(n_pages=200, concurrency_levels=(1, 4, 16)):
+    server = start_fixture_server(n_pages)
+    start_url = f"http://127.0.0.1:{server.server_address[1]}/page/0"
+
+    def on_page(url, start, soup):
+        return len(soup.find_all("p"))
+
+    report = []
+    for concurrency in concurrency_levels:
+        cache = {}
+        for run in ("froid", "cache ETag"):
+            async with Crawler(on_page, cache=cache, mode="http", concurrency=concurrency, per_domain=concurrency) as crawler:
+                t0 = time.perf_counter()
+                pages = await crawler.crawl([start_url], n_pages)
+                elapsed = time.perf_counter() - t0
+            report.append({
+                "concurrency": concurrency,
+                "run": run,
+                "pages": pages,
+                "pages_per_s": round(pages / elapsed, 1),
+                **crawler.stats,
+            })
+
+    server.shutdown()
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for r in asyncio.run(benchmark(n)):
+        print(r)
@@ -1,8 +1,8 @@
 
 
-import torch
 from config import Config
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from concurrent.futures import TimeoutError
+from ia import hf_batcher, llm_scheduler
 import re
 
 def prompt_on_sql_data(user_ip, initial_user_query, sql_data, schema_sql, model, tokenizer):
@@ -38,30 +38,23 @@ def prompt_on_sql_data(user_ip, initial_user_query, sql_data, schema_sql, model,
     Demande initiale de l'utilisateur :
     {initial_user_query}
     """
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-    
-    def run_generation():
-        with torch.no_grad():
-            return model.generate(
-                **inputs,
-                max_new_tokens=3000, # besoin de verbillage ici pour mon script et son esthetique // reprendre avec chunk et streaming 
-                do_sample=False
-            )
-
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(run_generation)
-        try:
-            output = future.result(timeout=Config.SERVER_TIMEOUT)  # timeout
-            # Décoder les tokens générés
-            decoded_text = tokenizer.decode(output[0], skip_special_tokens=True)
-
-            match = re.search(r"(<html.*</html>)", decoded_text, flags=re.DOTALL | re.IGNORECASE)
-            if match:
-                html_template = match.group(1)
-            else:
-                html_template = decoded_text
-                
-            return html_template
-
-        except TimeoutError:
-            return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"        
\ No newline at end of file
+    try:
+        # décodé en batch avec les autres générations HF de même longueur max
+        decoded_text = hf_batcher.generate(
+            model, tokenizer, prompt,
+            max_new_tokens=3000, # besoin de verbillage ici pour mon script et son esthetique // reprendre avec chunk et streaming 
+            timeout=Config.SERVER_TIMEOUT, name="sql_html"
+        )
+
+        match = re.search(r"(<html.*</html>)", decoded_text, flags=re.DOTALL | re.IGNORECASE)
+        if match:
+            html_template = match.group(1)
+        else:
+            html_template = decoded_text
+            
+        return html_template
+
+    except TimeoutError:
+        return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"
+    except llm_scheduler.QueueFull as e:
+        return str(e)
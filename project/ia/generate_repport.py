@@ -11,6 +11,7 @@ from pathlib import Path
 import os
 import os.path as op
 import re
+import json
 from config import Config
 
 # ======================================================
@@ -377,6 +378,23 @@ def repportLLM(result_llm, anomaly, prompt):
     generate_pdf_report(str(filename), anomaly, result_llm)
     return str(filename)
 
+def save_prompt(messages, anomaly):
+    # prompt envoyé au LLM, gardé à côté du rapport (rejouable : python -m ia.speculative)
+    # uniquement si Config.LLM_RECORD_PROMPTS : un fichier par anomalie sinon
+    if not Config.LLM_RECORD_PROMPTS:
+        return None
+    folder = Path(
+        Config.rapport_llm_export,
+        datetime.now().strftime("%Y%m%d"),
+        "anomaly"
+    )
+    folder.mkdir(parents=True, exist_ok=True)
+
+    filename = folder / f"prompt_anomalie_{anomaly.get('id')}.json"
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({"anomaly_id": anomaly.get("id"), "messages": messages}, f, ensure_ascii=False, indent=2)
+    return str(filename)
+
 def download_report(repport_name):
     file_path = op.join(Config.rapport_llm_export, repport_name)
     if not os.path.exists(file_path):
@@ -0,0 +1,321 @@
+import sys
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from config import Config
+from ia import llm_scheduler
+
+# ============================================================
+# MICRO-BATCHING DES GÉNÉRATIONS HF (transformers)
+# ============================================================
+# Plusieurs utilisateurs qui demandent une réponse SQL / RAG en même temps :
+# au lieu d'un model.generate par prompt, les requêtes sont collectées
+# pendant HF_BATCH_WAIT_MS, paddées à gauche et décodées ensemble (greedy),
+# un token par pas pour tout le batch, avec le KV cache partagé.
+# - arrêt par séquence : eos, max_new_tokens, chaîne d'arrêt (stop), annulation (timeout du job)
+#   => le résultat est rendu à l'appelant dès que SA séquence est finie
+# - un batch ne regroupe que des requêtes de même modèle et mêmes paramètres
+#   (max_new_tokens, repetition_penalty, no_repeat_ngram_size) : une réponse
+#   HTML de 3000 tokens ne retient pas les requêtes SQL de 300 tokens
+# - priorités / file bornée / timeouts : mêmes règles que llm_scheduler
+#   (Config.LLM_QUEUE_MAX, Config.LLM_TIMEOUTS, QueueFull, TimeoutError)
+#
+# Les requêtes HF passent par ici et non par la file de llm_scheduler :
+# celle-ci exécute un appel modèle à la fois, il n'y aurait jamais rien à grouper.
+
+_lock = threading.Lock()
+_not_empty = threading.Condition(_lock)
+_heap = []
+_seq = itertools.count()
+_worker = None
+
+_batch_sizes = deque(maxlen=500)
+_metrics = {
+    "requests": 0,
+    "batches": 0,
+    "rejected": 0,
+    "cancelled": 0,
+    "tokens": 0,
+    "decode_ms": 0.0,
+}
+
+
+class Request(llm_scheduler.Job):
+
+    def __init__(self, model, tokenizer, prompt, max_new_tokens, repetition_penalty,
+                 no_repeat_ngram_size, stop, priority, timeout, name):
+        super().__init__(None, priority, timeout, name)
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.repetition_penalty = repetition_penalty
+        self.no_repeat_ngram_size = no_repeat_ngram_size
+        self.stop = stop or []
+        self.key = (id(model), max_new_tokens, repetition_penalty, no_repeat_ngram_size)
+        self.tokens = []
+
+
+def generate(model, tokenizer, prompt, max_new_tokens=None, repetition_penalty=None,
+             no_repeat_ngram_size=None, stop=None, priority="chat", timeout=None, name=None):
+    """
+    Texte généré (greedy, sans le prompt) pour `prompt`, décodé dans un batch
+    avec les requêtes concurrentes ; coupé avant la première chaîne de `stop`
+    (arrêt de la séquence dès qu'elle apparaît). QueueFull si la file est pleine,
+    TimeoutError (requête annulée) si `timeout` expire.
+    """
+    timeout = Config.LLM_TIMEOUTS.get(priority) if timeout is None else timeout
+    request = Request(
+        model, tokenizer, prompt, max_new_tokens or Config.MAX_OUTPUT_TOKEN,
+        repetition_penalty, no_repeat_ngram_size, stop, priority, timeout, name,
+    )
+    _submit(request)
+    return request.wait(timeout)
+
+
+def _submit(request):
+    global _worker
+    with _not_empty:
+        pending = sum(1 for _, _, r in _heap if not r.cancelled())
+        if pending >= Config.LLM_QUEUE_MAX:
+            _metrics["rejected"] += 1
+            raise llm_scheduler.QueueFull(llm_scheduler.QUEUE_FULL_MESSAGE)
+        _metrics["requests"] += 1
+        heapq.heappush(_heap, (llm_scheduler.PRIORITIES[request.priority], next(_seq), request))
+        if _worker is None:
+            _worker = threading.Thread(target=_loop, name="hf-batcher", daemon=True)
+            _worker.start()
+        _not_empty.notify()
+
+
+# ----------------- Collecte des batchs -----------------
+def _take_batch():
+    # appelé sous _lock : requête la plus prioritaire + compatibles, le reste reste en file
+    batch, skipped = [], []
+    while _heap and len(batch) < Config.HF_BATCH_MAX:
+        entry = heapq.heappop(_heap)
+        request = entry[2]
+        if request.cancelled():
+            _metrics["cancelled"] += 1
+            request._done.set()
+        elif not batch or request.key == batch[0].key:
+            batch.append(request)
+        else:
+            skipped.append(entry)
+    for entry in skipped:
+        heapq.heappush(_heap, entry)
+    return batch
+
+
+def _loop():
+    while True:
+        with _not_empty:
+            while not _heap:
+                _not_empty.wait()
+            # fenêtre de collecte : quelques ms pour laisser arriver les requêtes concurrentes
+            deadline = time.perf_counter() + Config.HF_BATCH_WAIT_MS / 1000
+            while len(_heap) < Config.HF_BATCH_MAX:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                _not_empty.wait(remaining)
+            batch = _take_batch()
+
+        if not batch:
+            continue
+        now = time.perf_counter()
+        for request in batch:
+            request.started_at = now
+        try:
+            _run_batch(batch)
+        except BaseException as e:
+            for request in batch:
+                if not request._done.is_set():
+                    request.error = e
+                    request._done.set()
+
+
+# ----------------- Décodage en lockstep -----------------
+def _logits_processors(request):
+    from transformers import LogitsProcessorList, RepetitionPenaltyLogitsProcessor, NoRepeatNGramLogitsProcessor
+
+    processors = LogitsProcessorList()
+    if request.repetition_penalty and request.repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(request.repetition_penalty))
+    if request.no_repeat_ngram_size:
+        processors.append(NoRepeatNGramLogitsProcessor(request.no_repeat_ngram_size))
+    return processors
+
+
+_STOP_WINDOW = 8  # derniers tokens décodés pour détecter une chaîne d'arrêt
+
+
+def _stopped(request):
+    if not request.stop:
+        return False
+    tail = request.tokenizer.decode(request.tokens[-_STOP_WINDOW:], skip_special_tokens=True)
+    return any(s in tail for s in request.stop)
+
+
+def _finish(request):
+    text = request.tokenizer.decode(request.tokens, skip_special_tokens=True)
+    for s in request.stop:
+        if s in text:
+            text = text[:text.index(s)]
+    request.result = text.strip()
+    request._done.set()
+
+
+def _stop_token_ids(model, tokenizer):
+    # comme model.generate : eos de generation_config (int ou liste, fin de tour
+    # des modèles de chat : <|end|>, <|im_end|>...) + eos du tokenizer
+    ids = set()
+    config = getattr(model, "generation_config", None)
+    for eos in (getattr(config, "eos_token_id", None), tokenizer.eos_token_id):
+        if isinstance(eos, int):
+            ids.add(eos)
+        elif eos is not None:
+            ids.update(eos)
+    return ids
+
+
+def _run_batch(batch):
+    model, tokenizer = batch[0].model, batch[0].tokenizer
+    eos_ids = _stop_token_ids(model, tokenizer)
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    processors = _logits_processors(batch[0])
+
+    # padding à gauche : le dernier token de chaque prompt est aligné sur la dernière colonne
+    encoded = [tokenizer(r.prompt)["input_ids"] for r in batch]
+    width = max(len(ids) for ids in encoded)
+    input_ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+    for i, ids in enumerate(encoded):
+        input_ids[i, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[i, width - len(ids):] = 1
+    input_ids = input_ids.to(model.device)
+    attention_mask = attention_mask.to(model.device)
+
+    t0 = time.perf_counter()
+    active = [True] * len(batch)
+    sequences = input_ids
+    step_ids = input_ids
+    position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+    past = None
+
+    with torch.no_grad():
+        while True:
+            out = model(
+                input_ids=step_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past,
+                use_cache=True,
+            )
+            past = out.past_key_values
+            scores = processors(sequences, out.logits[:, -1, :].float())
+            next_tokens = scores.argmax(dim=-1)
+
+            for i, request in enumerate(batch):
+                if not active[i]:
+                    next_tokens[i] = pad_id
+                    continue
+                token = int(next_tokens[i])
+                if request.cancelled() or token in eos_ids:
+                    active[i] = False
+                    next_tokens[i] = pad_id
+                    _finish(request)
+                    continue
+                request.tokens.append(token)
+                if len(request.tokens) >= request.max_new_tokens or _stopped(request):
+                    active[i] = False
+                    _finish(request)
+
+            if not any(active):
+                break
+
+            # les séquences finies continuent en pad (ignorées) jusqu'à la fin du batch
+            step_ids = next_tokens[:, None]
+            sequences = torch.cat([sequences, step_ids], dim=-1)
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(batch), 1))], dim=-1)
+            position_ids = attention_mask.sum(-1, keepdim=True) - 1
+
+    with _lock:
+        _metrics["batches"] += 1
+        _metrics["tokens"] += sum(len(r.tokens) for r in batch)
+        _metrics["decode_ms"] += (time.perf_counter() - t0) * 1000
+        _batch_sizes.append(len(batch))
+
+
+def get_metrics():
+    with _lock:
+        sizes = list(_batch_sizes)
+        decode_s = _metrics["decode_ms"] / 1000
+        return {
+            "queue_depth": sum(1 for _, _, r in _heap if not r.cancelled()),
+            "batch_max": Config.HF_BATCH_MAX,
+            "batch_wait_ms": Config.HF_BATCH_WAIT_MS,
+            "batch_size_avg": round(sum(sizes) / len(sizes), 2) if sizes else None,
+            "tokens_per_s": round(_metrics["tokens"] / decode_s, 1) if decode_s else None,
+            **_metrics,
+            "decode_ms": round(_metrics["decode_ms"], 1),
+        }
+
+
+# ============================================================
+# BENCHMARK : DÉBIT (tokens/s) SELON LA CONCURRENCE
+# ============================================================
+# python -m ia.hf_batcher [nb_requetes] [max_new_tokens]
+# Même charge envoyée par 1, 2, 4, 8... appelants simultanés : tokens/s,
+# taille moyenne des batchs et latence p95.
+
+BENCH_PROMPTS = [
+    "Explique en une phrase le rôle d'un automate programmable.",
+    "Donne une cause possible d'un dépassement de durée sur un poste de vissage.",
+    "Qu'est-ce que le TRS d'une ligne de production ?",
+    "Cite deux vérifications à faire sur un vérin pneumatique lent.",
+]
+
+
+def benchmark(model, tokenizer, n_requests=16, max_new_tokens=64, concurrencies=(1, 2, 4, 8)):
+    generate(model, tokenizer, BENCH_PROMPTS[0], max_new_tokens=1)  # warm-up
+    report = []
+
+    for concurrency in concurrencies:
+        before = get_metrics()
+
+        def one(i):
+            t0 = time.perf_counter()
+            generate(model, tokenizer, BENCH_PROMPTS[i % len(BENCH_PROMPTS)], max_new_tokens=max_new_tokens)
+            return time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(one, range(n_requests)))
+        elapsed = time.perf_counter() - t0
+
+        latencies = sorted(results)
+        after = get_metrics()
+        batches = after["batches"] - before["batches"]
+        report.append({
+            "concurrency": concurrency,
+            "requests": n_requests,
+            "tokens_per_s": round((after["tokens"] - before["tokens"]) / elapsed, 1),
+            "batch_size_avg": round(n_requests / batches, 2) if batches else None,
+            "latency_p50_s": round(latencies[len(latencies) // 2], 2),
+            "latency_p95_s": round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+        })
+        print(report[-1])
+    return report
+
+
+if __name__ == "__main__":
+    import ia.model as model_utils
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    max_new = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    benchmark(model_utils.load_standard_model(), model_utils.load_tokenizer(), n, max_new)
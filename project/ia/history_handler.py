@@ -1,8 +1,7 @@
 
 from sklearn.preprocessing import normalize
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from config import Config 
+from ia.faiss import index_registry
 
 # 🔹 Gestion de l'historique en mémoire
 MAX_HISTORY = 5
@@ -44,23 +43,13 @@ def combine_query_with_history(query_vec, history_vecs):
 
 
 
-def filter_relevant_history(user_ip, query, top_k=3, min_similarity=0.8):
+def rank_relevant_history(query_vec, history_vecs, top_k=3, min_similarity=0.8):
     """
-    Retourne uniquement l'historique pertinent.
+    Indices de l'historique pertinent (similarité décroissante) à partir
+    de vecteurs déjà encodés.
     """
-    embedder = SentenceTransformer(Config.RAG_MODEL)
-    history = get_user_history(user_ip)
-
-    if not history:
-        return []
-
-    # Encodage
-    query_vec = embedder.encode([query], convert_to_numpy=True)
-    history_vecs = embedder.encode(history, convert_to_numpy=True)
-
-    # Normalisation
-    query_vec = normalize(query_vec, axis=1)
-    history_vecs = normalize(history_vecs, axis=1)
+    query_vec = normalize(np.atleast_2d(query_vec), axis=1)
+    history_vecs = normalize(np.atleast_2d(history_vecs), axis=1)
 
     # Similarité cosine
     similarities = (history_vecs @ query_vec.T).flatten()
@@ -72,5 +61,27 @@ def filter_relevant_history(user_ip, query, top_k=3, min_similarity=0.8):
 
     # Trier selon la similarité décroissante
     sorted_idx = relevant_indices[np.argsort(-similarities[relevant_indices])]
+    return list(sorted_idx[:top_k])
+
+
+def filter_relevant_history(user_ip, query, top_k=3, min_similarity=0.8):
+    """
+    Retourne uniquement l'historique pertinent.
+    """
+    history = get_user_history(user_ip)
+
+    if not history:
+        return []
+
+    # import local : query_features dépend de ce module
+    from ia.faiss.query_features import encode_texts
+
+    # Encodage (un seul batch, cache LRU partagé)
+    vecs = encode_texts(index_registry.get_embedder(), [query] + history)
+
+    sorted_idx = rank_relevant_history(vecs[0], vecs[1:], top_k, min_similarity)
+    if not sorted_idx:
+        return []
+
     print(f"[HISTORY] Found {len(sorted_idx)} relevant history items for user {user_ip}.")
-    return [history[i] for i in sorted_idx[:top_k]]
\ No newline at end of file
+    return [history[i] for i in sorted_idx]
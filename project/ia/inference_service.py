@@ -0,0 +1,369 @@
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import threading
+import socketserver
+import numpy as np
+from config import Config
+
+# ============================================================
+# DÉMON D'INFÉRENCE (GGUF + EMBEDDER BGE) + CLIENT LÉGER
+# ============================================================
+# Un seul process possède le modèle GGUF et l'embedder (python -m ia.inference_service).
+# L'app Flask, le scheduler de détection, les scripts... s'y connectent
+# (Config.INFERENCE_REMOTE) au lieu de charger chacun leur copie de plusieurs Go.
+#
+# Transport : socket Unix (Config.INFERENCE_ADDRESS = chemin) ou TCP localhost
+# ("127.0.0.1:port", Windows). Une connexion par requête.
+#
+# Protocole binaire, une trame :
+#   op (1 octet) | taille header (4) | taille blob (4) | header JSON utf-8 | blob
+# - embeddings : blob = float32 bruts (shape dans le header), pas de JSON de floats
+# - streaming  : une trame TOKEN par morceau (blob = texte utf-8), puis END
+# - annulation : le client ferme la connexion => génération arrêtée au token suivant
+#
+# Côté client, InferenceClient se présente comme un Llama « poolé »
+# (appel / create_chat_completion, stream ou non ; préfixe KV géré côté démon)
+# et comme un SentenceTransformer (encode) : le reste du code ne change pas.
+
+OP_GENERATE, OP_CHAT, OP_EMBED, OP_RETRIEVE, OP_PING = 1, 2, 3, 4, 5
+OP_TOKEN, OP_RESULT, OP_END, OP_ERROR = 16, 17, 18, 19
+
+_FRAME = struct.Struct("!BII")
+
+_serving = False  # True dans le process démon : retrieve / embedder locaux
+
+
+def remote_enabled():
+    return Config.INFERENCE_REMOTE and not _serving
+
+
+# ----------------- Trames -----------------
+def send_frame(sock, op, header=None, blob=b""):
+    head = json.dumps(header, ensure_ascii=False, default=str).encode("utf-8") if header is not None else b""
+    sock.sendall(_FRAME.pack(op, len(head), len(blob)) + head + blob)
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            raise ConnectionError("connexion fermée par le pair")
+        buf += part
+    return bytes(buf)
+
+
+def recv_frame(sock):
+    op, head_len, blob_len = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, head_len)) if head_len else None
+    blob = _recv_exact(sock, blob_len) if blob_len else b""
+    return op, header, blob
+
+
+def _parse_address(address):
+    if ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+# ============================================================
+# SERVEUR
+# ============================================================
+_model = None
+_model_lock = threading.Lock()  # un seul appel llama.cpp à la fois (hors pool)
+_started_at = time.time()
+_metrics_lock = threading.Lock()
+_metrics = {"generate": 0, "chat": 0, "embed": 0, "retrieve": 0, "errors": 0, "cancelled": 0}
+
+
+def _count(key):
+    with _metrics_lock:
+        _metrics[key] += 1
+
+
+def _load():
+    global _model
+    from ia.faiss import index_registry
+
+    if Config.LLM_POOL_WORKERS > 1:
+        from ia.llm_pool import LlamaPool
+        _model = LlamaPool()
+    else:
+        import ia.model as model_utils
+        _model = model_utils.llm()
+    index_registry.get_embedder()
+
+
+def _completion(op, payload, params):
+    from ia import prefix_cache, llm_stream
+
+    prefix = params.pop("prefix", None)
+    cache_prefix = params.pop("cache_prefix", False)
+    if getattr(_model, "pooled", False):
+        # le pool gère le préfixe KV dans ses workers
+        if op == OP_CHAT:
+            return _model.create_chat_completion(messages=payload, cache_prefix=cache_prefix, **params)
+        return _model(payload, prefix=prefix, **params)
+
+    llm_stream.compile_grammar(params)
+    if op == OP_CHAT:
+        if cache_prefix:
+            prefix_cache.prime(_model, prefix_cache.chat_prefix(_model, payload))
+        return _model.create_chat_completion(messages=payload, **params)
+    prefix_cache.prime(_model, prefix)
+    return _model(payload, **params)
+
+
+def _text_of(op, chunk):
+    if op == OP_CHAT:
+        return chunk["choices"][0]["delta"].get("content")
+    return chunk["choices"][0]["text"]
+
+
+def _handle_generate(sock, op, header):
+    params = header.get("params", {})
+    payload = header["messages"] if op == OP_CHAT else header["prompt"]
+    _count("chat" if op == OP_CHAT else "generate")
+    pooled = getattr(_model, "pooled", False)
+
+    if not pooled:
+        _model_lock.acquire()
+    try:
+        out = _completion(op, payload, params)
+        if not params.get("stream"):
+            send_frame(sock, OP_RESULT, out)
+            return
+        try:
+            for chunk in out:
+                text = _text_of(op, chunk)
+                if text:
+                    send_frame(sock, OP_TOKEN, blob=text.encode("utf-8"))
+        except (BrokenPipeError, ConnectionError, OSError):
+            _count("cancelled")  # client parti (timeout / déconnexion)
+            return
+        finally:
+            if hasattr(out, "close"):
+                out.close()
+        send_frame(sock, OP_END)
+    finally:
+        if not pooled:
+            _model_lock.release()
+
+
+def _handle_embed(sock, header):
+    from ia.faiss import index_registry
+
+    _count("embed")
+    vecs = index_registry.get_embedder().encode(header["texts"], convert_to_numpy=True)
+    vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+    send_frame(sock, OP_RESULT, {"shape": list(vecs.shape)}, vecs.tobytes())
+
+
+def _handle_retrieve(sock, header):
+    from ia.faiss import index_registry
+    from ia.faiss.faiss_handler import retrieve
+
+    _count("retrieve")
+    retrieved = retrieve(**header)
+    send_frame(sock, OP_RESULT, {
+        "items": list(retrieved),
+        "chunk_ids": retrieved.chunk_ids() if hasattr(retrieved, "chunk_ids") else [],
+        "version": index_registry.version(),
+    })
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        sock = self.request
+        try:
+            op, header, _ = recv_frame(sock)
+            if op in (OP_GENERATE, OP_CHAT):
+                _handle_generate(sock, op, header)
+            elif op == OP_EMBED:
+                _handle_embed(sock, header)
+            elif op == OP_RETRIEVE:
+                _handle_retrieve(sock, header)
+            elif op == OP_PING:
+                send_frame(sock, OP_RESULT, health())
+            else:
+                send_frame(sock, OP_ERROR, {"error": f"op inconnue : {op}"})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            _count("errors")
+            try:
+                send_frame(sock, OP_ERROR, {"error": f"{type(e).__name__}: {e}"})
+            except OSError:
+                pass
+
+
+def health():
+    from ia.faiss import index_registry
+
+    return {
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - _started_at, 1),
+        "model": Config.MODEL_NAME,
+        "embedder": Config.RAG_MODEL,
+        "pool": _model.health() if getattr(_model, "pooled", False) else None,
+        "index_version": index_registry.version(),
+        **_metrics,
+    }
+
+
+def serve(address=None):
+    global _serving
+    _serving = True
+    address = address or Config.INFERENCE_ADDRESS
+    family, bind = _parse_address(address)
+
+    t0 = time.perf_counter()
+    _load()
+    print(f"✅ Modèle + embedder chargés en {time.perf_counter() - t0:.1f}s")
+
+    if family == socket.AF_UNIX:
+        if os.path.exists(bind):
+            os.unlink(bind)  # socket d'un démon précédent
+        server = socketserver.ThreadingUnixStreamServer(bind, _Handler)
+    else:
+        server = socketserver.ThreadingTCPServer(bind, _Handler)
+    server.daemon_threads = True
+    print(f"🚀 Démon d'inférence à l'écoute sur {address}")
+    server.serve_forever()
+
+
+# ============================================================
+# CLIENT
+# ============================================================
+class RemoteChunks(list):
+    """
+    Résultats de retrieve() reçus du démon (même interface que RetrievedChunks).
+    """
+
+    def __init__(self, items, chunk_ids):
+        super().__init__(items)
+        self._chunk_ids = [tuple(c) for c in chunk_ids]
+
+    def chunk_ids(self):
+        return self._chunk_ids
+
+
+class RemoteEmbedder:
+    """
+    encode() d'un SentenceTransformer, calculé par le démon.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def encode(self, texts, convert_to_numpy=True, convert_to_tensor=False, **kwargs):
+        single = isinstance(texts, str)
+        vecs = self.client.embed([texts] if single else list(texts))
+        vecs = vecs[0] if single else vecs
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(vecs)
+        return vecs
+
+
+class InferenceClient:
+
+    pooled = True  # préfixes KV transmis au démon (cf. llm_stream)
+
+    def __init__(self, address=None):
+        self.address = address or Config.INFERENCE_ADDRESS
+        self.model_path = Config.MODEL_NAME
+        self._index_version = 0
+        self._embedder = RemoteEmbedder(self)
+
+    def _connect(self):
+        family, target = _parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(target)
+        except OSError as e:
+            sock.close()
+            raise ConnectionError(f"démon d'inférence injoignable ({self.address}) : {e}") from e
+        return sock
+
+    def _call(self, op, header):
+        sock = self._connect()
+        try:
+            send_frame(sock, op, header)
+            op, header, blob = recv_frame(sock)
+        finally:
+            sock.close()
+        if op == OP_ERROR:
+            raise RuntimeError(f"démon d'inférence : {header['error']}")
+        return header, blob
+
+    def _stream(self, op, header, chunk_of):
+        sock = self._connect()
+        try:
+            send_frame(sock, op, header)
+            while True:
+                kind, head, blob = recv_frame(sock)
+                if kind == OP_TOKEN:
+                    yield chunk_of(blob.decode("utf-8"))
+                elif kind == OP_END:
+                    return
+                else:
+                    raise RuntimeError(f"démon d'inférence : {(head or {}).get('error')}")
+        finally:
+            sock.close()  # générateur fermé (annulation) => le démon arrête la génération
+
+    # ----------------- Llama -----------------
+    def __call__(self, prompt, **params):
+        header = {"prompt": prompt, "params": params}
+        if params.get("stream"):
+            return self._stream(OP_GENERATE, header, lambda t: {"choices": [{"text": t}]})
+        return self._call(OP_GENERATE, header)[0]
+
+    def create_chat_completion(self, messages, **params):
+        header = {"messages": messages, "params": params}
+        if params.get("stream"):
+            return self._stream(OP_CHAT, header, lambda t: {"choices": [{"delta": {"content": t}}]})
+        return self._call(OP_CHAT, header)[0]
+
+    # ----------------- Embedder / RAG -----------------
+    def embed(self, texts):
+        header, blob = self._call(OP_EMBED, {"texts": texts})
+        return np.frombuffer(blob, dtype=np.float32).reshape(header["shape"])
+
+    def embedder(self):
+        return self._embedder
+
+    def retrieve(self, **kwargs):
+        header, _ = self._call(OP_RETRIEVE, kwargs)
+        self._index_version = header["version"]
+        return RemoteChunks(header["items"], header["chunk_ids"])
+
+    def index_version(self):
+        # version du registre d'index du démon vue au dernier retrieve (invalidation des caches)
+        return self._index_version
+
+    def health(self):
+        return self._call(OP_PING, {})[0]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient()
+    return _client
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else None)
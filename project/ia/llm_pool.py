@@ -0,0 +1,304 @@
+import os
+import sys
+import time
+import queue
+import itertools
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+# ============================================================
+# POOL DE WORKERS llama.cpp (MULTI-PROCESS)
+# ============================================================
+# N process, chacun avec son propre Llama :
+# - GGUF mappé en mémoire (use_mmap) : les poids sont partagés via le cache
+#   de pages de l'OS, la RAM ne croît que du KV cache par worker
+# - affinité CPU : worker i épinglé sur ses propres coeurs
+#   (n_threads = coeurs du worker), pas de contention entre générations
+# - file de requêtes partagée : le premier worker libre prend la suivante
+# - santé : heartbeat par worker, worker mort redémarré, requête en cours
+#   terminée en erreur
+#
+# LlamaPool se présente comme un Llama (appel / create_chat_completion,
+# stream ou non) : le reste du code ne change pas. L'ordonnanceur LLM
+# (llm_scheduler) garde les priorités et lance autant de jobs en parallèle
+# que de workers ; la file partagée ne contient donc jamais plus de N requêtes.
+
+HEALTH_STALE_S = 10  # heartbeat plus vieux (worker inactif) => worker signalé non sain
+
+
+def worker_cores(worker_id, n_workers, cpu_count=None):
+    cpu_count = cpu_count or os.cpu_count() or 1
+    per_worker = max(1, cpu_count // n_workers)
+    first = (worker_id * per_worker) % cpu_count
+    return list(range(first, min(first + per_worker, cpu_count)))
+
+
+# ----------------- Process worker -----------------
+def _worker_main(worker_id, cores, requests, results, heartbeats, current, cancel):
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    import ia.model as model_utils
+    from ia import prefix_cache, llm_stream
+
+    model = model_utils.llm(n_threads=len(cores) or None)
+    print(f"🧵 Worker LLM {worker_id} prêt (pid {os.getpid()}, coeurs {cores[0]}-{cores[-1]})")
+
+    while True:
+        heartbeats[worker_id] = time.time()
+        try:
+            msg = requests.get(timeout=1)
+        except queue.Empty:
+            continue
+        if msg is None:
+            break
+
+        req_id, kind, payload, params = msg
+        # mémoire partagée (visible immédiatement) : un crash n'en perd pas la trace
+        current[worker_id] = req_id
+        results.put(("start", req_id, worker_id))
+        try:
+            prefix = params.pop("prefix", None)
+            cache_prefix = params.pop("cache_prefix", False)
+            llm_stream.compile_grammar(params)
+            if kind == "chat":
+                if cache_prefix:
+                    prefix_cache.prime(model, prefix_cache.chat_prefix(model, payload))
+                out = model.create_chat_completion(messages=payload, **params)
+            else:
+                prefix_cache.prime(model, prefix)
+                out = model(payload, **params)
+
+            if params.get("stream"):
+                for chunk in out:
+                    heartbeats[worker_id] = time.time()
+                    if cancel[worker_id] == req_id:
+                        out.close()
+                        break
+                    results.put(("chunk", req_id, chunk))
+                out = None
+            results.put(("done", req_id, out))
+        except Exception as e:
+            results.put(("error", req_id, f"{type(e).__name__}: {e}"))
+        current[worker_id] = -1
+
+
+# ----------------- Pool (process principal) -----------------
+class LlamaPool:
+
+    pooled = True
+
+    def __init__(self, n_workers=None, model_path=None):
+        self.n_workers = n_workers or Config.LLM_POOL_WORKERS
+        self.model_path = model_path or Config.MODEL_NAME
+        self._ctx = mp.get_context("spawn")
+        self._requests = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        self._heartbeats = self._ctx.Array("d", self.n_workers)
+        self._current = self._ctx.Array("q", [-1] * self.n_workers)  # requête en cours par worker
+        self._cancel = self._ctx.Array("q", [-1] * self.n_workers)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {}     # {req_id: queue.Queue} (réponses à router)
+        self._assigned = {}    # {req_id: worker_id}
+        self._cancelled = set()
+        self._processes = [None] * self.n_workers
+        self._served = [0] * self.n_workers
+        self._restarts = 0
+        self._closed = False
+
+        for w in range(self.n_workers):
+            self._start_worker(w)
+        threading.Thread(target=self._dispatch, name="llm-pool-dispatch", daemon=True).start()
+        threading.Thread(target=self._health_loop, name="llm-pool-health", daemon=True).start()
+
+    def _start_worker(self, w):
+        cores = worker_cores(w, self.n_workers)
+        self._heartbeats[w] = time.time()
+        self._current[w] = -1
+        p = self._ctx.Process(
+            target=_worker_main,
+            args=(w, cores, self._requests, self._results, self._heartbeats, self._current, self._cancel),
+            name=f"llm-worker-{w}",
+            daemon=True,
+        )
+        p.start()
+        self._processes[w] = p
+
+    # ----------------- Routage des réponses -----------------
+    def _dispatch(self):
+        while not self._closed:
+            try:
+                kind, req_id, data = self._results.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self._lock:
+                if kind == "start":
+                    self._assigned[req_id] = data
+                    self._served[data] += 1
+                    if req_id in self._cancelled:
+                        self._cancel[data] = req_id
+                    continue
+                q = self._pending.get(req_id)
+                if kind in ("done", "error"):
+                    self._pending.pop(req_id, None)
+                    self._assigned.pop(req_id, None)
+                    self._cancelled.discard(req_id)
+            if q is not None:
+                q.put((kind, data))
+
+    def _health_loop(self):
+        while not self._closed:
+            time.sleep(Config.LLM_POOL_HEALTH_S)
+            for w, p in enumerate(self._processes):
+                if p.is_alive():
+                    continue
+                print(f"⚠️ Worker LLM {w} arrêté (exit {p.exitcode}) : redémarrage")
+                with self._lock:
+                    lost = {r for r, a in self._assigned.items() if a == w}
+                    if self._current[w] != -1:
+                        lost.add(self._current[w])
+                    for r in lost:
+                        self._assigned.pop(r, None)
+                        q = self._pending.pop(r, None)
+                        if q is not None:
+                            q.put(("error", f"worker {w} arrêté pendant la génération"))
+                    self._restarts += 1
+                self._start_worker(w)
+
+    # ----------------- Requêtes -----------------
+    def _submit(self, kind, payload, params):
+        req_id = next(self._ids)
+        q = queue.Queue()
+        with self._lock:
+            self._pending[req_id] = q
+        self._requests.put((req_id, kind, payload, params))
+        return req_id, q
+
+    def cancel(self, req_id):
+        with self._lock:
+            if req_id not in self._pending:
+                return
+            self._cancelled.add(req_id)
+            for w in range(self.n_workers):
+                if self._current[w] == req_id:
+                    self._cancel[w] = req_id
+
+    def _stream(self, req_id, q):
+        finished = False
+        try:
+            while True:
+                kind, data = q.get()
+                if kind == "chunk":
+                    yield data
+                elif kind == "done":
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise RuntimeError(f"LLM pool : {data}")
+        finally:
+            if not finished:
+                self.cancel(req_id)
+
+    def _request(self, kind, payload, params):
+        req_id, q = self._submit(kind, payload, params)
+        if params.get("stream"):
+            return self._stream(req_id, q)
+        kind, data = q.get()
+        if kind == "error":
+            raise RuntimeError(f"LLM pool : {data}")
+        return data
+
+    def __call__(self, prompt, **params):
+        return self._request("completion", prompt, params)
+
+    def create_chat_completion(self, messages, **params):
+        return self._request("chat", messages, params)
+
+    # ----------------- Santé / arrêt -----------------
+    def health(self):
+        now = time.time()
+        with self._lock:
+            busy = {w for w in range(self.n_workers) if self._current[w] != -1}
+            workers = []
+            for w, p in enumerate(self._processes):
+                age = now - self._heartbeats[w]
+                workers.append({
+                    "worker": w,
+                    "pid": p.pid,
+                    "alive": p.is_alive(),
+                    "busy": w in busy,
+                    "healthy": p.is_alive() and (w in busy or age < HEALTH_STALE_S),
+                    "heartbeat_age_s": round(age, 1),
+                    "served": self._served[w],
+                    "cores": worker_cores(w, self.n_workers),
+                })
+            return {
+                "workers": workers,
+                "in_flight": len(self._pending),
+                "restarts": self._restarts,
+            }
+
+    def close(self):
+        self._closed = True
+        for _ in self._processes:
+            self._requests.put(None)
+        for p in self._processes:
+            p.join(timeout=5)
+
+
+# ============================================================
+# BENCHMARK DE CHARGE
+# ============================================================
+# python -m ia.llm_pool [nb_requetes] [concurrence]
+# Même charge (prompts courts, réponses de 64 tokens) pour 1, 2, 4, 8...
+# workers (coeurs répartis entre workers) : requêtes/min et latence p95.
+
+BENCH_PROMPTS = [
+    "Explique en une phrase le rôle d'un automate programmable.",
+    "Donne une cause possible d'un dépassement de durée sur un poste de vissage.",
+    "Qu'est-ce que le TRS d'une ligne de production ?",
+    "Cite deux vérifications à faire sur un vérin pneumatique lent.",
+]
+
+
+def benchmark(n_requests=32, concurrency=8, worker_counts=None, max_tokens=64):
+    cpu = os.cpu_count() or 1
+    worker_counts = worker_counts or [n for n in (1, 2, 4, 8) if n <= cpu]
+    report = []
+
+    for n_workers in worker_counts:
+        pool = LlamaPool(n_workers)
+        pool(BENCH_PROMPTS[0], max_tokens=1)  # attente du chargement d'au moins un worker
+
+        def one(i):
+            t0 = time.perf_counter()
+            pool(BENCH_PROMPTS[i % len(BENCH_PROMPTS)], max_tokens=max_tokens, temperature=0)
+            return time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = sorted(executor.map(one, range(n_requests)))
+        elapsed = time.perf_counter() - t0
+        pool.close()
+
+        report.append({
+            "workers": n_workers,
+            "threads_per_worker": max(1, cpu // n_workers),
+            "requests": n_requests,
+            "concurrency": concurrency,
+            "requests_per_min": round(n_requests / elapsed * 60, 1),
+            "latency_p50_s": round(latencies[len(latencies) // 2], 2),
+            "latency_p95_s": round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+        })
+        print(report[-1])
+    return report
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    c = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    benchmark(n, c)
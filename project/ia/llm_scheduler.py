@@ -0,0 +1,219 @@
+import time
+import heapq
+import queue
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import TimeoutError
+from config import Config
+
+# ============================================================
+# ORDONNANCEUR CENTRAL DES APPELS LLM
+# ============================================================
+# Un seul modèle chargé (Llama llama.cpp) => un seul appel à la fois ;
+# avec le pool de workers llama.cpp (ia.llm_pool) : LLM_POOL_WORKERS appels.
+# Les générations HF (transformers) sont groupées en batchs par ia.hf_batcher
+# (mêmes priorités, même borne de file, mêmes timeouts).
+# Toutes les générations passent par ici au lieu d'executors ad hoc :
+# - file à priorités : anomalie live > chat (RAG / SQL) > rapport TRS
+#   (FIFO à priorité égale)
+# - file bornée (LLM_QUEUE_MAX) : au-delà, QueueFull (HTTP 503)
+# - timeout = attente + génération. À l'expiration, le job est annulé :
+#   retiré de la file s'il attend, arrêté au token suivant s'il tourne
+#   (les générations vérifient job.cancelled() entre deux tokens)
+# - métriques : profondeur de file par priorité, temps d'attente / d'exécution
+#
+# fn(job) est exécuté dans un thread worker ; un appel imbriqué depuis ce
+# thread est exécuté directement (pas d'interblocage).
+
+PRIORITIES = {"anomaly": 0, "chat": 1, "trs": 2}
+QUEUE_FULL_MESSAGE = "⏳ Serveur LLM saturé, réessayez dans quelques instants"
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class Job:
+
+    def __init__(self, fn, priority, timeout, name):
+        self.fn = fn
+        self.priority = priority
+        self.timeout = timeout
+        self.name = name or priority
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.result = None
+        self.error = None
+        self.cancel_reason = None  # "timeout" | "disconnect" | "cancelled"
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    def cancel(self, reason="cancelled"):
+        if not self._cancel.is_set():
+            self.cancel_reason = reason
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Résultat de fn(job) ; TimeoutError (job annulé) si `timeout` expire.
+        """
+        if not self._done.wait(timeout):
+            raise self._expire(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _expire(self, timeout):
+        self.cancel("timeout")
+        with _lock:
+            _metrics["timeouts"] += 1
+        return TimeoutError(f"LLM job '{self.name}' annulé après {timeout}s")
+
+
+_lock = threading.Lock()
+_not_empty = threading.Condition(_lock)
+_heap = []
+_seq = itertools.count()
+_workers = []
+_running = {}  # {thread: job}
+
+_waits = deque(maxlen=500)  # ms d'attente des derniers jobs
+_metrics = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "rejected": 0,
+    "timeouts": 0,
+    "cancelled_in_queue": 0,
+    "busy_ms": 0.0,
+}
+
+
+def _ensure_worker():
+    # appelé sous _lock : un thread par appel modèle simultané possible
+    while len(_workers) < max(1, Config.LLM_POOL_WORKERS):
+        t = threading.Thread(target=_loop, name=f"llm-scheduler-{len(_workers)}", daemon=True)
+        _workers.append(t)
+        t.start()
+
+
+def _loop():
+    me = threading.current_thread()
+    while True:
+        with _not_empty:
+            while not _heap:
+                _not_empty.wait()
+            _, _, job = heapq.heappop(_heap)
+            if job.cancelled():
+                _metrics["cancelled_in_queue"] += 1
+                job._done.set()
+                continue
+            job.started_at = time.perf_counter()
+            _waits.append((job.started_at - job.submitted_at) * 1000)
+            _running[me] = job
+
+        try:
+            job.result = job.fn(job)
+        except BaseException as e:
+            job.error = e
+        finally:
+            with _lock:
+                _running.pop(me, None)
+                _metrics["busy_ms"] += (time.perf_counter() - job.started_at) * 1000
+                _metrics["failed" if job.error is not None else "completed"] += 1
+            job._done.set()
+
+
+def submit(fn, priority="chat", timeout=None, name=None):
+    """
+    Met fn(job) en file et retourne le Job (job.wait() pour le résultat).
+    """
+    job = Job(fn, priority, timeout, name)
+    with _not_empty:
+        pending = sum(1 for _, _, j in _heap if not j.cancelled())
+        if pending >= Config.LLM_QUEUE_MAX:
+            _metrics["rejected"] += 1
+            raise QueueFull(QUEUE_FULL_MESSAGE)
+        _metrics["submitted"] += 1
+        heapq.heappush(_heap, (PRIORITIES[priority], next(_seq), job))
+        _ensure_worker()
+        _not_empty.notify()
+    return job
+
+
+def run(fn, priority="chat", timeout=None, name=None):
+    """
+    Exécute fn(job) via la file et attend le résultat.
+    timeout None = Config.LLM_TIMEOUTS[priority] ; TimeoutError à l'expiration.
+    """
+    me = threading.current_thread()
+    if me in _running:
+        return fn(_running[me])
+
+    timeout = Config.LLM_TIMEOUTS.get(priority) if timeout is None else timeout
+    return submit(fn, priority, timeout, name).wait(timeout)
+
+
+def stream(make_tokens, priority="chat", timeout=None, name=None):
+    """
+    Générateur des morceaux produits par make_tokens(job) dans le worker.
+    Fermer le générateur (client déconnecté) annule le job.
+    """
+    timeout = Config.LLM_TIMEOUTS.get(priority) if timeout is None else timeout
+    tokens = queue.Queue()
+    end = object()
+
+    def fn(job):
+        try:
+            for text in make_tokens(job):
+                if job.cancelled():
+                    break
+                tokens.put(text)
+        finally:
+            tokens.put(end)
+
+    job = submit(fn, priority, timeout, name)
+    deadline = time.perf_counter() + timeout if timeout else None
+    try:
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            try:
+                text = tokens.get(timeout=remaining)
+            except queue.Empty:
+                if not job._done.is_set():
+                    raise job._expire(timeout)
+                continue
+            if text is end:
+                break
+            yield text
+        job.wait()
+    finally:
+        if not job._done.is_set():
+            job.cancel("disconnect")  # générateur fermé avant la fin (client parti)
+
+
+def get_metrics():
+    with _lock:
+        pending = [j for _, _, j in _heap if not j.cancelled()]
+        now = time.perf_counter()
+        waits = sorted(_waits)
+        return {
+            "queue_depth": len(pending),
+            "queue_max": Config.LLM_QUEUE_MAX,
+            "queue_by_priority": {p: sum(1 for j in pending if j.priority == p) for p in PRIORITIES},
+            "oldest_wait_ms": round(max((now - j.submitted_at for j in pending), default=0) * 1000, 1),
+            "running": [{
+                "name": j.name,
+                "priority": j.priority,
+                "running_ms": round((now - j.started_at) * 1000, 1),
+            } for j in _running.values()],
+            "workers": len(_workers),
+            "wait_ms_avg": round(sum(waits) / len(waits), 1) if waits else None,
+            "wait_ms_p95": round(waits[int(0.95 * (len(waits) - 1))], 1) if waits else None,
+            **_metrics,
+            "busy_ms": round(_metrics["busy_ms"], 1),
+        }
@@ -0,0 +1,134 @@
+import json
+import time
+from config import Config
+from ia import prefix_cache
+
+# ============================================================
+# STREAMING DES TOKENS GGUF (llama.cpp stream=True)
+# ============================================================
+# - stream_completion / stream_chat : générateurs de morceaux de texte
+# - stats : TTFT (temps jusqu'au premier token, prompt eval compris)
+#   mesuré séparément du temps total de génération
+# - annulation coopérative : job (llm_scheduler) annulé => arrêt au token
+#   suivant, le générateur llama.cpp est fermé et le modèle libéré
+# - sse_event : formatage Server-Sent Events pour Flask
+# - socketio_emitter : tokens des analyses d'anomalie en événements Socket.IO
+
+TIMEOUT_MESSAGE = "⏱️ La génération a dépassé le délai imparti ({} sec)"
+
+
+_grammars = {}  # {texte GBNF: LlamaGrammar}
+
+
+def compile_grammar(params):
+    """
+    params["grammar"] en texte GBNF (transmissible au pool / démon) -> LlamaGrammar, compilée une fois.
+    """
+    text = params.get("grammar")
+    if isinstance(text, str):
+        if text not in _grammars:
+            from llama_cpp import LlamaGrammar
+            _grammars[text] = LlamaGrammar.from_string(text, verbose=False)
+        params["grammar"] = _grammars[text]
+    return params
+
+
+def new_stats():
+    return {"ttft_ms": None, "total_ms": None, "tokens": 0, "timeout": False, "disconnected": False, "cached": False}
+
+
+def _timed(chunks, text_of, stats, job):
+    stats = stats if stats is not None else new_stats()
+    t0 = time.perf_counter()
+    try:
+        for chunk in chunks:
+            if job is not None and job.cancelled():
+                break
+            text = text_of(chunk)
+            if not text:
+                continue
+            if stats["ttft_ms"] is None:
+                stats["ttft_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            stats["tokens"] += 1
+            yield text
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        if job is not None and job.cancelled():
+            # annulé par le timeout du job, ou client déconnecté : comptés à part
+            stats["disconnected" if job.cancel_reason == "disconnect" else "timeout"] = True
+        stats["total_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        print_stats(stats)
+
+
+def stream_completion(model, prompt, stats=None, job=None, prefix=None, **params):
+    """
+    Texte généré pour `prompt`, morceau par morceau.
+    prefix : début statique de `prompt` dont l'état KV est mis en cache (prefix_cache).
+    """
+    params = {
+        "max_tokens": Config.MAX_OUTPUT_TOKEN,
+        "temperature": Config.TEMPERATURE,
+        "top_p": Config.TOP_P,
+        "top_k": Config.TOP_K,
+        "repeat_penalty": 1.08,
+        "stop": ["<|end|>"],
+        **params,
+    }
+    if getattr(model, "pooled", False):
+        params["prefix"] = prefix  # état KV (et grammaire) gérés dans le process worker
+    else:
+        compile_grammar(params)
+        prefix_cache.prime(model, prefix)
+    chunks = model(prompt, stream=True, **params)
+    return _timed(chunks, lambda c: c["choices"][0]["text"], stats, job)
+
+
+def stream_chat(model, messages, stats=None, job=None, cache_prefix=False, **params):
+    """
+    Équivalent streaming de model.create_chat_completion(messages, ...).
+    cache_prefix : état KV des messages précédant le dernier message utilisateur
+    (prompt système fixe) restauré depuis prefix_cache.
+    """
+    if getattr(model, "pooled", False):
+        params["cache_prefix"] = cache_prefix  # état KV géré dans le process worker
+    elif cache_prefix:
+        prefix_cache.prime(model, prefix_cache.chat_prefix(model, messages))
+    chunks = model.create_chat_completion(messages=messages, stream=True, **params)
+    return _timed(chunks, lambda c: c["choices"][0]["delta"].get("content"), stats, job)
+
+
+def collect(tokens, on_token=None):
+    """
+    Consomme un flux de tokens (callback optionnel par morceau) et retourne le texte complet.
+    """
+    parts = []
+    for text in tokens:
+        parts.append(text)
+        if on_token is not None:
+            on_token(text)
+    return "".join(parts)
+
+
+def socketio_emitter(socketio, anomaly_id, event="anomalie_stream"):
+    """
+    on_token qui pousse chaque morceau d'une analyse d'anomalie sur Socket.IO.
+    """
+    def on_token(text):
+        socketio.emit(event, {"id": anomaly_id, "token": text}, namespace="/")
+    return on_token
+
+
+def print_stats(stats):
+    total = stats["total_ms"] or 0
+    rate = stats["tokens"] / (total / 1000) if total else 0
+    print(
+        f"⚡ LLM stream : TTFT {stats['ttft_ms']} ms | total {total} ms | "
+        f"{stats['tokens']} tokens ({rate:.1f} tok/s)"
+        + (" | TIMEOUT" if stats["timeout"] else "")
+        + (" | CLIENT DÉCONNECTÉ" if stats["disconnected"] else "")
+    )
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
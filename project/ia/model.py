@@ -6,12 +6,20 @@ import torch
 
 from llama_cpp import Llama
 
-def llm():
+def llm(n_threads=None, draft=True):
+    # n_threads : coeurs du worker quand le modèle tourne dans le pool (ia.llm_pool)
+    # draft : décodage spéculatif si Config.LLM_DRAFT_MODEL est renseigné (ia.speculative)
+    from ia import speculative
+
+    draft_model = speculative.draft_model(n_threads) if draft else None
     return Llama(
     model_path=Config.MODEL_NAME,
     n_ctx=4096,
-    n_threads=8,
+    n_threads=n_threads or 8,
     n_batch=128,
+    use_mmap=True, # poids partagés entre process via le cache de pages
+    draft_model=draft_model,
+    logits_all=draft_model is not None, # scores dimensionné n_ctx (vérification des tokens du draft)
     temperature=0.2,
     top_p=0.8,
     top_k=40,
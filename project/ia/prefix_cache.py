@@ -0,0 +1,203 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+
+# ============================================================
+# CACHE KV DES PRÉFIXES DE PROMPT (llama.cpp)
+# ============================================================
+# Les prompts système (règles RAG, règles d'analyse d'anomalie, schéma SQL...)
+# sont identiques d'une requête à l'autre. Leur état llama.cpp (KV cache) est
+# évalué une fois puis sauvegardé (Llama.save_state) ; chaque requête restaure
+# l'état (load_state) et llama.cpp n'évalue que le suffixe dynamique.
+#
+# Sûreté : llama.cpp compare les tokens du prompt avec ceux déjà en KV
+# (plus long préfixe commun) avant d'évaluer ; un préfixe mal découpé réduit
+# seulement le gain, jamais la justesse de la sortie.
+#
+# prime() est appelé dans le job de l'ordonnanceur LLM (un seul appel
+# modèle à la fois) juste avant la génération.
+#
+# Désactivé avec un modèle draft (ia.speculative) : logits_all => save_state()
+# copierait tout le tableau scores (n_ctx x vocab, ~2.5 Go) à chaque état.
+
+SENTINEL = "⁣PROMPT_SUFFIX⁣"
+
+_lock = threading.Lock()
+_states = OrderedDict()  # {(modèle, hash du préfixe): (LlamaState, nb tokens)}
+_chat_prefixes = {}      # {(modèle, messages statiques): texte du préfixe}
+
+_metrics = {
+    "warm": 0,      # préfixe déjà en KV (requête précédente du même flux)
+    "hits": 0,      # état restauré
+    "misses": 0,    # préfixe évalué puis sauvegardé
+    "prime_ms": 0.0,
+    "prefix_tokens_saved": 0,
+}
+
+
+def _key(model, prefix):
+    digest = hashlib.blake2b(prefix.encode("utf-8"), digest_size=16).hexdigest()
+    return getattr(model, "model_path", None) or id(model), digest
+
+
+def prime(model, prefix):
+    """
+    Met le KV de `model` dans l'état « préfixe évalué ».
+    Retourne "warm" / "hit" / "miss" (None si désactivé ou non applicable).
+    """
+    if not Config.LLM_PREFIX_CACHE or not prefix or not hasattr(model, "save_state"):
+        return None
+    if getattr(model, "draft_model", None) is not None:
+        return None
+
+    t0 = time.perf_counter()
+    tokens = model.tokenize(prefix.encode("utf-8"), add_bos=True, special=True)
+    n = len(tokens)
+    current = model.input_ids[:model.n_tokens]
+
+    if model.n_tokens >= n and current[:n].tolist() == tokens:
+        outcome = "warm"
+    else:
+        key = _key(model, prefix)
+        with _lock:
+            cached = _states.get(key)
+            if cached is not None:
+                _states.move_to_end(key)
+
+        if cached is not None:
+            model.load_state(cached[0])
+            outcome = "hit"
+        else:
+            model.reset()
+            model.eval(tokens)
+            state = model.save_state()
+            with _lock:
+                _states[key] = (state, n)
+                while len(_states) > Config.LLM_PREFIX_CACHE_SIZE:
+                    _states.popitem(last=False)
+            outcome = "miss"
+
+    with _lock:
+        _metrics["warm" if outcome == "warm" else "hits" if outcome == "hit" else "misses"] += 1
+        _metrics["prime_ms"] += (time.perf_counter() - t0) * 1000
+        if outcome != "miss":
+            _metrics["prefix_tokens_saved"] += n
+    return outcome
+
+
+def _token_text(model, token_id):
+    if token_id == -1:
+        return ""
+    return model.detokenize([token_id], special=True).decode("utf-8", errors="ignore")
+
+
+def chat_prefix(model, messages):
+    """
+    Texte du prompt de chat (template du GGUF) jusqu'au contenu du dernier
+    message utilisateur : tout ce qui précède est statique si les messages
+    précédents le sont. None si le template n'est pas disponible.
+    """
+    key = (_key(model, "")[0], tuple((m["role"], m["content"]) for m in messages[:-1]))
+    if key in _chat_prefixes:
+        return _chat_prefixes[key]
+
+    prefix = None
+    try:
+        from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+        template = model.metadata.get("tokenizer.chat_template")
+        if not template:
+            return None
+        # mêmes tokens bos / eos que le handler de chat construit par Llama()
+        formatter = Jinja2ChatFormatter(
+            template=template,
+            eos_token=_token_text(model, model.token_eos()),
+            bos_token=_token_text(model, model.token_bos()),
+        )
+        rendered = formatter(messages=messages[:-1] + [{"role": "user", "content": SENTINEL}]).prompt
+        prefix = rendered[:rendered.index(SENTINEL)]
+    except Exception as e:
+        print(f"⚠️ Préfixe de chat non calculable ({e}) : pas de cache KV pour ce flux")
+
+    with _lock:
+        _chat_prefixes[key] = prefix
+    return prefix
+
+
+def clear():
+    with _lock:
+        _states.clear()
+
+
+def get_metrics():
+    with _lock:
+        return {
+            "enabled": bool(Config.LLM_PREFIX_CACHE) and not Config.LLM_DRAFT_MODEL,
+            "states": len(_states),
+            "prefix_tokens": [n for _, n in _states.values()],
+            **_metrics,
+            "prime_ms": round(_metrics["prime_ms"], 1),
+        }
+
+
+# ============================================================
+# BENCHMARK : TEMPS D'ÉVALUATION DU PROMPT AVANT / APRÈS
+# ============================================================
+# python -m ia.prefix_cache
+# Flux anomalie (chat, règles système fixes) et SQL (schéma fixe) :
+# génération d'un seul token = évaluation du prompt, avec le KV remis à zéro
+# (avant) puis avec l'état du préfixe restauré (après).
+
+def _timed_call(fn):
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) * 1000
+
+
+def benchmark(model, runs=3):
+    from ia.eval_gguf import ANOMALY_SYSTEM_PROMPT
+    from ia.sql_handler import build_sql_prompt
+
+    with open(Config.sql_database, "r", encoding="utf-8", errors="ignore") as f:
+        schema_text = f.read()
+
+    def anomaly_flow(i):
+        messages = [
+            {"role": "system", "content": ANOMALY_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Machine M{i} step S{i} : dépassement de {10 + i}s sur la durée nominale."},
+        ]
+        prefix = chat_prefix(model, messages)
+        return prefix, lambda: model.create_chat_completion(messages=messages, max_tokens=1, temperature=0)
+
+    def sql_flow(i):
+        prompt, prefix = build_sql_prompt(schema_text, f"Liste des {5 + i} dernières anomalies de la machine M{i}")
+        return prefix, lambda: model(prompt, max_tokens=1, temperature=0)
+
+    report = []
+    for name, flow in (("anomaly", anomaly_flow), ("sql", sql_flow)):
+        before, after = [], []
+        for i in range(runs):
+            prefix, call = flow(i)
+            model.reset()
+            before.append(_timed_call(call))
+
+            model.reset()  # autre flux entre deux requêtes : état restauré depuis le cache
+            after.append(_timed_call(lambda: (prime(model, prefix), call())))
+
+        n_prefix = len(model.tokenize(prefix.encode("utf-8"), add_bos=True, special=True)) if prefix else 0
+        report.append({
+            "flow": name,
+            "prefix_tokens": n_prefix,
+            "prompt_eval_ms_before": round(sorted(before)[len(before) // 2], 1),
+            "prompt_eval_ms_after": round(sorted(after)[len(after) // 2], 1),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    import ia.model as model_utils
+
+    for r in benchmark(model_utils.llm()):
+        print(r)
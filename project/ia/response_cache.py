@@ -0,0 +1,147 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import Config
+from ia.faiss import index_registry
+from ia.faiss.query_features import encode_texts
+
+# ============================================================
+# CACHE SÉMANTIQUE DES RÉPONSES LLM
+# ============================================================
+# Une question quasi identique à une question déjà traitée, avec le même
+# contexte (mêmes chunks récupérés / même historique), est servie depuis le
+# cache au lieu d'une génération de 10 à 60 s.
+# - clé : signature exacte (chunks récupérés, modèle...) + embedding normalisé
+#   de la question, comparé en cosinus (>= RESPONSE_CACHE_MIN_SIM)
+# - éviction : TTL (RESPONSE_CACHE_TTL) + LRU (RESPONSE_CACHE_SIZE entrées)
+# - invalidation : cache vidé dès qu'un index FAISS est rechargé ou remplacé
+#   (index_registry.version())
+# Les réponses en timeout ("⏱️ ...") ne sont jamais mises en cache.
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # {id: {"signature", "vec", "answer", "created"}}
+_by_signature = {}        # {signature: [id, ...]}
+_next_id = 0
+_index_version = None
+
+_metrics = {
+    "hits": 0,
+    "misses": 0,
+    "stores": 0,
+    "expired": 0,
+    "evicted": 0,
+    "invalidations": 0,
+}
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+def embed_query(query):
+    vec = encode_texts(index_registry.get_embedder(), [normalize_query(query)])[0]
+    vec = np.asarray(vec, dtype=np.float32)
+    return vec / (np.linalg.norm(vec) + 1e-12)
+
+
+def _drop(entry_id):
+    entry = _entries.pop(entry_id)
+    ids = _by_signature.get(entry["signature"])
+    if ids is not None:
+        ids.remove(entry_id)
+        if not ids:
+            del _by_signature[entry["signature"]]
+
+
+def _check_version():
+    # appelé sous _lock : un index rechargé rend les réponses cachées obsolètes
+    global _index_version
+    version = index_registry.version()
+    if version != _index_version:
+        if _entries:
+            _metrics["invalidations"] += 1
+        _entries.clear()
+        _by_signature.clear()
+        _index_version = version
+
+
+def _purge_expired(now):
+    ttl = Config.RESPONSE_CACHE_TTL
+    if not ttl:
+        return
+    expired = [i for i, e in _entries.items() if now - e["created"] > ttl]
+    for i in expired:
+        _drop(i)
+    _metrics["expired"] += len(expired)
+
+
+def lookup(query, signature):
+    """
+    Réponse cachée pour une question proche avec la même signature, sinon None.
+    Retourne aussi le vecteur de la question (à repasser à store()).
+    """
+    if not Config.RESPONSE_CACHE_SIZE:
+        return None, None
+
+    vec = embed_query(query)
+    with _lock:
+        _check_version()
+        _purge_expired(time.time())
+
+        ids = _by_signature.get(signature)
+        if ids:
+            vecs = np.stack([_entries[i]["vec"] for i in ids])
+            sims = vecs @ vec
+            best = int(np.argmax(sims))
+            if sims[best] >= Config.RESPONSE_CACHE_MIN_SIM:
+                entry_id = ids[best]
+                _entries.move_to_end(entry_id)
+                _metrics["hits"] += 1
+                return _entries[entry_id]["answer"], vec
+
+        _metrics["misses"] += 1
+    return None, vec
+
+
+def store(query, signature, answer, vec=None):
+    global _next_id
+    if not Config.RESPONSE_CACHE_SIZE or not answer or answer.startswith("⏱️"):
+        return
+
+    if vec is None:
+        vec = embed_query(query)
+    with _lock:
+        _check_version()
+        entry_id = _next_id
+        _next_id += 1
+        _entries[entry_id] = {
+            "signature": signature,
+            "vec": vec,
+            "answer": answer,
+            "created": time.time(),
+        }
+        _by_signature.setdefault(signature, []).append(entry_id)
+        _metrics["stores"] += 1
+
+        while len(_entries) > Config.RESPONSE_CACHE_SIZE:
+            _drop(next(iter(_entries)))
+            _metrics["evicted"] += 1
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _by_signature.clear()
+
+
+def get_metrics():
+    with _lock:
+        total = _metrics["hits"] + _metrics["misses"]
+        return {
+            "size": len(_entries),
+            "max_size": Config.RESPONSE_CACHE_SIZE,
+            "ttl_s": Config.RESPONSE_CACHE_TTL,
+            "hit_rate": round(_metrics["hits"] / total, 3) if total else None,
+            **_metrics,
+        }
@@ -0,0 +1,161 @@
+import sys
+import glob
+import json
+import time
+import os.path as op
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel
+from config import Config
+
+# ============================================================
+# DÉCODAGE SPÉCULATIF (MODÈLE DRAFT GGUF)
+# ============================================================
+# Un petit GGUF de la même famille (même vocabulaire, ex : Qwen2 0.5B pour
+# Qwen2 7B) propose LLM_DRAFT_TOKENS tokens en greedy ; le modèle principal
+# les vérifie en une seule évaluation batchée et garde le plus long préfixe
+# accepté (+ son propre token suivant). Les tokens acceptés sont ceux que le
+# modèle principal aurait produits : moins de passes du 7B pour la même sortie
+# (gain et équivalence à mesurer sur les prompts réels : benchmark ci-dessous).
+#
+# Activé si Config.LLM_DRAFT_MODEL est renseigné (ia.model.llm).
+# Le KV du draft est réutilisé d'un appel à l'autre (plus long préfixe commun).
+#
+# Mémoire : la vérification demande les logits de tous les tokens au modèle
+# principal (logits_all, tableau scores n_ctx x vocab, ~2.5 Go pour Qwen2 à
+# n_ctx=4096) ; le cache d'états de prefix_cache est donc désactivé avec un draft.
+# Le draft, lui, ne garde pas ces logits : seul le dernier est lu (llama_get_logits).
+
+
+class GGUFDraftModel(LlamaDraftModel):
+
+    def __init__(self, model_path=None, num_pred_tokens=None, n_threads=None):
+        self.model = Llama(
+            model_path=model_path or Config.LLM_DRAFT_MODEL,
+            n_ctx=4096,
+            n_threads=n_threads or 8,
+            n_batch=128,
+            use_mmap=True,
+            verbose=False,
+        )
+        self.num_pred_tokens = num_pred_tokens or Config.LLM_DRAFT_TOKENS
+        self.eos = self.model.token_eos()
+        self.n_vocab = self.model.n_vocab()
+
+    def _next_token(self):
+        # logits du dernier token évalué (sans logits_all, Llama.scores n'est pas rempli)
+        logits = np.ctypeslib.as_array(self.model._ctx.get_logits(), shape=(self.n_vocab,))
+        return int(np.argmax(logits))
+
+    def _sync(self, ids):
+        # garde le KV du plus long préfixe commun, évalue le reste (au moins 1 token pour les logits)
+        m = self.model
+        current = m.input_ids[:m.n_tokens]
+        n = min(len(current), len(ids) - 1)
+        diff = np.flatnonzero(current[:n] != ids[:n])
+        common = int(diff[0]) if len(diff) else n
+        m.n_tokens = common  # eval() retire du KV tout ce qui suit
+        m.eval(ids[common:].tolist())
+
+    def __call__(self, input_ids, /, **kwargs):
+        m = self.model
+        self._sync(np.asarray(input_ids, dtype=np.intc))
+
+        draft = []
+        for _ in range(self.num_pred_tokens):
+            token = self._next_token()
+            if token == self.eos:
+                break
+            draft.append(token)
+            m.eval([token])
+        return np.array(draft, dtype=np.intc)
+
+
+def draft_model(n_threads=None):
+    if not Config.LLM_DRAFT_MODEL:
+        return None
+    print(f" --- Loading draft model {op.basename(Config.LLM_DRAFT_MODEL)} ({Config.LLM_DRAFT_TOKENS} tokens / passe)")
+    return GGUFDraftModel(n_threads=n_threads)
+
+
+# ============================================================
+# BENCHMARK : tokens/s ET ÉQUIVALENCE À TEMPÉRATURE 0
+# ============================================================
+# python -m ia.speculative [nb_prompts] [max_tokens]
+# Prompts d'anomalie enregistrés (rapport_llm_export/<jour>/anomaly/prompt_anomalie_*.json,
+# écrits seulement avec Config.LLM_RECORD_PROMPTS = True pendant la collecte),
+# générés en greedy par le modèle seul puis avec le draft : tokens/s de
+# chaque mode et sorties identiques ou non (position du premier écart).
+
+def recorded_prompts(limit=5):
+    pattern = op.join(Config.rapport_llm_export, "*", "anomaly", "prompt_anomalie_*.json")
+    files = sorted(glob.glob(pattern), key=op.getmtime, reverse=True)[:limit]
+    prompts = []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            prompts.append(json.load(f)["messages"])
+    return prompts
+
+
+def _run(model, prompts, max_tokens):
+    outputs, tokens, elapsed = [], 0, 0.0
+    for messages in prompts:
+        model.reset()
+        t0 = time.perf_counter()
+        out = model.create_chat_completion(
+            messages=messages, max_tokens=max_tokens,
+            temperature=0.0, top_k=1, repeat_penalty=1.0,
+        )
+        elapsed += time.perf_counter() - t0
+        tokens += out["usage"]["completion_tokens"]
+        outputs.append(out["choices"][0]["message"]["content"])
+    return outputs, tokens / elapsed if elapsed else 0.0
+
+
+def _first_diff(a, b):
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return None if len(a) == len(b) else min(len(a), len(b))
+
+
+def benchmark(n_prompts=5, max_tokens=400):
+    import ia.model as model_utils
+
+    prompts = recorded_prompts(n_prompts)
+    if not prompts:
+        raise RuntimeError(
+            f"aucun prompt d'anomalie enregistré dans {Config.rapport_llm_export} "
+            "(activer Config.LLM_RECORD_PROMPTS le temps de la collecte)"
+        )
+    if not Config.LLM_DRAFT_MODEL:
+        raise RuntimeError("Config.LLM_DRAFT_MODEL non renseigné")
+
+    # un seul 7B en mémoire à la fois
+    model = model_utils.llm(draft=False)
+    base_outputs, base_rate = _run(model, prompts, max_tokens)
+    del model
+
+    model = model_utils.llm(draft=True)
+    spec_outputs, spec_rate = _run(model, prompts, max_tokens)
+    del model
+
+    diffs = [_first_diff(a, b) for a, b in zip(base_outputs, spec_outputs)]
+    report = {
+        "prompts": len(prompts),
+        "draft_model": op.basename(Config.LLM_DRAFT_MODEL),
+        "draft_tokens": Config.LLM_DRAFT_TOKENS,
+        "tokens_per_s_base": round(base_rate, 2),
+        "tokens_per_s_speculative": round(spec_rate, 2),
+        "speedup": round(spec_rate / base_rate, 2) if base_rate else None,
+        "identical_outputs": sum(d is None for d in diffs),
+        "first_diff_chars": diffs,
+    }
+    print(report)
+    return report
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    max_new = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    benchmark(n, max_new)
@@ -0,0 +1,69 @@
+import re
+from functools import lru_cache
+
+# ============================================================
+# GRAMMAIRE GBNF : SOUS-ENSEMBLE SELECT DU SCHÉMA SQL
+# ============================================================
+# Construite depuis les CREATE TABLE de schema_db.sql : seuls les tables et
+# colonnes existantes sont générables, le modèle ne peut produire qu'une
+# requête SELECT complète terminée par ";" (fin de grammaire => génération
+# arrêtée). Plus de texte libre à découper ni de regex à la sortie.
+#
+# Sous-ensemble : SELECT [DISTINCT] colonnes / agrégats / * FROM table
+# [JOIN table ON col = col]* [WHERE cond (AND|OR cond)*] [GROUP BY]
+# [ORDER BY ... ASC|DESC] LIMIT n ;   + "SELECT NULL WHERE FALSE;" (demande impossible)
+
+_CREATE_TABLE = re.compile(r"CREATE TABLE\s+(?:\w+\.)?(\w+)\s*\((.*?)\n\);", re.DOTALL | re.IGNORECASE)
+_COLUMN = re.compile(r"^\s*\"?(\w+)\"?\s+\w", re.MULTILINE)
+_CONSTRAINT_WORDS = {"constraint", "primary", "foreign", "unique", "check"}
+
+
+def parse_schema(schema_text):
+    """
+    {table: [colonnes]} depuis un dump PostgreSQL (CREATE TABLE).
+    """
+    tables = {}
+    for name, body in _CREATE_TABLE.findall(schema_text):
+        columns = [c for c in _COLUMN.findall(body) if c.lower() not in _CONSTRAINT_WORDS]
+        if columns:
+            tables[name] = columns
+    return tables
+
+
+def _literals(words):
+    return " | ".join(f'"{w}"' for w in sorted(words, key=lambda w: (-len(w), w)))
+
+
+@lru_cache(maxsize=4)
+def build_gbnf(schema_text):
+    tables = parse_schema(schema_text)
+    if not tables:
+        raise ValueError("aucune table trouvée dans le schéma SQL")
+
+    all_columns = {c for cols in tables.values() for c in cols}
+    qualified = [f'"{t}." ({_literals(cols)})' for t, cols in sorted(tables.items())]
+
+    return "\n".join([
+        'root ::= "SELECT NULL WHERE FALSE;" | "SELECT " distinct? select-list " FROM " table join* where? group? order? " LIMIT " int ";"',
+        'distinct ::= "DISTINCT "',
+        'select-list ::= "*" | select-item (", " select-item)*',
+        'select-item ::= (agg | col) (" AS " ident)?',
+        'agg ::= ("COUNT" | "SUM" | "AVG" | "MIN" | "MAX") "(" ("*" | "DISTINCT " col | col) ")"',
+        f"table ::= {_literals(tables)}",
+        f"column ::= {_literals(all_columns)}",
+        "qualified ::= " + " | ".join(qualified),
+        "col ::= qualified | column",
+        'join ::= " " ("LEFT " | "INNER ")? "JOIN " table " ON " col " = " col',
+        'where ::= " WHERE " cond ((" AND " | " OR ") cond)*',
+        'cond ::= col " " cmp " " value | col " IS " "NOT "? "NULL" | col " IN (" value (", " value)* ")"'
+        ' | col " BETWEEN " value " AND " value | col " ILIKE " string',
+        'cmp ::= "=" | "!=" | "<>" | "<=" | ">=" | "<" | ">"',
+        'value ::= number | string | "TRUE" | "FALSE" | "NOW()" (" - INTERVAL " string)? | col',
+        'group ::= " GROUP BY " col (", " col)*',
+        'order ::= " ORDER BY " order-item (", " order-item)*',
+        'order-item ::= (agg | col) (" ASC" | " DESC")?',
+        "string ::= \"'\" [^'\\n;]* \"'\"",
+        'number ::= "-"? [0-9]+ ("." [0-9]+)?',
+        "int ::= [1-9] [0-9]*",
+        "ident ::= [a-z_] [a-z0-9_]*",
+    ])
@@ -3,14 +3,13 @@ from datetime import date, datetime
 from decimal import Decimal
 import uuid
 import psycopg2
-import torch
 from config import Config
 from transformers import Blip2Processor, Blip2ForConditionalGeneration
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from concurrent.futures import TimeoutError
+from ia import llm_scheduler, llm_stream, hf_batcher, sql_grammar
 import base64
 import ia.history_handler
 import  ia.web_search_handler
-import re
 import ia.generate_display_html
 import json
 
@@ -21,6 +20,49 @@ spring.datasource.password=root
 spring.datasource.driver-class-name=org.postgresql.Driver
 
 '''
+def build_sql_prompt(schema_text, query):
+    """
+    (prompt, préfixe statique) : rôle + schéma + consigne, jusqu'à la demande
+    utilisateur (état KV réutilisé entre requêtes, voir ia.prefix_cache).
+    """
+    prefix = f"""
+            RÔLE
+            Tu es un moteur déterministe de génération de requêtes SQL SELECT pour PostgreSQL.
+
+            CONTEXTE
+            Voici le schéma EXACT de la base de données (et uniquement celui-ci) :
+            {schema_text}
+
+            TÂCHE
+            Génère UNE SEULE requête SQL SELECT valide qui répond STRICTEMENT à la demande suivante :
+            """
+    prompt = prefix + query + """
+
+            CONTRAINTES OBLIGATOIRES (à respecter sans exception)
+            - La requête DOIT être compatible PostgreSQL
+            - La requête DOIT être un SELECT (aucun INSERT, UPDATE, DELETE, CREATE, DROP, WITH, CTE)
+            - La requête DOIT utiliser UNIQUEMENT les tables et colonnes présentes dans le schéma fourni
+            - La requête DOIT contenir une clause LIMIT 20
+            - La requête DOIT se terminer par UN SEUL point-virgule (;)
+            - AUCUNE sous-requête non nécessaire
+            - AUCUNE colonne, table ou alias inventé
+            - AUCUNE approximation sémantique
+
+            FORMAT DE SORTIE (critique)
+            - Retourne UNIQUEMENT le code SQL brut
+            - AUCUN texte explicatif
+            - AUCUN commentaire SQL
+            - AUCUNE mise en forme Markdown
+            - AUCUNE répétition
+            - AUCUNE phrase avant ou après
+
+            Si la demande est impossible à satisfaire STRICTEMENT avec le schéma fourni,
+            retourne EXACTEMENT :
+            SELECT NULL WHERE FALSE;
+            """
+    return prompt, prefix
+
+
 class Database:
 
     def __init__(self):
@@ -96,79 +138,49 @@ class Database:
         with open(schema_file, "r", encoding="utf-8", errors="ignore") as f:
             schema_text = f.read()
         
-        prompt = f"""
-            RÔLE
-            Tu es un moteur déterministe de génération de requêtes SQL SELECT pour PostgreSQL.
-
-            CONTEXTE
-            Voici le schéma EXACT de la base de données (et uniquement celui-ci) :
-            {schema_text}
-
-            TÂCHE
-            Génère UNE SEULE requête SQL SELECT valide qui répond STRICTEMENT à la demande suivante :
-            {query}
-
-            CONTRAINTES OBLIGATOIRES (à respecter sans exception)
-            - La requête DOIT être compatible PostgreSQL
-            - La requête DOIT être un SELECT (aucun INSERT, UPDATE, DELETE, CREATE, DROP, WITH, CTE)
-            - La requête DOIT utiliser UNIQUEMENT les tables et colonnes présentes dans le schéma fourni
-            - La requête DOIT contenir une clause LIMIT 20
-            - La requête DOIT se terminer par UN SEUL point-virgule (;)
-            - AUCUNE sous-requête non nécessaire
-            - AUCUNE colonne, table ou alias inventé
-            - AUCUNE approximation sémantique
+        prompt, prefix = build_sql_prompt(schema_text, query)
 
-            FORMAT DE SORTIE (critique)
-            - Retourne UNIQUEMENT le code SQL brut
-            - AUCUN texte explicatif
-            - AUCUN commentaire SQL
-            - AUCUNE mise en forme Markdown
-            - AUCUNE répétition
-            - AUCUNE phrase avant ou après
+        if tokenizer is None:
+            # modèle GGUF (llama.cpp) : schéma en cache KV, seul le suffixe est évalué ;
+            # sortie contrainte par la grammaire SELECT du schéma, arrêt au ";"
+            grammar = sql_grammar.build_gbnf(schema_text)
 
-            Si la demande est impossible à satisfaire STRICTEMENT avec le schéma fourni,
-            retourne EXACTEMENT :
-            SELECT NULL WHERE FALSE;
-            """
+            def run_generation(job):
+                return llm_stream.collect(llm_stream.stream_completion(
+                    model, prompt, job=job, prefix=prefix,
+                    max_tokens=Config.MAX_OUTPUT_TOKEN, temperature=0.0, top_k=1,
+                    grammar=grammar, stop=["<|end|>", ";"]
+                ))
 
-        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-        
-        def run_generation():
-            with torch.no_grad():
-                return model.generate(
-                    **inputs,
-                    max_new_tokens=Config.MAX_OUTPUT_TOKEN,
-                    do_sample=False                )
-
-        with ThreadPoolExecutor() as executor:
-            future = executor.submit(run_generation)
-            try:
-                output = future.result(timeout=Config.SERVER_TIMEOUT)  # timeout
-                # Décoder les tokens générés
-                decoded_text = tokenizer.decode(output[0], skip_special_tokens=True)
-
-                # On retire le prompt complet pour ne garder que la requête SQL
-                sql_query = decoded_text[len(prompt):].strip()
-                # Nettoyer les lignes qui commencent par '#' et les lignes vides
-                match = re.search(r"\bSELECT\b.*?;", sql_query, flags=re.IGNORECASE | re.DOTALL)
-                if match:
-                    sql_query_clean = match.group(0).strip()
-                    print("### Clean SQL:", sql_query_clean)                    
-                    # Exécuter la requête
-                    sql_data = json.dumps(self.query(sql_query_clean), indent=2, ensure_ascii=False)    
-                    print(f"### Generated DB DATA : {len(sql_data)} characters")
-                    return sql_data
-                     # Générer le HTML d'affichage
-                    '''
-                    html_template = generate_display_html.prompt_on_sql_data("none", query, sql_data, schema_text, model, tokenizer)
-                    html_template = html_template.replace("```", "")
-                    print("### Generated HTML:", html_template)
-                    return html_template
-                    '''
-                
-                else:
-                    print("⚠️ Aucun SELECT trouvé dans la sortie.")
-            except TimeoutError:
-                return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"   
+        try:
+            if tokenizer is None:
+                output = llm_scheduler.run(run_generation, priority="chat", name="sql")  # timeout
+            else:
+                # modèle HF (pas de grammaire) : décodé en batch avec les requêtes SQL concurrentes,
+                # arrêt au ";", texte avant le SELECT ignoré
+                output = hf_batcher.generate(model, tokenizer, prompt, max_new_tokens=Config.MAX_OUTPUT_TOKEN, stop=[";"], name="sql")
+                output = output[max(output.upper().find("SELECT"), 0):]
+            sql_query = output.strip().rstrip(";").strip()
+            if sql_query.upper().startswith("SELECT"):
+                sql_query_clean = sql_query + ";"
+                print("### Clean SQL:", sql_query_clean)                    
+                # Exécuter la requête
+                sql_data = json.dumps(self.query(sql_query_clean), indent=2, ensure_ascii=False)    
+                print(f"### Generated DB DATA : {len(sql_data)} characters")
+                return sql_data
+                 # Générer le HTML d'affichage
+                '''
+                html_template = generate_display_html.prompt_on_sql_data("none", query, sql_data, schema_text, model, tokenizer)
+                html_template = html_template.replace("```", "")
+                print("### Generated HTML:", html_template)
+                return html_template
+                '''
+            
+            else:
+                print("⚠️ Aucun SELECT trouvé dans la sortie.")
+        except TimeoutError:
+            return f"⏱️ La génération a dépassé le délai imparti ({Config.SERVER_TIMEOUT} sec)"
+        except llm_scheduler.QueueFull as e:
+            return str(e)   
                  
                 
@@ -1,9 +1,9 @@
 from duckduckgo_search import DDGS
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import util
 import torch
 import re
-from config import Config
 from ia.faiss.faiss_handler import apply_tfidf_sort
+from ia.faiss import index_registry
 
 
 def clean_text(t: str) -> str:
@@ -13,11 +13,9 @@ def clean_text(t: str) -> str:
     t = re.sub(r"\s+", " ", t).strip()
     return t
 
-from functools import lru_cache
-
-@lru_cache(maxsize=1)
 def get_embedder():
-    return SentenceTransformer(Config.RAG_MODEL)
+    # embedder partagé avec faiss_handler / history_handler (un seul par process)
+    return index_registry.get_embedder()
 
 
 def searchWeb(query, top_k=5, min_score=0.30, max_results=5):
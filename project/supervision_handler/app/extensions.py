@@ -7,16 +7,88 @@ socketio = SocketIO(
     async_mode="threading"
 )
 
-import ia.model as model_utils
+import time
+import threading
+import multiprocessing
+from config import Config
+
+# ============================================================
+# MODÈLE LLM CHARGÉ À LA DEMANDE
+# ============================================================
+# Importer ce module (factory, routes, simulateurs, /api/health...) ne charge
+# plus rien : `model` / `tokenizer` sont des proxys qui chargent le modèle au
+# premier usage réel (appel, attribut), ou en tâche de fond via warm_up().
+# ia.model (torch, transformers, llama_cpp) n'est importé qu'à ce moment-là.
+#
+# Config.LLM_SEPARATE_PROCESS : inférence dans un process à part
+# (ia.llm_pool, même avec 1 worker) ; le process API REST / WebSocket ne
+# mappe pas le GGUF et survit à un crash de llama.cpp (worker redémarré).
+
+
+class LazyModel:
+
+    def __init__(self, loader, name="model"):
+        self._loader = loader
+        self._name = name
+        self._model = None
+        self._lock = threading.Lock()
+        self.load_s = None
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    print(f" --- Loading {self._name}...")
+                    t0 = time.perf_counter()
+                    self._model = self._loader()
+                    self.load_s = round(time.perf_counter() - t0, 2)
+                    print(f"✅ {self._name} chargé en {self.load_s}s")
+        return self._model
+
+    def loaded(self):
+        return self._model is not None
+
+    def warm_up(self):
+        """
+        Chargement en tâche de fond : l'API répond pendant ce temps,
+        la première inférence attend la fin du chargement.
+        """
+        threading.Thread(target=self.get, name=f"warm-up-{self._name}", daemon=True).start()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
 
 def load_models():
-    global tokenizer, model
+    import ia.model as model_utils
+
     print(" --- Loading Models...")
     tokenizer = model_utils.load_tokenizer()
     model = model_utils.load_standard_model()
     return tokenizer, model
 
 def load_models_gguf():
+    if Config.INFERENCE_REMOTE:
+        # modèle du démon d'inférence (python -m ia.inference_service) : rien à charger ici
+        from ia import inference_service
+        return None, inference_service.client()
+
+    if Config.LLM_POOL_WORKERS > 1 or Config.LLM_SEPARATE_PROCESS:
+        if multiprocessing.parent_process() is not None:
+            # process worker du pool (ré-import du module principal par spawn) : il charge son propre modèle
+            return None, None
+        from ia.llm_pool import LlamaPool
+        return None, LlamaPool()
+
+    import ia.model as model_utils
     return None,  model_utils.llm()
 
-tokenizer, model = load_models_gguf() # load_models()
\ No newline at end of file
+tokenizer, model = None, LazyModel(lambda: load_models_gguf()[1], "GGUF") # load_models()
+# modèle HF :
+# _hf = LazyModel(load_models, "HF")
+# tokenizer, model = LazyModel(lambda: _hf.get()[0], "tokenizer"), LazyModel(lambda: _hf.get()[1], "model")
@@ -1,10 +1,14 @@
 import os
-from flask import Blueprint, jsonify, request, Response,send_file,abort
+from flask import Blueprint, jsonify, request, Response,send_file,abort, stream_with_context
 from flask_cors import CORS
-import ia.model as model_utils
 import ia.eval_gguf as eval
 from ia.sql_handler import Database
-from supervision_handler.app.extensions import tokenizer, model
+from ia.faiss import index_registry, embedding_cache, cross_encoder
+from ia.faiss.query_features import get_cache_stats
+from concurrent.futures import TimeoutError
+from ia import response_cache, llm_stream, llm_scheduler, prefix_cache, hf_batcher
+from config import Config
+from supervision_handler.app.extensions import tokenizer, model, socketio
 
 ia_api = Blueprint("ia_api", __name__, url_prefix="/ia_api")
 
@@ -70,9 +74,20 @@ def analyseAnomaly():
     if not isinstance(anomaly, dict):
         return jsonify({"error": "Invalid anomaly format, expected dict"}), 400
 
-    response_text = eval.eval_prompt_anomaly_gguf( systemPrompt, userPrompt, model, anomaly)
+    if not data.get("stream", Config.LLM_STREAM_ANOMALY):
+        response_text = eval.eval_prompt_anomaly_gguf( systemPrompt, userPrompt, model, anomaly)
+        return jsonify({"reply": response_text})
 
-    return jsonify({"reply": response_text})
+    # tokens poussés en direct sur Socket.IO ("anomalie_stream"), rapport complet en réponse HTTP
+    stats = llm_stream.new_stats()
+    response_text = eval.eval_prompt_anomaly_gguf(
+        systemPrompt, userPrompt, model, anomaly,
+        on_token=llm_stream.socketio_emitter(socketio, anomaly.get("id")),
+        stats=stats
+    )
+    socketio.emit("anomalie_stream", {"id": anomaly.get("id"), "status": "completed", **stats}, namespace="/")
+
+    return jsonify({"reply": response_text, "timing": stats})
 
 
 # === Routes ===
@@ -85,6 +100,33 @@ def generate_faiss_prompt():
     response_text = eval.faiss_search(user_ip, prompt, model, tokenizer)
     return jsonify({"reply": response_text})
 
+@ia_api.post("/generate/stream")
+def generate_faiss_prompt_stream():
+    """
+    Même réponse que /generate, en Server-Sent Events :
+    event "token" {"text"} par morceau, puis event "done" {ttft_ms, total_ms, tokens...}.
+    """
+    user_ip = get_user_ip(request)
+    data = request.get_json()
+    prompt = data.get("prompt", "")
+    print("prompt (stream) : " + prompt)
+
+    def events():
+        stats = llm_stream.new_stats()
+        try:
+            for text in eval.faiss_search(user_ip, prompt, model, tokenizer, stream=True, stats=stats):
+                yield llm_stream.sse_event("token", {"text": text})
+        except Exception as e:
+            yield llm_stream.sse_event("error", {"error": str(e)})
+            return
+        yield llm_stream.sse_event("done", stats)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @ia_api.post("/sql")
 def generate_sql_prompt():
     user_ip = get_user_ip(request)
@@ -95,6 +137,41 @@ def generate_sql_prompt():
     response_text = db.prompt_sql_query(user_ip, prompt, model, tokenizer)
     return Response(response_text, mimetype="text/plain")
 
+
+@ia_api.get("/rag/metrics")
+def rag_metrics():
+    return jsonify({
+        **index_registry.get_metrics(),
+        "query_embed_cache": get_cache_stats(),
+        "chunk_embed_cache": embedding_cache.get_cache().stats(),
+        "cross_encoder": cross_encoder.get_metrics(),
+        "response_cache": response_cache.get_metrics()
+    })
+
+
+@ia_api.get("/llm/metrics")
+def llm_metrics():
+    # file de l'ordonnanceur LLM : profondeur par priorité, attente, job en cours
+    # (ne déclenche pas le chargement du modèle)
+    return jsonify({
+        **llm_scheduler.get_metrics(),
+        "prefix_cache": prefix_cache.get_metrics(),
+        "hf_batcher": hf_batcher.get_metrics(),
+        "model_loaded": model.loaded(),
+        "model_load_s": model.load_s,
+        "pool": model.health() if model.loaded() and getattr(model, "pooled", False) else None
+    })
+
+
+@ia_api.errorhandler(llm_scheduler.QueueFull)
+def llm_queue_full(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@ia_api.errorhandler(TimeoutError)
+def llm_timeout(e):
+    return jsonify({"error": "⏱️ La génération a dépassé le délai imparti", "details": str(e)}), 504
+
         
 @ia_api.post("/prompt/image")
 def generate_image_prompt():
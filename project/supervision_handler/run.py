@@ -1,7 +1,7 @@
 from supervision_handler.app.factory import create_app
 from supervision_handler.app.ws import init_socketio
-import ia.model as model_utils
-from supervision_handler.app.extensions import  socketio
+from supervision_handler.app.extensions import  socketio, model
+from config import Config
 
 
 app = create_app()
@@ -14,6 +14,8 @@ def on_connect():
 
 if __name__ == "__main__":
     print("🚀 Démarrage serveur Flask + REST + SocketIO")
+    if Config.LLM_WARMUP:
+        model.warm_up() # l'API répond pendant le chargement du modèle
     socketio.run(app, host="0.0.0.0", port=5000, debug=True,use_reloader=False)
    
 
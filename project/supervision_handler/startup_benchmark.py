@@ -0,0 +1,56 @@
+import sys
+import json
+import subprocess
+
+# ============================================================
+# BENCHMARK DE DÉMARRAGE (supervision_handler)
+# ============================================================
+# python -m supervision_handler.startup_benchmark [runs]
+# Chaque mesure tourne dans un interpréteur neuf (imports à froid) :
+# - import_factory : ce que paient les simulateurs / services (factory)
+# - api_ready      : create_app() + premier GET /api/health
+# - model_loaded   : chargement du modèle (premier usage du proxy)
+# - first_token    : première inférence (1 token)
+# Avant le chargement à la demande, import_factory ~ model_loaded.
+
+PHASES = r"""
+import json, time
+t0 = time.perf_counter()
+out = {}
+import supervision_handler.app.factory
+out["import_factory_s"] = time.perf_counter() - t0
+from supervision_handler.app.factory import create_app
+app = create_app()
+assert app.test_client().get("/api/health").status_code == 200
+out["api_ready_s"] = time.perf_counter() - t0
+if WITH_MODEL:
+    from supervision_handler.app.extensions import model
+    model.get()
+    out["model_loaded_s"] = time.perf_counter() - t0
+    model("Bonjour", max_tokens=1)
+    out["first_token_s"] = time.perf_counter() - t0
+print("BENCH " + json.dumps(out))
+"""
+
+
+def _run_once(with_model):
+    code = f"WITH_MODEL = {with_model}\n" + PHASES
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCH "):
+            return json.loads(line[len("BENCH "):])
+    raise RuntimeError(f"benchmark de démarrage en échec :\n{proc.stderr[-2000:]}")
+
+
+def benchmark(runs=3, with_model=True):
+    samples = [_run_once(with_model) for _ in range(runs)]
+    report = {}
+    for key in samples[0]:
+        values = sorted(s[key] for s in samples)
+        report[key] = round(values[len(values) // 2], 2)
+    return report
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(benchmark(runs))
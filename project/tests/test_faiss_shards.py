@@ -0,0 +1,94 @@
+import zlib
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("sklearn")
+pytest.importorskip("sentence_transformers")
+
+from config import Config
+from ia.faiss import faiss_handler, chunk_store, source_index, bm25_index
+
+
+class HashEmbedder:
+    """
+    Embedder déterministe (sac de mots hashés) : pas de modèle à charger.
+    """
+
+    dim = 64
+
+    def encode(self, texts, convert_to_numpy=True, **kwargs):
+        single = isinstance(texts, str)
+        out = np.zeros((1 if single else len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(out, [texts] if single else texts):
+            for tok in text.lower().split():
+                row[zlib.crc32(tok.encode("utf-8")) % self.dim] += 1.0
+            row /= np.linalg.norm(row) + 1e-8
+        return out
+
+
+def _shard(tmp_path, key, chunks, source, embedder):
+    store_dir = tmp_path / key
+    chunk_store.create_store(str(store_dir), chunks, [{"source": source} for _ in chunks])
+    store = chunk_store.open_store(str(store_dir))
+
+    vecs = faiss_handler.project_to_1024(embedder.encode(chunks)).copy()
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(faiss_handler.DIM))
+    index.add_with_ids(vecs, np.arange(len(chunks), dtype=np.int64))
+    return store.texts, store.metadata, embedder, index
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    # projection 64 → 1024 persistée dans tmp_path, pas à côté des vrais index
+    monkeypatch.setattr(Config, "INDEX_FAISS", str(tmp_path))
+    embedder = HashEmbedder()
+    parts = {
+        "general__factures": _shard(tmp_path, "general__factures", [
+            "facture presse hydraulique montant total",
+            "facture client maintenance annuelle",
+        ], "factures/facture_presse_2024.pdf", embedder),
+        # aucune source du shard ne contient "facture" ni "presse"
+        "general__industrie": _shard(tmp_path, "general__industrie", [
+            "réglage du vérin de la ligne 2",
+            "nettoyage du convoyeur",
+        ], "industrie/maintenance_ligne.pdf", embedder),
+    }
+
+    monkeypatch.setattr(Config, "RAG_MIN_SCORE", 0.0)
+    monkeypatch.setattr(Config, "RAG_CROSS_ENCODER", None)
+    monkeypatch.setattr(faiss_handler.index_registry, "get_embedder", lambda: embedder)
+    monkeypatch.setattr(faiss_handler, "index_keys", lambda workflow, families=None: list(parts))
+    monkeypatch.setattr(faiss_handler, "load_faiss_index", lambda key: parts[key])
+    monkeypatch.setattr(faiss_handler, "load_source_index",
+                        lambda key, metadata=None: source_index.build_source_index(metadata))
+    monkeypatch.setattr(faiss_handler, "load_bm25",
+                        lambda key, chunks=None, strict=True: bm25_index.build_bm25_index(chunks))
+    return parts
+
+
+def test_metadata_fallback_is_2d():
+    embedder = HashEmbedder()
+    vec = embedder.encode("facture presse")[0]
+    sidx = source_index.build_source_index([{"source": "industrie/maintenance_ligne.pdf"}])
+    out = faiss_handler.augment_query_with_metadata(vec, "facture presse", [], embedder, sidx=sidx)
+    assert out.shape == (1, embedder.dim)
+
+
+def test_sharded_query_with_unmatched_shard(sharded):
+    results = faiss_handler.retrieve("", "facture presse", top_k=4)
+
+    assert len(results) == 4
+    assert {key for key, _ in results.chunk_ids()} == set(sharded)
+    assert "facture presse" in results[0]["text"]
+
+
+def test_sharded_query_with_emptied_shard(sharded):
+    # tous les documents du shard supprimés en place : tombstones dans le store, ntotal = 0
+    index = sharded["general__industrie"][3]
+    index.remove_ids(np.arange(index.ntotal, dtype=np.int64))
+
+    results = faiss_handler.retrieve("", "facture presse", top_k=4)
+
+    assert {key for key, _ in results.chunk_ids()} == {"general__factures"}
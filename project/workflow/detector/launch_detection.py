@@ -18,7 +18,6 @@ from workflow.detector.predicat_handler import compute_prediction
 from supervision_handler.app.service.anomalie_service import update_anomaly
 from supervision_handler.app.extensions import tokenizer, model
 from config import Config
-import ia.model as model_utils
 from workflow.detector.feature_handler import fetch_events_df
 import json 
 from sqlalchemy.inspection import inspect
@@ -1,19 +1,17 @@
 from typing import Dict, List, Optional
-import torch
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import json
 from threading import Thread
 from transformers import TextIteratorStreamer
 import os.path as op
 import os
 import sys
-from ia.generate_repport import repportLLM
+from ia.generate_repport import repportLLM, save_prompt
 from config import Config
 
 from supervision_handler.app.factory import socketio
 from ia.faiss.faiss_handler import retrieve
+from ia import llm_stream, llm_scheduler, hf_batcher
 
-llm_executor = ThreadPoolExecutor(max_workers=1)
 
 def reduce_workflow(workflow: Dict, anomaly: Dict) -> Dict:
     """
@@ -304,11 +302,15 @@ def eval_prompt_anomaly_gguf(system_prompt: str,user_prompt:str, model, anomalie
     f"dephasage workflow"
 )
     
-    retrieved = retrieve(user_ip="none", query = query, workeflow = True)
+    # documentation machines uniquement (shard workflow__documentation_machines)
+    retrieved = retrieve(user_ip="none", query=query, workflow=True, families=Config.ANOMALY_RAG_FAMILIES)
 
+    # documentation propre à l'anomalie dans le message utilisateur : le message
+    # système reste fixe, son état KV est réutilisé d'une anomalie à l'autre (cache_prefix)
+    rag_context = ""
     if  retrieved:
-        system_prompt += (
-            "\n\nVoici la documentation machine disponible. "
+        rag_context = (
+            "Voici la documentation machine disponible. "
             "Analyse les causes possibles ainsi que les solutions techniques "
             "compatibles avec l'incident survenu.\n\n"
             + "\n\n".join([
@@ -319,10 +321,11 @@ def eval_prompt_anomaly_gguf(system_prompt: str,user_prompt:str, model, anomalie
                 f"Score: {round(r.get('score', 0), 3)}"
                 for r in retrieved
             ])
+            + "\n\n"
         )
 
     
-    output = model.create_chat_completion(
+    params = dict(
         messages=[
             {
                 "role": "system",
@@ -330,16 +333,23 @@ def eval_prompt_anomaly_gguf(system_prompt: str,user_prompt:str, model, anomalie
             },
             {
                 "role": "user",
-                "content": user_prompt
+                "content": rag_context + user_prompt
             }
         ],
         temperature=0.7,
         max_tokens=1200,
         repeat_penalty=1.10
     )
+    save_prompt(params["messages"], anomalie)
 
-    # ✅ BON ACCÈS AU TEXTE
-    result = output["choices"][0]["message"]["content"].strip()
+    stats = llm_stream.new_stats()
+    # tokens poussés en direct au front (Socket.IO "anomalie_stream")
+    on_token = llm_stream.socketio_emitter(socketio, anomalie.get("id")) if Config.LLM_STREAM_ANOMALY else None
+    # anomalie live : priorité maximale dans l'ordonnanceur LLM
+    result = llm_scheduler.run(
+        lambda job: llm_stream.collect(llm_stream.stream_chat(model, stats=stats, job=job, cache_prefix=True, **params), on_token),
+        priority="anomaly", name="anomaly_live"
+    ).strip()
 
     # 🔒 fallback intelligent
     if not result :
@@ -349,7 +359,8 @@ def eval_prompt_anomaly_gguf(system_prompt: str,user_prompt:str, model, anomalie
             "Un contrôle de la remontée des durées et des événements PLC est requis."
         )
 
-    socketio.emit("anomalie", {"status": "completed"}, namespace="/")
+    socketio.emit("anomalie", {"status": "completed", "id": anomalie.get("id"),
+                               "ttft_ms": stats["ttft_ms"], "total_ms": stats["total_ms"]}, namespace="/")
     
     print(result)
     return repportLLM(result, anomalie, user_prompt)
@@ -357,27 +368,14 @@ def eval_prompt_anomaly_gguf(system_prompt: str,user_prompt:str, model, anomalie
 
 
 def eval_prompt_anomaly(prompt, model, tokenizer, anomalie):
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-
-    with torch.no_grad():
-        output = model.generate(
-            **inputs,
-            max_new_tokens=350,
-            do_sample=False,           # 🔒 plus d'aléatoire
-            temperature=0.0,           # 🔒
-            repetition_penalty=1.05,
-            no_repeat_ngram_size=4,
-            eos_token_id=tokenizer.eos_token_id,
-            pad_token_id=tokenizer.eos_token_id,
-        )
-
-    decoded = tokenizer.decode(output[0], skip_special_tokens=True)
-
-    # ✅ retire le prompt si le modèle l'a recopié
-    if decoded.startswith(prompt):
-        result = decoded[len(prompt):].strip()
-    else:
-        result = decoded.strip()
+    # décodé en batch avec les autres générations HF (greedy, arrêt sur eos)
+    result = hf_batcher.generate(
+        model, tokenizer, prompt,
+        max_new_tokens=350,
+        repetition_penalty=1.05,
+        no_repeat_ngram_size=4,
+        priority="anomaly", name="anomaly_hf",
+    )
 
     socketio.emit("anomalie", {"status": "completed"}, namespace="/")
     repportLLM(result, anomalie, prompt)  # (tu avais oublié prompt dans repportLLM)
@@ -527,28 +525,16 @@ FORMAT STRICT DE SORTIE
 
 def eval_prompt_trs(prompt, model, tokenizer, anomalie, period=None):
 
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
     print(prompt)
-    with torch.no_grad():
-        output = model.generate(
-            **inputs,
-            max_new_tokens=350,
-            do_sample=False,        # 🔒 CRITIQUE
-            temperature=0.0,        # 🔒 CRITIQUE
-            repetition_penalty=1.05,
-            no_repeat_ngram_size=4,
-            eos_token_id=tokenizer.eos_token_id,
-            pad_token_id=tokenizer.eos_token_id
-        )
-
-
-    decoded = tokenizer.decode(output[0], skip_special_tokens=True)
 
-    # 🔑 découpe robuste
-    if decoded.startswith(prompt):
-        result = decoded[len(prompt):].strip()
-    else:
-        result = decoded.strip()
+    # rapport TRS journalier : priorité la plus basse
+    result = hf_batcher.generate(
+        model, tokenizer, prompt,
+        max_new_tokens=350,
+        repetition_penalty=1.05,
+        no_repeat_ngram_size=4,
+        priority="trs", name="trs_hf",
+    )
 
     print("RESULT TRS LLM :\n", result)
 